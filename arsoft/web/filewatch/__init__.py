@@ -1,3 +1,5 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 # kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+default_app_config = 'arsoft.web.filewatch.apps.FileWatchConfig'
@@ -3,18 +3,122 @@
 # kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
 
 from django.contrib import admin
+from django.conf import settings
+from django.conf.urls import url
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.db import transaction
 from django import forms
-from arsoft.web.filewatch.models import FileWatchModel
+from django.utils.http import urlencode
+from arsoft.web.filewatch.models import FileWatchModel, FileWatchItemModel
+from arsoft.web.filewatch.browse import FileQuery, FILE_COLUMNS, page_files, iter_files, count_files
+
+import csv
 
 class FileWatchForm(forms.ModelForm):
     class Meta:
         model = FileWatchModel
-        fields = ['filename', 'recursive', 'notify']
+        fields = ['filename', 'host', 'recursive', 'notify', 'checksum', 'include', 'exclude', 'check_interval', 'priority']
 
 class FileWatchAdmin(admin.ModelAdmin):
 
-    list_display = ('filename', 'recursive', 'notify')
-    fields = ['filename', 'recursive', 'notify']
+    list_display = ('filename', 'host', 'recursive', 'notify', 'checksum', 'check_interval', 'priority', 'last_check')
+    fields = ['filename', 'host', 'recursive', 'notify', 'checksum', 'include', 'exclude', 'check_interval', 'priority']
     form = FileWatchForm
 
+class FileFilterForm(forms.Form):
+    watch = forms.ModelChoiceField(queryset=FileWatchModel.objects.order_by('filename'), required=False, empty_label='all')
+    path = forms.CharField(required=False, help_text='path prefix')
+    uid = forms.IntegerField(required=False, min_value=0, label='Owner (uid)')
+    size_min = forms.IntegerField(required=False, min_value=0, label='Min. size')
+    size_max = forms.IntegerField(required=False, min_value=0, label='Max. size')
+
+    def query(self):
+        data = self.cleaned_data
+        return FileQuery(item=data['watch'], prefix=data['path'] or None, uid=data['uid'],
+                         size_min=data['size_min'], size_max=data['size_max'])
+
+class _Echo(object):
+    # the csv writer writes each row to this file, which hands it back
+    def write(self, value):
+        return value
+
+class FileWatchItemAdmin(admin.ModelAdmin):
+    """
+    Read only list of the tracked files. The stock change list counts all
+    rows and pages with OFFSET, which does not work for millions of files;
+    this one pages by (watch item, filename), counts only once in a while
+    and exports the selected files as streamed CSV file. The entries are
+    not editable, because the checks keep them in sync with the disk.
+    """
+    readonly_fields = ('watchid',) + FILE_COLUMNS[1:]
+    fields = readonly_fields
+
+    def get_urls(self):
+        info = (self.model._meta.app_label, self.model._meta.model_name)
+        return [
+            url(r'^export/$', self.admin_site.admin_view(self.export_view), name='%s_%s_export' % info),
+            ] + super(FileWatchItemAdmin, self).get_urls()
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def _filter_form(self, request):
+        form = FileFilterForm(request.GET)
+        return form if form.is_valid() else None
+
+    def changelist_view(self, request, extra_context=None):
+        form = self._filter_form(request)
+        query = form.query() if form is not None else FileQuery()
+        after = before = None
+        try:
+            if 'after_watch' in request.GET:
+                after = (int(request.GET['after_watch']), request.GET.get('after', ''))
+            elif 'before_watch' in request.GET:
+                before = (int(request.GET['before_watch']), request.GET.get('before', ''))
+        except ValueError:
+            pass
+        (rows, has_previous, has_next) = page_files(query, after=after, before=before, page_size=settings.ADMIN_FILES_PER_PAGE)
+        (num_files, exact) = count_files(query)
+        filters = dict([ (name, value) for (name, value) in request.GET.items()
+                            if name in FileFilterForm.base_fields and value ])
+        previous_url = next_url = None
+        if rows and has_previous:
+            previous_url = '?' + urlencode(dict(filters, before_watch=rows[0][1], before=rows[0][2]))
+        if rows and has_next:
+            next_url = '?' + urlencode(dict(filters, after_watch=rows[-1][1], after=rows[-1][2]))
+        watches = dict(FileWatchModel.objects.values_list('id', 'filename'))
+        context = dict(self.admin_site.each_context(request),
+                       title='Tracked files',
+                       opts=self.model._meta,
+                       form=form if form is not None else FileFilterForm(),
+                       rows=[ (pk, watches.get(watchid), values) for (pk, watchid, *values) in rows ],
+                       columns=FILE_COLUMNS[1:],
+                       num_files=num_files,
+                       num_files_exact=exact,
+                       previous_url=previous_url,
+                       next_url=next_url,
+                       export_url='export/?' + urlencode(filters),
+                       )
+        context.update(extra_context or {})
+        return TemplateResponse(request, 'files.html', context)
+
+    @transaction.non_atomic_requests
+    def export_view(self, request):
+        form = self._filter_form(request)
+        query = form.query() if form is not None else FileQuery()
+        watches = dict(FileWatchModel.objects.values_list('id', 'filename'))
+        writer = csv.writer(_Echo())
+        def rows():
+            yield writer.writerow(('watch',) + FILE_COLUMNS[1:])
+            for row in iter_files(query):
+                yield writer.writerow((watches.get(row[0]),) + row[1:])
+        response = StreamingHttpResponse(rows(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="filewatch-files.csv"'
+        return response
+
 admin.site.register(FileWatchModel, FileWatchAdmin)
+admin.site.register(FileWatchItemModel, FileWatchItemAdmin)
@@ -0,0 +1,272 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+#
+# The agent scans watch items on other hosts than the one running the web
+# server. It does not need Django: the configuration of a watch item is
+# fetched from /agent/<item>, the files are compared against a baseline
+# kept by the agent and only the changes are sent back to the same URL,
+# compressed and in batches. Each request is signed with a key shared
+# with the server (AGENT_KEYS in the settings of the server).
+
+from arsoft.web.filewatch.scan import FileWalker, FileWatchItemFromDisk, PathFilter, parse_patterns
+from arsoft.web.filewatch.compare import merge_files, detect_moves, Change, \
+    FILE_ADDED, FILE_CHANGED, FILE_UNCHANGED, FILE_DELETED, FILE_UPDATED, FILE_MOVED
+from arsoft.web.filewatch.hashing import FileHasher
+from arsoft.web.filewatch.baseline import BaselineItem, BaselineReader, BaselineWriter, write_baseline, merge_delta
+
+import os
+import json
+import time
+import zlib
+import hmac
+import uuid
+import hashlib
+import urllib.request
+import urllib.error
+
+HEADER_HOST = 'X-Filewatch-Host'
+HEADER_TIME = 'X-Filewatch-Time'
+HEADER_SIGNATURE = 'X-Filewatch-Signature'
+HEADER_NONCE = 'X-Filewatch-Nonce'
+DELTA_CONTENT_TYPE = 'application/x-filewatch-delta'
+
+# number of changed files sent with one request
+AGENT_BATCH_SIZE = 5000
+
+class AgentError(Exception):
+    pass
+
+class AgentConflict(AgentError):
+    """
+    Raised when the server refuses changes which do not match the files it
+    stored for the item.
+    """
+    pass
+
+def sign_request(key, method, item_id, host, timestamp, nonce, body):
+    """
+    Returns the signature of a request to /agent/<item_id>: the HMAC-SHA256
+    with the shared key over the method, the item, the host, the time, the
+    nonce (used only once) and the hash of the body.
+    """
+    message = '\n'.join([ method, str(item_id), host, str(timestamp), nonce, hashlib.sha256(body).hexdigest() ])
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def encode_delta(payload):
+    return zlib.compress(json.dumps(payload).encode('utf-8'))
+
+def decode_delta(data, max_size):
+    """
+    Returns the payload of a compressed delta. Raises ValueError if it is
+    invalid or larger than max_size bytes when decompressed.
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(data, max_size)
+    except zlib.error as e:
+        raise ValueError('invalid delta: %s' % e)
+    if decompressor.unconsumed_tail:
+        raise ValueError('delta larger than %i bytes' % max_size)
+    try:
+        ret = json.loads(data.decode('utf-8'))
+    except ValueError as e:
+        raise ValueError('invalid delta: %s' % e)
+    if not isinstance(ret, dict):
+        raise ValueError('invalid delta: not an object')
+    return ret
+
+def entry_values(item):
+    """
+    Returns the values of a file entry (a FileWatchItemFromDisk or
+    BaselineItem) as sent in a delta.
+    """
+    entry = BaselineItem.from_item(item)
+    return [ entry.filename, entry.ctime_ns, entry.mtime_ns, entry.uid, entry.gid, entry.mode, entry.size,
+             entry.inode, entry.device, entry.checksum ]
+
+def entry_from_values(values):
+    return BaselineItem(*values)
+
+def change_values(changes):
+    return [ [ getattr(change, 'kind', ''), str(change), getattr(change, 'old', None), getattr(change, 'new', None) ] for change in changes ]
+
+def changes_from_values(values):
+    return [ Change(kind, message, old, new) for (kind, message, old, new) in values ]
+
+class ScanAgent(object):
+    """
+    Checks watch items on the local host and sends the changes to the
+    server at server_url (the URL of the filewatch application). The
+    baseline of each item is kept in state_dir; without a current one all
+    files are sent and replace those stored on the server.
+    """
+    def __init__(self, server_url, host, key, state_dir, batch_size=AGENT_BATCH_SIZE, scan_workers=4, hash_workers=4,
+                 max_delta=100000, notify=True, timeout=60, output=None):
+        self.server_url = server_url.rstrip('/')
+        self.host = host
+        self._key = key
+        self.state_dir = state_dir
+        self.batch_size = batch_size
+        self.scan_workers = scan_workers
+        self.hash_workers = hash_workers
+        self.max_delta = max_delta
+        self.notify = notify
+        self.timeout = timeout
+        self._output = output
+
+    def _write(self, line):
+        if self._output is not None:
+            self._output(line)
+
+    def _request(self, method, item_id, payload=None):
+        body = encode_delta(payload) if payload is not None else b''
+        timestamp = int(time.time())
+        request = urllib.request.Request('%s/agent/%i' % (self.server_url, item_id), data=body if payload is not None else None, method=method)
+        request.add_header(HEADER_HOST, self.host)
+        nonce = uuid.uuid4().hex
+        request.add_header(HEADER_TIME, str(timestamp))
+        request.add_header(HEADER_NONCE, nonce)
+        request.add_header(HEADER_SIGNATURE, sign_request(self._key, method, item_id, self.host, timestamp, nonce, body))
+        if payload is not None:
+            request.add_header('Content-Type', DELTA_CONTENT_TYPE)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            if e.code == 409:
+                raise AgentConflict('%s %s/agent/%i failed: %i %s' % (method, self.server_url, item_id, e.code, e.read().decode('utf-8', 'replace').strip()))
+            raise AgentError('%s %s/agent/%i failed: %i %s' % (method, self.server_url, item_id, e.code, e.read().decode('utf-8', 'replace').strip()))
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise AgentError('%s %s/agent/%i failed: %s' % (method, self.server_url, item_id, e))
+
+    def baseline_filename(self, item_id):
+        return os.path.join(self.state_dir, '%i.fwb' % item_id)
+
+    def _open_baseline(self, item_id, revision):
+        try:
+            reader = BaselineReader(self.baseline_filename(item_id))
+        except (IOError, OSError, ValueError):
+            return None
+        if reader.item_id != item_id or reader.revision != revision:
+            reader.close()
+            return None
+        return reader
+
+    def _files_on_disk(self, config, path_filter):
+        root = config['filename']
+        if not os.path.exists(root):
+            return []
+        elif os.path.isdir(root) and config['recursive']:
+            walker = FileWalker(path_filter=path_filter)
+            return walker.walk_parallel(root, self.scan_workers, walker.root_dev(root))
+        else:
+            return [ FileWatchItemFromDisk(root, os.stat(root)) ]
+
+    def _send(self, item_id, revision, changes, reset, run_id, final=False, status=None):
+        payload = { 'revision': revision, 'reset': reset, 'run': run_id, 'changes': changes, 'final': final }
+        if final:
+            payload['status'] = status
+            payload['notify'] = self.notify
+        return self._request('POST', item_id, payload)['revision']
+
+    def check(self, item_id):
+        """
+        Checks the given watch item and returns the number of changed files.
+        Raises AgentError if the server cannot be reached or refuses the
+        changes; the local baseline is kept then, so the next check sends
+        the changes again. When the changes do not match the files on the
+        server (AgentConflict) the baseline is dropped instead, so the next
+        check sends all files.
+        """
+        started = time.time()
+        config = self._request('GET', item_id)
+        revision = config['revision']
+        path_filter = None
+        if config['recursive'] and (config['include'] or config['exclude']):
+            path_filter = PathFilter(config['filename'], include=parse_patterns(config['include']), exclude=parse_patterns(config['exclude']))
+        reader = self._open_baseline(item_id, revision)
+        reset = reader is None
+        # without the baseline the changes since the last check are not
+        # known, so the stored files are only replaced; only the first
+        # check of an item reports all files as added
+        resync = reset and revision > 0
+        if reset:
+            self._write('agent: %s no baseline for revision %i, sending all files' % (config['filename'], revision))
+        results = merge_files(self._files_on_disk(config, path_filter), reader if reader is not None else [])
+        if config['checksum']:
+            results = FileHasher(config['checksum'], self.hash_workers).process(results)
+        new_baseline = None
+        delta = None
+        if reset:
+            # nothing is held back without deleted files, so the files
+            # arrive sorted and are written to the new baseline directly
+            new_baseline = BaselineWriter(self.baseline_filename(item_id), item_id, revision)
+        else:
+            results = detect_moves(results, self.max_delta)
+            delta = {}
+        run_id = uuid.uuid4().hex
+        batch = []
+        status = { 'num_files': 0, 'total_size': 0, FILE_ADDED: 0, FILE_CHANGED: 0, FILE_MOVED: 0, FILE_DELETED: 0 }
+        num_changed = 0
+        try:
+            for (state, disk_item, db_item, changes) in results:
+                if disk_item is not None:
+                    status['num_files'] += 1
+                    status['total_size'] += disk_item.size
+                if new_baseline is not None and disk_item is not None:
+                    new_baseline.add(BaselineItem.from_item(disk_item))
+                if state == FILE_UNCHANGED:
+                    continue
+                if state == FILE_DELETED:
+                    record = { 'state': state, 'filename': db_item.filename }
+                else:
+                    if disk_item.checksum is None and db_item is not None:
+                        disk_item.checksum = db_item.checksum
+                    record = { 'state': state, 'entry': entry_values(disk_item) }
+                    if state == FILE_MOVED:
+                        record['old_filename'] = db_item.filename
+                if state != FILE_UPDATED and not resync:
+                    record['changes'] = change_values(changes)
+                    status[state] += 1
+                    num_changed += 1
+                    self._write('agent: %s: file %s %s' % (config['filename'], disk_item.filename if disk_item is not None else db_item.filename, state))
+                if delta is not None:
+                    if state == FILE_MOVED:
+                        delta[db_item.filename] = None
+                    delta[record.get('filename') or record['entry'][0]] = entry_from_values(record['entry']) if 'entry' in record else None
+                    if len(delta) > self.max_delta:
+                        # the next check starts from scratch
+                        delta = None
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    revision = self._send(item_id, revision, batch, reset, run_id)
+                    reset = False
+                    batch = []
+            status['duration'] = time.time() - started
+            revision = self._send(item_id, revision, batch, reset, run_id, final=True, status=status)
+        except BaseException as e:
+            if new_baseline is not None:
+                new_baseline.abort()
+            if reader is not None:
+                reader.close()
+            if isinstance(e, AgentConflict):
+                try:
+                    os.unlink(self.baseline_filename(item_id))
+                except OSError:
+                    pass
+            raise
+        if new_baseline is not None:
+            new_baseline.revision = revision
+            new_baseline.close()
+        elif delta is not None:
+            write_baseline(self.baseline_filename(item_id), item_id, revision, merge_delta(reader, delta))
+        else:
+            try:
+                os.unlink(self.baseline_filename(item_id))
+            except OSError:
+                pass
+        if reader is not None:
+            reader.close()
+        self._write('agent: %s %i files, %i changed, revision %i' % (config['filename'], status['num_files'], num_changed, revision))
+        return num_changed
@@ -0,0 +1,29 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+
+def enable_sqlite_wal(sender, connection, **kwargs):
+    # with the write-ahead log readers (e.g. the dashboard) are not blocked
+    # by a check writing the files and the other way round
+    if connection.vendor == 'sqlite' and settings.DATABASE_SQLITE_WAL:
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.close()
+
+def clear_dashboard(sender, **kwargs):
+    from arsoft.web.filewatch.status import invalidate_dashboard
+    invalidate_dashboard()
+
+class FileWatchConfig(AppConfig):
+    name = 'arsoft.web.filewatch'
+
+    def ready(self):
+        connection_created.connect(enable_sqlite_wal, dispatch_uid='filewatch-sqlite-wal')
+        item_model = self.get_model('FileWatchModel')
+        post_save.connect(clear_dashboard, sender=item_model, dispatch_uid='filewatch-dashboard-save')
+        post_delete.connect(clear_dashboard, sender=item_model, dispatch_uid='filewatch-dashboard-delete')
@@ -0,0 +1,332 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from arsoft.timestamp import utc_timestamp_to_datetime
+from arsoft.web.filewatch.scan import ns_to_timestamp
+from arsoft.web.filewatch.compare import merge_files, FILE_CHANGED, Change, CHANGE_CHECKSUM
+from arsoft.web.filewatch.hashing import checksum_algorithm
+
+import os
+import mmap
+import zlib
+import struct
+from bisect import bisect_right
+
+# A baseline file holds the file entries of a watch item sorted by
+# filename. The entries are grouped into blocks, which are compressed
+# separately:
+#
+#   header  magic, item id, revision of the item
+#   blocks  zlib compressed records, each a filename (sharing its prefix
+#           with the previous one of the block) and the attributes
+#   index   offset, size and number of records of each block plus the
+#           filename of its first record
+#   footer  offset of the index, number of records and blocks, magic
+#
+# The file is memory-mapped and only the index is read when it is opened;
+# the blocks are decompressed while iterating, so a range of files (a
+# subtree) can be read without touching the other blocks.
+BASELINE_MAGIC = b'FWBASE02'
+BASELINE_INDEX_MAGIC = b'FWINDEX1'
+# number of records per block
+BASELINE_BLOCK_SIZE = 1024
+
+_HEADER = struct.Struct('<8sQQ')
+_FOOTER = struct.Struct('<QQQ8s')
+_INDEX_ENTRY = struct.Struct('<QII')
+_NAME = struct.Struct('<HH')
+# ctime_ns, mtime_ns, uid, gid, mode, size, inode, device, length of the
+# checksum
+_RECORD = struct.Struct('<qqIIIqQQB')
+
+def _encode(filename):
+    return filename.encode('utf-8', 'surrogateescape')
+
+def _decode(data):
+    return data.decode('utf-8', 'surrogateescape')
+
+class BaselineItem(object):
+    """
+    A file entry read from a baseline. It provides the attributes of a
+    FileWatchItemModel used by the comparison, but has no primary key;
+    FileWatchItemWriter updates and deletes it by its filename.
+    """
+    __slots__ = ('filename', 'ctime_ns', 'mtime_ns', 'uid', 'gid', 'mode', 'size', 'inode', 'device', 'checksum')
+
+    pk = None
+
+    def __init__(self, filename, ctime_ns, mtime_ns, uid, gid, mode, size, inode, device, checksum):
+        self.filename = filename
+        self.ctime_ns = ctime_ns
+        self.mtime_ns = mtime_ns
+        self.uid = uid
+        self.gid = gid
+        self.mode = mode
+        self.size = size
+        self.inode = inode
+        self.device = device
+        self.checksum = checksum
+
+    @staticmethod
+    def from_item(item):
+        """
+        Returns the entry for a FileWatchItemModel, BaselineItem or
+        FileWatchItemFromDisk.
+        """
+        if hasattr(item, 'inode'):
+            (inode, device) = (item.inode, item.device)
+        else:
+            (inode, device) = (item.ino, item.dev)
+        return BaselineItem(item.filename, item.ctime_ns, item.mtime_ns, item.uid, item.gid, item.mode, item.size,
+                            inode if inode else None, device if device else None, item.checksum if item.checksum else '')
+
+    # so a baseline can be compared against another one like a disk
+    @property
+    def ino(self):
+        return self.inode if self.inode else 0
+
+    @property
+    def dev(self):
+        return self.device if self.device else 0
+
+    @property
+    def created(self):
+        return utc_timestamp_to_datetime(ns_to_timestamp(self.ctime_ns))
+
+    @property
+    def modified(self):
+        return utc_timestamp_to_datetime(ns_to_timestamp(self.mtime_ns))
+
+class BaselineWriter(object):
+    """
+    Writes a baseline file. The entries must be added sorted by filename.
+    The file is written under a temporary name and only replaces an
+    existing baseline when it is closed. The header is written last, so
+    revision may still be changed before.
+    """
+    def __init__(self, filename, item_id, revision, block_size=BASELINE_BLOCK_SIZE):
+        self.filename = filename
+        self._tmpname = filename + '.tmp'
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.item_id = item_id
+        self.revision = revision
+        self._f = open(self._tmpname, 'wb')
+        self._f.write(b'\0' * _HEADER.size)
+        self._block_size = block_size
+        self._block = []
+        self._block_first = None
+        self._previous = None
+        self._previous_name = None
+        self._index = []
+        self.num_records = 0
+
+    def add(self, item):
+        # the same order as the comparison expects
+        if self._previous_name is not None and item.filename <= self._previous_name:
+            raise ValueError('files not sorted by filename: %s after %s' % (item.filename, self._previous_name))
+        name = _encode(item.filename)
+        if not self._block:
+            self._block_first = name
+            shared = 0
+        else:
+            shared = len(os.path.commonprefix([ self._previous, name ]))
+        checksum = item.checksum.encode('ascii') if item.checksum else b''
+        self._block.append(_NAME.pack(shared, len(name) - shared))
+        self._block.append(name[shared:])
+        self._block.append(_RECORD.pack(item.ctime_ns, item.mtime_ns, item.uid, item.gid, item.mode, item.size,
+                                        item.inode if item.inode else 0, item.device if item.device else 0, len(checksum)))
+        self._block.append(checksum)
+        self._previous = name
+        self._previous_name = item.filename
+        self.num_records += 1
+        if len(self._block) >= self._block_size * 4:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        data = zlib.compress(b''.join(self._block))
+        self._index.append( (self._f.tell(), len(data), len(self._block) // 4, self._block_first) )
+        self._f.write(data)
+        self._block = []
+
+    def close(self):
+        self._flush_block()
+        index_offset = self._f.tell()
+        self._f.write(BASELINE_INDEX_MAGIC)
+        for (offset, size, count, first) in self._index:
+            self._f.write(_INDEX_ENTRY.pack(offset, size, count))
+            self._f.write(struct.pack('<H', len(first)))
+            self._f.write(first)
+        self._f.write(_FOOTER.pack(index_offset, self.num_records, len(self._index), BASELINE_MAGIC))
+        self._f.seek(0)
+        self._f.write(_HEADER.pack(BASELINE_MAGIC, self.item_id, self.revision))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        os.rename(self._tmpname, self.filename)
+
+    def abort(self):
+        self._f.close()
+        try:
+            os.unlink(self._tmpname)
+        except OSError:
+            pass
+
+class BaselineReader(object):
+    """
+    Reads a baseline file written by BaselineWriter. Raises ValueError if
+    the file is not a valid baseline.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._f = open(filename, 'rb')
+        try:
+            size = os.fstat(self._f.fileno()).st_size
+            if size < _HEADER.size + _FOOTER.size:
+                raise ValueError('%s is not a baseline' % filename)
+            self._map = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            (magic, self.item_id, self.revision) = _HEADER.unpack_from(self._map, 0)
+            (index_offset, self.num_records, num_blocks, end_magic) = _FOOTER.unpack_from(self._map, size - _FOOTER.size)
+            if magic != BASELINE_MAGIC or end_magic != BASELINE_MAGIC or \
+                    self._map[index_offset:index_offset + len(BASELINE_INDEX_MAGIC)] != BASELINE_INDEX_MAGIC:
+                raise ValueError('%s is not a baseline' % filename)
+            self._blocks = []
+            self._firsts = []
+            pos = index_offset + len(BASELINE_INDEX_MAGIC)
+            for i in range(num_blocks):
+                (offset, length, count) = _INDEX_ENTRY.unpack_from(self._map, pos)
+                pos += _INDEX_ENTRY.size
+                (name_len,) = struct.unpack_from('<H', self._map, pos)
+                pos += 2
+                self._blocks.append( (offset, length, count) )
+                self._firsts.append(_decode(self._map[pos:pos + name_len]))
+                pos += name_len
+        except (ValueError, struct.error, mmap.error):
+            self.close()
+            raise ValueError('%s is not a baseline' % filename)
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read_block(self, i):
+        (offset, length, count) = self._blocks[i]
+        data = zlib.decompress(self._map[offset:offset + length])
+        pos = 0
+        previous = b''
+        for n in range(count):
+            (shared, suffix_len) = _NAME.unpack_from(data, pos)
+            pos += _NAME.size
+            name = previous[:shared] + data[pos:pos + suffix_len]
+            pos += suffix_len
+            (ctime_ns, mtime_ns, uid, gid, mode, size, inode, device, checksum_len) = _RECORD.unpack_from(data, pos)
+            pos += _RECORD.size
+            checksum = data[pos:pos + checksum_len].decode('ascii')
+            pos += checksum_len
+            previous = name
+            yield BaselineItem(_decode(name), ctime_ns, mtime_ns, uid, gid, mode, size, inode if inode else None,
+                               device if device else None, checksum)
+
+    def iter_items(self, start=None, end=None):
+        """
+        Yields the entries sorted by filename, starting at the first one
+        not less than start and stopping before end.
+        """
+        first_block = max(0, bisect_right(self._firsts, start) - 1) if start is not None else 0
+        for i in range(first_block, len(self._blocks)):
+            if end is not None and self._firsts[i] >= end:
+                return
+            for item in self._read_block(i):
+                if start is not None and item.filename < start:
+                    continue
+                if end is not None and item.filename >= end:
+                    return
+                yield item
+
+    def __iter__(self):
+        return self.iter_items()
+
+    def iter_subtree(self, subtree):
+        prefix = os.path.join(subtree, '')
+        return self.iter_items(prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+    def lookup(self, filename):
+        """
+        Returns the entry of the given file or None.
+        """
+        i = bisect_right(self._firsts, filename) - 1
+        if i < 0:
+            return None
+        for item in self._read_block(i):
+            if item.filename == filename:
+                return item
+        return None
+
+def write_baseline(filename, item_id, revision, items):
+    """
+    Writes the given entries (sorted by filename) as baseline file and
+    returns the number of entries.
+    """
+    writer = BaselineWriter(filename, item_id, revision)
+    try:
+        for entry in items:
+            writer.add(entry)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return writer.num_records
+
+def merge_delta(entries, delta):
+    """
+    Yields the entries (sorted by filename) with the changes in delta (a
+    dict of filename to the new BaselineItem or None for a deleted file)
+    applied.
+    """
+    changed = iter(sorted(delta.items()))
+    pending = next(changed, None)
+    for entry in entries:
+        while pending is not None and pending[0] < entry.filename:
+            if pending[1] is not None:
+                yield pending[1]
+            pending = next(changed, None)
+        if pending is not None and pending[0] == entry.filename:
+            if pending[1] is not None:
+                yield pending[1]
+            pending = next(changed, None)
+        else:
+            yield entry
+    while pending is not None:
+        if pending[1] is not None:
+            yield pending[1]
+        pending = next(changed, None)
+
+def diff_baselines(old, new):
+    """
+    Compares two baselines like a check compares the files on disk against
+    the database, with new taking the place of the disk. The checksums are
+    compared when both entries have one of the same algorithm. Yields the
+    same tuples as merge_files.
+    """
+    for (state, new_item, old_item, changes) in merge_files(new, old):
+        if new_item is not None and old_item is not None and new_item.checksum and \
+                checksum_algorithm(new_item.checksum) == checksum_algorithm(old_item.checksum) and \
+                new_item.checksum != old_item.checksum:
+            changes.append( Change(CHANGE_CHECKSUM, 'Checksum changed from %s to %s' % (old_item.checksum, new_item.checksum),
+                                   old_item.checksum, new_item.checksum) )
+            state = FILE_CHANGED
+        yield (state, new_item, old_item, changes)
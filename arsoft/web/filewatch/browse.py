@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from arsoft.web.filewatch.models import FileWatchItemModel
+from arsoft.web.filewatch.persist import open_baseline
+
+import hashlib
+
+# columns of the file list and the CSV export
+FILE_COLUMNS = ('watchid', 'filename', 'size', 'uid', 'gid', 'mode', 'mtime_ns', 'ctime_ns', 'inode', 'device', 'checksum')
+
+class FileQuery(object):
+    """
+    The filters of the file list: watch item, path prefix, owner and size
+    range. Filters which are None are not applied.
+    """
+    def __init__(self, item=None, prefix=None, uid=None, size_min=None, size_max=None):
+        self.item = item
+        self.prefix = prefix
+        self.uid = uid
+        self.size_min = size_min
+        self.size_max = size_max
+
+    @property
+    def is_item_only(self):
+        return self.prefix is None and self.uid is None and self.size_min is None and self.size_max is None
+
+    def queryset(self):
+        qs = FileWatchItemModel.objects.all()
+        if self.item is not None:
+            qs = qs.filter(watchid=self.item)
+        if self.prefix:
+            # a range instead of startswith, so the index can be used
+            qs = qs.filter(filename__gte=self.prefix, filename__lt=self.prefix[:-1] + chr(ord(self.prefix[-1]) + 1))
+        if self.uid is not None:
+            qs = qs.filter(uid=self.uid)
+        if self.size_min is not None:
+            qs = qs.filter(size__gte=self.size_min)
+        if self.size_max is not None:
+            qs = qs.filter(size__lte=self.size_max)
+        return qs
+
+    def cache_key(self):
+        key = repr((self.item.id if self.item is not None else None, self.prefix, self.uid, self.size_min, self.size_max))
+        return 'filewatch-count-%s' % hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+def _after(qs, key):
+    (watchid, filename) = key
+    return qs.filter(Q(watchid__gt=watchid) | Q(watchid=watchid, filename__gt=filename))
+
+def _before(qs, key):
+    (watchid, filename) = key
+    return qs.filter(Q(watchid__lt=watchid) | Q(watchid=watchid, filename__lt=filename))
+
+def page_files(query, after=None, before=None, page_size=100):
+    """
+    Returns one page of files matching query, ordered by watch item and
+    filename, as tuple (rows, has_previous, has_next). The page starts
+    after the key (watchid, filename) after or ends before the key before,
+    so no page needs an OFFSET and all pages are equally fast. Each row is
+    a tuple of the pk and the FILE_COLUMNS.
+    """
+    qs = query.queryset().values_list('pk', *FILE_COLUMNS)
+    if before is not None:
+        rows = list(_before(qs, before).order_by('-watchid', '-filename')[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        return (rows, has_previous, True)
+    if after is not None:
+        qs = _after(qs, after)
+    rows = list(qs.order_by('watchid', 'filename')[:page_size + 1])
+    return (rows[:page_size], after is not None, len(rows) > page_size)
+
+def iter_files(query, batch_size=None):
+    """
+    Yields all files matching query as tuples of the FILE_COLUMNS, fetched
+    in batches of batch_size rows like page_files, so only one batch is
+    kept in memory.
+    """
+    if not batch_size:
+        batch_size = settings.CHECK_DB_FETCH_SIZE
+    qs = query.queryset().values_list(*FILE_COLUMNS).order_by('watchid', 'filename')
+    key = None
+    while True:
+        batch = list((_after(qs, key) if key is not None else qs)[:batch_size])
+        for row in batch:
+            yield row
+        if len(batch) < batch_size:
+            break
+        key = (batch[-1][0], batch[-1][1])
+
+def count_files(query):
+    """
+    Returns the tuple (number of files matching query, exact). Without
+    other filters than the watch item the number is taken from a current
+    baseline; otherwise the number counted by the database is cached for
+    ADMIN_COUNT_CACHE_TIMEOUT seconds, so it may be slightly off.
+    """
+    if query.item is not None and query.is_item_only:
+        reader = open_baseline(query.item)
+        if reader is not None:
+            try:
+                return (reader.num_records, True)
+            finally:
+                reader.close()
+    key = query.cache_key()
+    ret = cache.get(key)
+    if ret is not None:
+        return (ret, False)
+    ret = query.queryset().count()
+    cache.set(key, ret, settings.ADMIN_COUNT_CACHE_TIMEOUT)
+    return (ret, True)
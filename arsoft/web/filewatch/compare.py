@@ -0,0 +1,218 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from arsoft.timestamp import as_local_time
+from arsoft.web.filewatch.scan import SkippedDirectory, ns_to_us
+from collections import OrderedDict
+import os
+
+FILE_ADDED = 'added'
+FILE_CHANGED = 'changed'
+FILE_UNCHANGED = 'unchanged'
+FILE_DELETED = 'deleted'
+# the file did not change, but additional data (like the checksum) has
+# been stored for it
+FILE_UPDATED = 'updated'
+# a file deleted in one place was found in another one (by its device and
+# inode); disk_item has the new and db_item the old name
+FILE_MOVED = 'moved'
+
+# kinds of changes of a single file
+CHANGE_ADDED = 'added'
+CHANGE_DELETED = 'deleted'
+CHANGE_CTIME = 'ctime'
+CHANGE_MTIME = 'mtime'
+CHANGE_OWNER = 'owner'
+CHANGE_GROUP = 'group'
+CHANGE_MODE = 'mode'
+CHANGE_SIZE = 'size'
+CHANGE_CHECKSUM = 'checksum'
+CHANGE_MOVED = 'moved'
+
+CHANGE_CHOICES = (
+    (CHANGE_ADDED, 'Added'),
+    (CHANGE_DELETED, 'Deleted'),
+    (CHANGE_CTIME, 'Create time'),
+    (CHANGE_MTIME, 'Modification time'),
+    (CHANGE_OWNER, 'Owner'),
+    (CHANGE_GROUP, 'Group'),
+    (CHANGE_MODE, 'Mode'),
+    (CHANGE_SIZE, 'Size'),
+    (CHANGE_CHECKSUM, 'Checksum'),
+    (CHANGE_MOVED, 'Moved'),
+    )
+
+class Change(str):
+    """
+    A change message, which knows the kind of the change (one of the
+    CHANGE_* constants) so reports can group the changes, and the old and
+    new value as stored in the change history.
+    """
+    def __new__(cls, kind, message, old=None, new=None):
+        ret = str.__new__(cls, message)
+        ret.kind = kind
+        ret.old = old
+        ret.new = new
+        return ret
+
+    def __reduce__(self):
+        return (Change, (self.kind, str(self), self.old, self.new))
+
+ADDED_CHANGE = Change(CHANGE_ADDED, 'File added')
+DELETED_CHANGE = Change(CHANGE_DELETED, 'File deleted')
+
+def timestamp_changed(disk_ns, db_ns):
+    """
+    Returns whether the timestamp of a file on disk differs from the one
+    stored in the database. Timestamps converted from the former datetime
+    columns only have a resolution of microseconds, so these are compared
+    after rounding the timestamp on disk like the conversion did.
+    """
+    if disk_ns == db_ns:
+        return False
+    if db_ns % 1000 == 0:
+        return ns_to_us(disk_ns) != db_ns // 1000
+    return True
+
+def get_changes(disk_item, db_item):
+    """
+    Compares the attributes of the given file on disk with the database
+    entry, updates the database entry (without saving it) and returns the
+    list of change messages.
+    """
+    changes = []
+    if timestamp_changed(disk_item.ctime_ns, db_item.ctime_ns):
+        changes.append( Change(CHANGE_CTIME, 'Create time changed from %s to %s' % (as_local_time(db_item.created), as_local_time(disk_item.created)),
+                               str(db_item.ctime_ns), str(disk_item.ctime_ns)) )
+        db_item.ctime_ns = disk_item.ctime_ns
+    if timestamp_changed(disk_item.mtime_ns, db_item.mtime_ns):
+        changes.append( Change(CHANGE_MTIME, 'Modification time changed from %s to %s' % (as_local_time(db_item.modified), as_local_time(disk_item.modified)),
+                               str(db_item.mtime_ns), str(disk_item.mtime_ns)) )
+        db_item.mtime_ns = disk_item.mtime_ns
+    if disk_item.uid != db_item.uid:
+        changes.append( Change(CHANGE_OWNER, 'Owner changed from %i to %i' % (db_item.uid, disk_item.uid), str(db_item.uid), str(disk_item.uid)) )
+        db_item.uid = disk_item.uid
+    if disk_item.gid != db_item.gid:
+        changes.append( Change(CHANGE_GROUP, 'Group changed from %i to %i' % (db_item.gid, disk_item.gid), str(db_item.gid), str(disk_item.gid)) )
+        db_item.gid = disk_item.gid
+    if disk_item.mode != db_item.mode:
+        changes.append( Change(CHANGE_MODE, 'Mode changed from %o to %o' % (db_item.mode, disk_item.mode), '%o' % db_item.mode, '%o' % disk_item.mode) )
+        db_item.mode = disk_item.mode
+    if disk_item.size != db_item.size:
+        changes.append( Change(CHANGE_SIZE, 'Size changed from %o to %o' % (db_item.size, disk_item.size), str(db_item.size), str(disk_item.size)) )
+        db_item.size = disk_item.size
+    return changes
+
+def _next_sorted(it, previous):
+    item = next(it, None)
+    if item is not None and previous is not None and item.filename < previous.filename:
+        raise ValueError('files not sorted by filename: %s after %s' % (item.filename, previous.filename))
+    return item
+
+def merge_files(files_on_disk, files_in_db):
+    """
+    Compares the files found on disk against the files stored in the
+    database. Both sequences must be sorted by filename in the order of the
+    code points, like Python compares strings; they are merged in a single
+    pass and ValueError is raised if they are not sorted. Neither sequence
+    is kept in memory, so they can be streamed from the disk walker and a
+    database cursor (see iter_files_in_db, which does not rely on the
+    collation of the database).
+
+    The files in the database which are directly inside of a directory
+    marked as SkippedDirectory by the walker are reported as unchanged
+    without a disk_item.
+    """
+    disk_iter = iter(files_on_disk)
+    db_iter = iter(files_in_db)
+    disk_item = _next_sorted(disk_iter, None)
+    db_item = _next_sorted(db_iter, None)
+    skipped_dirs = set()
+    while disk_item is not None or db_item is not None:
+        if db_item is None or (disk_item is not None and disk_item.filename < db_item.filename):
+            if isinstance(disk_item, SkippedDirectory):
+                skipped_dirs.add(disk_item.filename)
+            else:
+                yield (FILE_ADDED, disk_item, None, [ADDED_CHANGE])
+            disk_item = _next_sorted(disk_iter, disk_item)
+        elif disk_item is None or db_item.filename < disk_item.filename:
+            if os.path.join(os.path.dirname(db_item.filename), '') in skipped_dirs:
+                yield (FILE_UNCHANGED, None, db_item, [])
+            else:
+                yield (FILE_DELETED, None, db_item, [DELETED_CHANGE])
+            db_item = _next_sorted(db_iter, db_item)
+        else:
+            changes = get_changes(disk_item, db_item)
+            if changes:
+                yield (FILE_CHANGED, disk_item, db_item, changes)
+            else:
+                yield (FILE_UNCHANGED, disk_item, db_item, [])
+            disk_item = _next_sorted(disk_iter, disk_item)
+            db_item = _next_sorted(db_iter, db_item)
+
+def _inode_key(dev, ino):
+    return (dev, ino) if dev and ino else None
+
+def _is_move(disk_item, db_item):
+    # inodes are reused, so the content must not have changed either
+    return disk_item.size == db_item.size and disk_item.mtime_ns == db_item.mtime_ns
+
+def _move(disk_item, db_item):
+    changes = [ Change(CHANGE_MOVED, 'File moved from %s' % db_item.filename, db_item.filename, disk_item.filename) ]
+    changes.extend(get_changes(disk_item, db_item))
+    if disk_item.checksum:
+        db_item.checksum = disk_item.checksum
+    return (FILE_MOVED, disk_item, db_item, changes)
+
+def detect_moves(results, max_pending=None):
+    """
+    Takes the results of merge_files (or FileHasher.process) and reports a
+    deleted and an added file with the same device and inode, size and
+    modification time as a single FILE_MOVED result. The unmatched added
+    and deleted files are held back until their counterpart shows up, at
+    most max_pending of each kind; the oldest ones are passed on when there
+    are more. All other results are passed on as they are, but the stored
+    device and inode are brought up to date, which turns an unchanged file
+    into FILE_UPDATED if they differ.
+    """
+    added = OrderedDict()
+    deleted = OrderedDict()
+    for (state, disk_item, db_item, changes) in results:
+        if state == FILE_ADDED:
+            key = _inode_key(disk_item.dev, disk_item.ino)
+            db_match = deleted.get(key) if key is not None else None
+            if db_match is not None and _is_move(disk_item, db_match[2]):
+                del deleted[key]
+                yield _move(disk_item, db_match[2])
+            elif key is None or key in added:
+                # a hard link of a file added in the same check
+                yield (state, disk_item, db_item, changes)
+            else:
+                added[key] = (state, disk_item, db_item, changes)
+                if max_pending is not None and len(added) > max_pending:
+                    yield added.popitem(last=False)[1]
+        elif state == FILE_DELETED:
+            key = _inode_key(db_item.device, db_item.inode)
+            disk_match = added.get(key) if key is not None else None
+            if disk_match is not None and _is_move(disk_match[1], db_item):
+                del added[key]
+                yield _move(disk_match[1], db_item)
+            elif key is None or key in deleted:
+                yield (state, disk_item, db_item, changes)
+            else:
+                deleted[key] = (state, disk_item, db_item, changes)
+                if max_pending is not None and len(deleted) > max_pending:
+                    yield deleted.popitem(last=False)[1]
+        else:
+            if disk_item is not None and db_item is not None and \
+                    (db_item.inode != disk_item.ino or db_item.device != disk_item.dev):
+                db_item.inode = disk_item.ino
+                db_item.device = disk_item.dev
+                if state == FILE_UNCHANGED:
+                    state = FILE_UPDATED
+            yield (state, disk_item, db_item, changes)
+    for result in added.values():
+        yield result
+    for result in deleted.values():
+        yield result
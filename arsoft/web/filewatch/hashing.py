@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from arsoft.web.filewatch.compare import FILE_ADDED, FILE_CHANGED, FILE_UNCHANGED, FILE_UPDATED, Change, CHANGE_CHECKSUM
+
+CHECKSUM_NONE = ''
+CHECKSUM_SHA256 = 'sha256'
+CHECKSUM_SHA512 = 'sha512'
+# only available with Python 3.6 or newer
+CHECKSUM_BLAKE2B = 'blake2b'
+
+CHECKSUM_CHOICES = (
+    (CHECKSUM_NONE, 'None'),
+    (CHECKSUM_SHA256, 'SHA-256'),
+    (CHECKSUM_SHA512, 'SHA-512'),
+    (CHECKSUM_BLAKE2B, 'BLAKE2b'),
+    )
+
+# number of bytes read from a file at once
+HASH_CHUNK_SIZE = 1024 * 1024
+# number of files a worker may hash ahead of the comparison
+HASH_QUEUE_SIZE = 64
+
+def checksum_algorithm(checksum):
+    """
+    Returns the name of the algorithm of a stored checksum, which has the
+    format <algorithm>:<hex digest>.
+    """
+    return checksum.split(':', 1)[0] if checksum else CHECKSUM_NONE
+
+class FileHasher(object):
+    """
+    Calculates the checksums of the files reported by merge_files using a
+    pool of worker threads; hashlib releases the GIL while hashing, so the
+    workers run in parallel. A file is only hashed when it is new, its
+    attributes (including the inode) changed or the stored checksum uses
+    another algorithm. Since the ctime cannot be set from user space, a
+    modified content always causes a new checksum, even when the size and
+    modification time have been restored.
+    """
+    def __init__(self, algorithm, workers, chunk_size=HASH_CHUNK_SIZE, queue_size=HASH_QUEUE_SIZE, io_budget=None):
+        # raises ValueError for an unsupported algorithm
+        hashlib.new(algorithm)
+        self.algorithm = algorithm
+        self._workers = workers
+        self._chunk_size = chunk_size
+        self._queue_size = max(queue_size, workers)
+        self._lock = threading.Lock()
+        # limits the number of bytes read per second
+        self._io_budget = io_budget
+        self.errors = []
+        self.num_hashed = 0
+        self.num_cached = 0
+        self.bytes_hashed = 0
+        # time spent hashing, summed over all workers
+        self.elapsed = 0.0
+
+    @property
+    def megabytes_per_second(self):
+        return self.bytes_hashed / self.elapsed / 1048576.0 if self.elapsed > 0 else 0.0
+
+    def hash_file(self, filename):
+        """
+        Returns the checksum of the given file or None if it cannot be read.
+        """
+        start = time.time()
+        h = hashlib.new(self.algorithm)
+        buf = bytearray(self._chunk_size)
+        view = memoryview(buf)
+        num_bytes = 0
+        waited = 0.0
+        try:
+            with open(filename, 'rb', buffering=0) as f:
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    h.update(view[:n])
+                    num_bytes += n
+                    if self._io_budget is not None:
+                        waited += self._io_budget.consume(n)
+        except (IOError, OSError) as e:
+            with self._lock:
+                self.errors.append( (filename, e.strerror if e.strerror else str(e)) )
+            return None
+        elapsed = time.time() - start - waited
+        with self._lock:
+            self.num_hashed += 1
+            self.bytes_hashed += num_bytes
+            self.elapsed += elapsed
+        return '%s:%s' % (self.algorithm, h.hexdigest())
+
+    def _needs_hash(self, state, disk_item, db_item):
+        if state == FILE_ADDED or state == FILE_CHANGED:
+            return True
+        return checksum_algorithm(db_item.checksum) != self.algorithm or db_item.inode != disk_item.ino
+
+    def _apply(self, state, disk_item, db_item, changes, future):
+        if future is None:
+            return (state, disk_item, db_item, changes)
+        checksum = future.result()
+        if checksum is None:
+            # the file could not be read, so drop the stored checksum to
+            # hash it again by the next check
+            if db_item is not None and db_item.checksum:
+                db_item.checksum = ''
+                if state == FILE_UNCHANGED:
+                    state = FILE_UPDATED
+            return (state, disk_item, db_item, changes)
+        disk_item.checksum = checksum
+        if db_item is None:
+            return (state, disk_item, db_item, changes)
+        old_checksum = db_item.checksum
+        if state == FILE_UNCHANGED:
+            state = FILE_UPDATED
+        if checksum_algorithm(old_checksum) == self.algorithm and old_checksum != checksum:
+            changes.append( Change(CHANGE_CHECKSUM, 'Checksum changed from %s to %s' % (old_checksum, checksum), old_checksum, checksum) )
+            state = FILE_CHANGED
+        db_item.checksum = checksum
+        db_item.inode = disk_item.ino
+        return (state, disk_item, db_item, changes)
+
+    def process(self, results):
+        """
+        Takes the results of merge_files and yields them in the same order
+        with the checksums applied. Files whose content changed are
+        reported as FILE_CHANGED; unchanged files which only got a new
+        checksum or inode stored are reported as FILE_UPDATED.
+        """
+        executor = ThreadPoolExecutor(max_workers=self._workers)
+        pending = deque()
+        try:
+            for (state, disk_item, db_item, changes) in results:
+                if disk_item is not None and self._needs_hash(state, disk_item, db_item):
+                    future = executor.submit(self.hash_file, disk_item.filename)
+                else:
+                    if disk_item is not None:
+                        self.num_cached += 1
+                    future = None
+                pending.append( (state, disk_item, db_item, changes, future) )
+                while len(pending) > self._queue_size or (pending and (pending[0][4] is None or pending[0][4].done())):
+                    (state, disk_item, db_item, changes, future) = pending.popleft()
+                    yield self._apply(state, disk_item, db_item, changes, future)
+            while pending:
+                (state, disk_item, db_item, changes, future) = pending.popleft()
+                yield self._apply(state, disk_item, db_item, changes, future)
+        finally:
+            for entry in pending:
+                if entry[4] is not None:
+                    entry[4].cancel()
+            executor.shutdown(wait=True)
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, F
+from django.utils import timezone
+from arsoft.web.filewatch.models import FileWatchEventModel, FileWatchEventSummaryModel
+from arsoft.web.filewatch.compare import Change, CHANGE_CHOICES, CHANGE_ADDED, CHANGE_DELETED, CHANGE_MOVED, ADDED_CHANGE, DELETED_CHANGE
+
+import uuid
+from datetime import datetime, timedelta
+
+# import the logging library
+import logging
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+def new_run_id():
+    """
+    Returns a new identifier for the change events of a check.
+    """
+    return uuid.uuid4().hex
+
+def query_events(item=None, filename=None, since=None, until=None, run_id=None):
+    """
+    Returns the change events matching all given criteria, ordered by time.
+    A filename ending with a separator selects all files below that
+    directory.
+    """
+    qs = FileWatchEventModel.objects.all()
+    if item is not None:
+        qs = qs.filter(watchid=item)
+    if filename:
+        if filename.endswith('/'):
+            qs = qs.filter(filename__startswith=filename)
+        else:
+            qs = qs.filter(filename=filename)
+    if since is not None:
+        qs = qs.filter(time__gte=since)
+    if until is not None:
+        qs = qs.filter(time__lt=until)
+    if run_id:
+        qs = qs.filter(run_id=run_id)
+    return qs.order_by('time', 'id')
+
+def event_change(event):
+    """
+    Returns the change recorded by the given event.
+    """
+    if event.kind == CHANGE_ADDED:
+        return ADDED_CHANGE
+    elif event.kind == CHANGE_DELETED:
+        return DELETED_CHANGE
+    elif event.kind == CHANGE_MOVED:
+        return Change(event.kind, 'File moved from %s' % event.old_value, event.old_value, event.new_value)
+    label = dict(CHANGE_CHOICES).get(event.kind, event.kind)
+    return Change(event.kind, '%s changed from %s to %s' % (label, event.old_value, event.new_value), event.old_value, event.new_value)
+
+def query_summaries(item=None, since=None, until=None):
+    """
+    Returns the daily summaries of the compacted change events.
+    """
+    qs = FileWatchEventSummaryModel.objects.all()
+    if item is not None:
+        qs = qs.filter(watchid=item)
+    if since is not None:
+        qs = qs.filter(day__gte=since)
+    if until is not None:
+        qs = qs.filter(day__lt=until)
+    return qs.order_by('day', 'watchid', 'kind')
+
+def _start_of_day(dt):
+    dt = dt.astimezone(timezone.utc)
+    return datetime(dt.year, dt.month, dt.day, tzinfo=timezone.utc)
+
+def _compact_day(start):
+    end = start + timedelta(days=1)
+    qs = FileWatchEventModel.objects.filter(time__gte=start, time__lt=end)
+    num_events = 0
+    with transaction.atomic():
+        for row in qs.values('watchid', 'kind').annotate(num_events=Count('id'), num_files=Count('filename', distinct=True)).order_by():
+            # a day is normally compacted at once; if not, the number of
+            # files may count a file twice
+            updated = FileWatchEventSummaryModel.objects.filter(watchid_id=row['watchid'], day=start.date(), kind=row['kind']).update(
+                num_events=F('num_events') + row['num_events'], num_files=F('num_files') + row['num_files'])
+            if not updated:
+                FileWatchEventSummaryModel.objects.create(watchid_id=row['watchid'], day=start.date(), kind=row['kind'],
+                                                          num_events=row['num_events'], num_files=row['num_files'])
+            num_events += row['num_events']
+        qs.delete()
+    return num_events
+
+def compact_events(retention_days=None, summary_retention_days=None, now=None):
+    """
+    Rolls the change events older than retention_days (EVENT_RETENTION_DAYS)
+    up into daily summaries per watch item and kind of change and removes
+    them. Only complete days (in UTC) are compacted, each one in a single
+    transaction. Summaries older than summary_retention_days
+    (EVENT_SUMMARY_RETENTION_DAYS) are removed; 0 keeps them forever.
+    Returns the tuple (number of compacted events, number of removed
+    summaries).
+    """
+    if retention_days is None:
+        retention_days = settings.EVENT_RETENTION_DAYS
+    if summary_retention_days is None:
+        summary_retention_days = settings.EVENT_SUMMARY_RETENTION_DAYS
+    if now is None:
+        now = timezone.now()
+    num_events = 0
+    num_summaries = 0
+    if retention_days > 0:
+        cutoff = _start_of_day(now - timedelta(days=retention_days))
+        oldest = FileWatchEventModel.objects.filter(time__lt=cutoff).aggregate(oldest=Min('time'))['oldest']
+        while oldest is not None:
+            start = _start_of_day(oldest)
+            num_events += _compact_day(start)
+            # skip the days without events
+            oldest = FileWatchEventModel.objects.filter(time__gte=start + timedelta(days=1), time__lt=cutoff).aggregate(oldest=Min('time'))['oldest']
+    if summary_retention_days > 0:
+        day = (now - timedelta(days=summary_retention_days)).date()
+        qs = FileWatchEventSummaryModel.objects.filter(day__lt=day)
+        num_summaries = qs.count()
+        qs.delete()
+    if num_events or num_summaries:
+        logger.info('Compacted %i change events, removed %i summaries' % (num_events, num_summaries))
+    return (num_events, num_summaries)
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from arsoft.web.filewatch.models import FileWatchModel, FileWatchItemModel, FileWatchAgentNonceModel
+from arsoft.web.filewatch.scan import FileWatchItemFromDisk
+from arsoft.web.filewatch.persist import FileWatchItemWriter, RevisionConflict
+from arsoft.web.filewatch.compare import FILE_ADDED, FILE_CHANGED, FILE_DELETED, FILE_UPDATED, FILE_MOVED
+from arsoft.web.filewatch.baseline import BaselineItem
+from arsoft.web.filewatch.status import StatusCounter, save_status
+from arsoft.web.filewatch.agent import HEADER_HOST, HEADER_TIME, HEADER_SIGNATURE, HEADER_NONCE, sign_request, \
+    entry_from_values, changes_from_values
+
+import re
+import hmac
+import time
+from datetime import timedelta
+
+_RUN_ID = re.compile(r'^[0-9a-f]{1,32}$')
+_NONCE = re.compile(r'^[0-9a-f]{16,32}$')
+
+class AgentAuthError(Exception):
+    pass
+
+def _header(request, name):
+    return request.META.get('HTTP_' + name.upper().replace('-', '_'), '')
+
+def verify_request(request, item):
+    """
+    Checks the signature of a request of an agent for the given watch item
+    and returns the name of its host. Raises AgentAuthError if the host has
+    no key, is not the host of the item, the time is off by more than
+    AGENT_MAX_CLOCK_SKEW seconds, the signature does not match or the nonce
+    of the request has been used before.
+    """
+    host = _header(request, HEADER_HOST)
+    key = settings.AGENT_KEYS.get(host) if host else None
+    if not key:
+        raise AgentAuthError('unknown host %s' % host)
+    if item.host != host:
+        raise AgentAuthError('item %i is not scanned by %s' % (item.id, host))
+    try:
+        timestamp = int(_header(request, HEADER_TIME))
+    except ValueError:
+        raise AgentAuthError('invalid time')
+    if abs(time.time() - timestamp) > settings.AGENT_MAX_CLOCK_SKEW:
+        raise AgentAuthError('time is off by more than %i seconds' % settings.AGENT_MAX_CLOCK_SKEW)
+    nonce = _header(request, HEADER_NONCE)
+    if not _NONCE.match(nonce):
+        raise AgentAuthError('invalid nonce')
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    expected = sign_request(key, request.method, item.id, host, timestamp, nonce, request.body)
+    if not hmac.compare_digest(expected, _header(request, HEADER_SIGNATURE)):
+        raise AgentAuthError('invalid signature')
+    _use_nonce(item, nonce)
+    return host
+
+def _use_nonce(item, nonce):
+    # a request older than twice the clock skew is refused by its time, so
+    # only the nonces of the more recent requests need to be kept
+    now = timezone.now()
+    FileWatchAgentNonceModel.objects.filter(watchid=item, time__lt=now - timedelta(seconds=2 * settings.AGENT_MAX_CLOCK_SKEW)).delete()
+    try:
+        with transaction.atomic():
+            FileWatchAgentNonceModel.objects.create(watchid=item, nonce=nonce, time=now)
+    except IntegrityError:
+        raise AgentAuthError('nonce %s has been used before' % nonce)
+
+def agent_config(item):
+    """
+    Returns the configuration of a watch item for its agent.
+    """
+    return { 'id': item.id, 'filename': item.filename, 'recursive': item.recursive, 'checksum': item.checksum,
+             'include': item.include, 'exclude': item.exclude, 'revision': item.revision }
+
+def _disk_item(values):
+    entry = entry_from_values(values)
+    ret = FileWatchItemFromDisk.from_values(entry.filename, entry.ctime_ns, entry.mtime_ns, entry.uid, entry.gid,
+                                            entry.mode, entry.size, entry.inode or 0, entry.device or 0)
+    ret.checksum = entry.checksum
+    return ret
+
+def agent_status(payload):
+    """
+    Returns the StatusCounter of the final batch of a check sent by an
+    agent, or None for the other batches. Raises ValueError, KeyError or
+    TypeError if the status is invalid.
+    """
+    if not payload.get('final'):
+        return None
+    values = payload['status']
+    if not isinstance(values, dict):
+        raise ValueError('invalid status')
+    counter = StatusCounter()
+    counter.num_files = int(values['num_files'])
+    counter.total_size = int(values['total_size'])
+    counter.num_added = int(values[FILE_ADDED])
+    counter.num_changed = int(values[FILE_CHANGED])
+    counter.num_moved = int(values[FILE_MOVED])
+    counter.num_deleted = int(values[FILE_DELETED])
+    return counter
+
+def apply_delta(item, payload):
+    """
+    Writes a batch of changes sent by the agent of the given watch item.
+    The batch must be based on the current revision of the item, otherwise
+    RevisionConflict is raised and nothing is written; with reset all
+    stored files are replaced. Returns the writer, which has the counts of
+    the written rows; the new revision is item.revision.
+    """
+    revision = payload['revision']
+    run_id = payload.get('run')
+    status = agent_status(payload)
+    if run_id is not None and not _RUN_ID.match(run_id):
+        raise ValueError('invalid run %s' % run_id)
+    with transaction.atomic():
+        if payload.get('reset'):
+            if not FileWatchModel.objects.filter(pk=item.pk, revision=revision).update(revision=F('revision') + 1):
+                raise RevisionConflict('revision of %s is not %i' % (item.filename, revision))
+            FileWatchItemModel.objects.filter(watchid=item).delete()
+            revision += 1
+        elif FileWatchModel.objects.filter(pk=item.pk).values_list('revision', flat=True)[0] != revision:
+            raise RevisionConflict('revision of %s is not %i' % (item.filename, revision))
+        item.revision = revision
+        # the chunks are written within the transaction of the batch
+        writer = FileWatchItemWriter(item, per_item=False, run_id=run_id if settings.EVENT_LOG else None,
+                                     expected_revision=revision)
+        for record in payload['changes']:
+            state = record['state']
+            changes = changes_from_values(record.get('changes', []))
+            if state == FILE_ADDED:
+                writer.insert(_disk_item(record['entry']), changes)
+            elif state == FILE_CHANGED or state == FILE_UPDATED:
+                writer.update(entry_from_values(record['entry']), changes)
+            elif state == FILE_MOVED:
+                entry = entry_from_values(record['entry'])
+                db_item = entry_from_values(record['entry'])
+                db_item.filename = record['old_filename']
+                writer.move(db_item, entry, changes)
+            elif state == FILE_DELETED:
+                writer.delete(BaselineItem(record['filename'], 0, 0, 0, 0, 0, 0, None, None, ''), changes)
+            else:
+                raise ValueError('invalid state %s' % state)
+        writer.close()
+        if payload.get('final'):
+            item.last_check = timezone.now()
+            item.save(update_fields=['last_check'])
+            # the agent has seen all files
+            save_status(item, item.last_check, float(payload['status']['duration']), status, True)
+    return writer
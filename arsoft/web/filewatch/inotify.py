@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+class INotifyEvent(object):
+    def __init__(self, wd, mask, cookie, name):
+        self.wd = wd
+        self.mask = mask
+        self.cookie = cookie
+        self.name = name
+
+    @property
+    def is_dir(self):
+        return (self.mask & IN_ISDIR) != 0
+
+class INotify(object):
+    """
+    Minimal wrapper for the Linux inotify interface using ctypes, so no
+    additional module is required.
+    """
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self._fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        return wd
+
+    def rm_watch(self, wd):
+        if self._libc.inotify_rm_watch(self._fd, wd) < 0:
+            e = ctypes.get_errno()
+            # the watch is already gone when the directory has been removed
+            if e != errno.EINVAL:
+                raise OSError(e, os.strerror(e))
+
+    def read_events(self, timeout=None):
+        """
+        Waits up to timeout seconds for events and returns the list of
+        events which have been read.
+        """
+        ret = []
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return ret
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return ret
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+            ret.append(INotifyEvent(wd, mask, cookie, name))
+        return ret
@@ -0,0 +1,427 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from django.db import transaction, IntegrityError, close_old_connections
+from django.db.models import Q, F, Count, Max
+from django.utils import timezone
+from arsoft.web.filewatch.models import FileWatchModel, FileWatchJobModel, FileWatchLockModel
+from arsoft.web.filewatch.notify import get_dispatcher
+from arsoft.web.filewatch.scan import parse_patterns
+from arsoft.web.filewatch.metrics import OUTPUT_TEXT, format_line
+from arsoft.web.filewatch.history import compact_events
+
+import os
+import errno
+import hashlib
+import ctypes
+import platform
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+# import the logging library
+import logging
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+# interval in seconds in which a long running worker removes the old jobs
+# and compacts the change events
+JOB_EXPIRE_INTERVAL = 3600
+
+def job_log_filename(job):
+    return os.path.join(settings.JOB_LOG_DIR, '%i.log' % job.id)
+
+def _queue_key(item, verbose, incremental, subtree, include, exclude, output_format):
+    key = repr((item.id if item is not None else None, bool(verbose), incremental, subtree, include, exclude, output_format))
+    return hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+def _take_over(job, full, notify):
+    if (full and not job.full) or (notify and not job.notify):
+        job.full = job.full or full
+        job.notify = job.notify or notify
+        job.save(update_fields=['full', 'notify'])
+    return job
+
+def enqueue_check(item=None, verbose=False, notify=True, incremental=None, full=False, subtree='', include='', exclude='',
+                  output_format=OUTPUT_TEXT):
+    """
+    Queues a check of the given watch item (or of all items) and returns
+    the tuple (job, created). subtree, include and exclude restrict the
+    check as described for CheckItemHandler; the patterns are given one
+    per line, and output_format selects the format of the job log. When
+    a job with the same options covering the same files is already queued,
+    that job is returned instead and takes over the requested full scan
+    and notification. The queue key of the job makes sure that concurrent
+    requests do not queue the same check twice.
+    """
+    key = _queue_key(item, verbose, incremental, subtree, include, exclude, output_format)
+    while True:
+        with transaction.atomic():
+            qs = FileWatchJobModel.objects.filter(state=FileWatchJobModel.STATE_QUEUED, output_format=output_format,
+                                                  verbose=verbose, incremental=incremental)
+            if item is None:
+                qs = qs.filter(watchid__isnull=True)
+            else:
+                qs = qs.filter(Q(watchid=item) | Q(watchid__isnull=True))
+            # a job without restrictions covers all files of the item
+            qs = qs.filter(Q(subtree='', include='', exclude='') | Q(subtree=subtree, include=include, exclude=exclude))
+            job = qs.order_by('id').first()
+            if job is not None:
+                return (_take_over(job, full, notify), False)
+            try:
+                with transaction.atomic():
+                    job = FileWatchJobModel.objects.create(watchid=item, verbose=verbose, notify=notify, incremental=incremental,
+                                                           full=full, subtree=subtree, include=include, exclude=exclude,
+                                                           output_format=output_format, queue_key=key)
+                return (job, True)
+            except IntegrityError:
+                pass
+        # queued by a concurrent request; look again unless it was started
+        # in the meantime
+        job = FileWatchJobModel.objects.filter(queue_key=key).first()
+        if job is not None:
+            return (_take_over(job, full, notify), False)
+
+_IONICE_CLASSES = { 'realtime': 1, 'best-effort': 2, 'idle': 3 }
+# number of the ioprio_set system call, which the C library does not wrap
+_SYS_IOPRIO_SET = { 'x86_64': 251, 'i386': 289, 'i686': 289, 'armv7l': 314, 'armv6l': 314,
+                    'aarch64': 30, 'riscv64': 30, 'ppc64le': 273, 'ppc64': 273, 's390x': 282 }
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+
+def set_io_priority(ioclass=None, level=None):
+    """
+    Sets the I/O scheduling class of this process with the ioprio_set
+    system call. Threads inherit the class when they are started, so it
+    must be called before any worker threads are started.
+    """
+    if ioclass is None:
+        ioclass = settings.CHECK_IONICE_CLASS
+    if level is None:
+        level = settings.CHECK_IONICE_LEVEL
+    if not ioclass:
+        return True
+    nr = _SYS_IOPRIO_SET.get(platform.machine())
+    if nr is None:
+        logger.warning('Unable to set the I/O priority: ioprio_set not supported on %s' % platform.machine())
+        return False
+    value = _IONICE_CLASSES[ioclass] << _IOPRIO_CLASS_SHIFT
+    if ioclass != 'idle':
+        value |= level
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(nr, _IOPRIO_WHO_PROCESS, 0, value) != 0:
+        e = ctypes.get_errno()
+        logger.warning('Unable to set the I/O priority: %s' % os.strerror(e))
+        return False
+    return True
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+def worker_name():
+    return '%s:%i' % (socket.gethostname(), os.getpid())
+
+def lock_item(item, worker):
+    """
+    Locks the given watch item for a process which changes its files
+    outside of a job (the watch daemon), so it does not run concurrently
+    with a check. Returns False if the item is locked.
+    """
+    try:
+        with transaction.atomic():
+            FileWatchLockModel.objects.create(watchid=item, worker=worker)
+    except IntegrityError:
+        return False
+    return True
+
+def unlock_item(item, worker):
+    FileWatchLockModel.objects.filter(watchid=item, job__isnull=True, worker=worker).delete()
+
+class CheckJobWorker(object):
+    """
+    Runs the queued check jobs one after another. Before a job starts, the
+    worker locks all watch items of the job, so concurrent workers (or
+    workers on other hosts sharing the database) and the watch daemon
+    never change the same item at the same time. A job whose items are
+    locked stays queued.
+    """
+    def __init__(self, poll_interval=None, output=None):
+        self._poll_interval = settings.JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._output = output
+        self.name = worker_name()
+        self._last_expire = 0
+
+    def _write(self, line):
+        if self._output is not None:
+            self._output(line.rstrip('\r\n'))
+
+    def _job_items(self, job):
+        if job.watchid_id is None:
+            return list(FileWatchModel.objects.all())
+        return [ job.watchid ]
+
+    def _acquire_locks(self, job, items):
+        try:
+            with transaction.atomic():
+                for item in items:
+                    FileWatchLockModel.objects.create(watchid=item, job=job)
+        except IntegrityError:
+            return False
+        return True
+
+    def _release_locks(self, job):
+        FileWatchLockModel.objects.filter(job=job).delete()
+
+    def _finish(self, job, state):
+        job.state = state
+        job.finished = timezone.now()
+        job.save(update_fields=['state', 'finished'])
+        self._release_locks(job)
+
+    def recover(self):
+        """
+        Fails the running jobs of workers on this host which no longer
+        exist and releases their locks.
+        """
+        hostname = socket.gethostname()
+        for job in FileWatchJobModel.objects.filter(state=FileWatchJobModel.STATE_RUNNING, worker__startswith=hostname + ':'):
+            pid = int(job.worker.rsplit(':', 1)[1])
+            if not process_alive(pid):
+                logger.warning('Worker %s of job %i is gone' % (job.worker, job.id))
+                self._finish(job, FileWatchJobModel.STATE_FAILED)
+        # locks of jobs which are not running any more
+        FileWatchLockModel.objects.filter(job__isnull=False).exclude(job__state=FileWatchJobModel.STATE_RUNNING).delete()
+        # and of watch daemons which are gone
+        for lock in FileWatchLockModel.objects.filter(job__isnull=True, worker__startswith=hostname + ':'):
+            if not process_alive(int(lock.worker.rsplit(':', 1)[1])):
+                logger.warning('Watch daemon %s is gone, unlocking %s' % (lock.worker, lock.watchid.filename))
+                lock.delete()
+
+    def expire(self):
+        """
+        Removes finished jobs older than JOB_KEEP_DAYS and their logs and
+        compacts the old change events.
+        """
+        self._last_expire = time.time()
+        limit = timezone.now() - timedelta(days=settings.JOB_KEEP_DAYS)
+        qs = FileWatchJobModel.objects.filter(state__in=[FileWatchJobModel.STATE_DONE, FileWatchJobModel.STATE_FAILED], finished__lt=limit)
+        for job in qs:
+            try:
+                os.unlink(job_log_filename(job))
+            except OSError:
+                pass
+        qs.delete()
+        compact_events()
+
+    def expire_if_due(self):
+        if time.time() - self._last_expire >= JOB_EXPIRE_INTERVAL:
+            self.expire()
+
+    def claim(self):
+        """
+        Returns the next queued job whose watch items could be locked, or
+        None if there is none.
+        """
+        for job in FileWatchJobModel.objects.filter(state=FileWatchJobModel.STATE_QUEUED).order_by('id'):
+            # only one worker can move the job from queued to running
+            if not FileWatchJobModel.objects.filter(id=job.id, state=FileWatchJobModel.STATE_QUEUED).update(
+                    state=FileWatchJobModel.STATE_RUNNING, worker=self.name, started=timezone.now(), queue_key=None):
+                continue
+            job.refresh_from_db()
+            if self._acquire_locks(job, self._job_items(job)):
+                return job
+            try:
+                with transaction.atomic():
+                    FileWatchJobModel.objects.filter(id=job.id).update(state=FileWatchJobModel.STATE_QUEUED, worker='', started=None,
+                                                                       queue_key=job.queue_key)
+            except IntegrityError:
+                # the same check was queued again in the meantime
+                FileWatchJobModel.objects.filter(id=job.id).update(state=FileWatchJobModel.STATE_QUEUED, worker='', started=None)
+        return None
+
+    def lock(self, job, items):
+        """
+        Marks the given job as running by this worker and locks the given
+        items for it, so a check started outside of the queue does not run
+        concurrently with a queued one. Returns False if an item is locked.
+        """
+        job.state = FileWatchJobModel.STATE_RUNNING
+        job.worker = self.name
+        job.started = timezone.now()
+        job.save(update_fields=['state', 'worker', 'started'])
+        if self._acquire_locks(job, items):
+            return True
+        self._finish(job, FileWatchJobModel.STATE_FAILED)
+        return False
+
+    def run_job(self, job, handler=None):
+        """
+        Runs the check of the given job, or the given CheckItemHandler on
+        behalf of the job, and writes its output to the job log.
+        """
+        # the views use this module to queue the jobs
+        from arsoft.web.filewatch.views import CheckItemHandler
+        self._write(format_line('job: %i started\r\n' % job.id, job.output_format))
+        state = FileWatchJobModel.STATE_FAILED
+        with open(job_log_filename(job), 'w') as log:
+            try:
+                if handler is None:
+                    handler = CheckItemHandler(item_id=job.watchid_id, verbose=job.verbose, notify=job.notify,
+                                               incremental=job.incremental, full=job.full, subtree=job.subtree or None,
+                                               include=parse_patterns(job.include), exclude=parse_patterns(job.exclude),
+                                               output_format=job.output_format, job_id=job.id)
+                for line in handler:
+                    log.write(line)
+                    log.flush()
+                    self._write(line)
+                state = FileWatchJobModel.STATE_DONE
+            except Exception:
+                logger.exception('Check job %i failed' % job.id)
+                log.write('error: %s\r\n' % traceback.format_exc().replace('\n', '\r\n'))
+            finally:
+                self._finish(job, state)
+        self._write(format_line('job: %i %s\r\n' % (job.id, state), job.output_format))
+        return state
+
+    def prepare(self):
+        if not os.path.isdir(settings.JOB_LOG_DIR):
+            os.makedirs(settings.JOB_LOG_DIR)
+        close_old_connections()
+        self.recover()
+        self.expire()
+
+    def run_queued(self):
+        """
+        Runs jobs until no more job can be claimed and returns the number of
+        jobs which have been run. The notification mails left by other
+        processes are delivered as well.
+        """
+        ret = 0
+        close_old_connections()
+        num_mails = get_dispatcher().resume()
+        if num_mails:
+            self._write('mails: %i pending mails taken over' % num_mails)
+        while True:
+            close_old_connections()
+            job = self.claim()
+            if job is None:
+                break
+            self.run_job(job)
+            ret += 1
+        return ret
+
+    def run(self, once=False):
+        self.prepare()
+        while True:
+            self.run_queued()
+            if once:
+                break
+            self.expire_if_due()
+            time.sleep(self._poll_interval)
+        # do not exit before the notifications of the jobs are delivered
+        get_dispatcher().wait()
+
+class CheckScheduler(object):
+    """
+    Queues a check job for every watch item with a check interval when it
+    is due. When several items are due, those with the highest priority are
+    queued first, and only max_jobs jobs are queued or running at the same
+    time, so the checks do not run all at once. Items which have not been
+    checked yet get a fixed offset within their interval, so they are
+    spread over time as well.
+
+    An item whose check failed is retried after SCHEDULER_RETRY_DELAY
+    seconds, doubled with each further failure but at most its interval.
+
+    With a worker the scheduler runs the queued jobs itself.
+    """
+    def __init__(self, worker=None, max_jobs=None, poll_interval=None, output=None):
+        self._worker = worker
+        self._max_jobs = settings.SCHEDULER_MAX_JOBS if max_jobs is None else max_jobs
+        self._poll_interval = settings.SCHEDULER_POLL_INTERVAL if poll_interval is None else poll_interval
+        self._output = output
+        self._start = timezone.now()
+
+    def _write(self, line):
+        if self._output is not None:
+            self._output(line.rstrip('\r\n'))
+
+    def next_check(self, item):
+        if item.last_check is not None:
+            return item.last_check + timedelta(seconds=item.check_interval)
+        # Knuth's multiplicative hash spreads consecutive ids
+        offset = (item.id * 2654435761) % (2 ** 32) % item.check_interval
+        return self._start + timedelta(seconds=offset)
+
+    def failed_checks(self):
+        """
+        Returns the number of failed jobs since the last successful check
+        and the time the last one finished by watch item id.
+        """
+        qs = FileWatchJobModel.objects.filter(Q(watchid__last_check__isnull=True) | Q(finished__gt=F('watchid__last_check')),
+                                              state=FileWatchJobModel.STATE_FAILED, watchid__check_interval__gt=0, finished__isnull=False)
+        return dict([ (row['watchid'], (row['num_failed'], row['last_failed']))
+                     for row in qs.values('watchid').annotate(num_failed=Count('id'), last_failed=Max('finished')) ])
+
+    def due_items(self, now=None):
+        if now is None:
+            now = timezone.now()
+        ret = []
+        failed = self.failed_checks()
+        # the items of other hosts are checked by their agents
+        for item in FileWatchModel.objects.filter(check_interval__gt=0, host=''):
+            next_check = self.next_check(item)
+            if item.id in failed:
+                (num_failed, last_failed) = failed[item.id]
+                delay = min(settings.SCHEDULER_RETRY_DELAY * 2 ** min(num_failed - 1, 16), item.check_interval)
+                next_check = max(next_check, last_failed + timedelta(seconds=delay))
+            if next_check <= now:
+                ret.append( (-item.priority, next_check, item.id, item) )
+        ret.sort()
+        return [ x[-1] for x in ret ]
+
+    def schedule(self):
+        """
+        Queues the jobs for the due items and returns the number of queued
+        jobs.
+        """
+        active = FileWatchJobModel.objects.filter(state__in=[FileWatchJobModel.STATE_QUEUED, FileWatchJobModel.STATE_RUNNING])
+        num_active = active.count()
+        busy = set(active.values_list('watchid_id', flat=True))
+        ret = 0
+        for item in self.due_items():
+            if num_active >= self._max_jobs:
+                break
+            if item.id in busy or None in busy:
+                continue
+            job, created = enqueue_check(item=item)
+            if created:
+                self._write('schedule: job %i queued for %s' % (job.id, item.filename))
+                num_active += 1
+                ret += 1
+        return ret
+
+    def run(self, once=False):
+        if self._worker is not None:
+            self._worker.prepare()
+        while True:
+            close_old_connections()
+            self.schedule()
+            if self._worker is not None:
+                while self._worker.run_queued():
+                    # queue the next due items right away
+                    self.schedule()
+            if once:
+                break
+            if self._worker is not None:
+                self._worker.expire_if_due()
+            time.sleep(self._poll_interval)
+        get_dispatcher().wait()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from arsoft.web.filewatch.models import FileWatchModel, FileWatchJobModel
+from arsoft.web.filewatch.jobs import CheckJobWorker, set_io_priority
+from arsoft.web.filewatch.metrics import OUTPUT_TEXT, OUTPUT_JSON
+from arsoft.web.filewatch.notify import get_dispatcher
+from arsoft.web.filewatch.views import CheckItemHandler
+
+import os
+import sys
+
+# exit codes like diff: no changes, changes found, the check failed
+EXIT_UNCHANGED = 0
+EXIT_CHANGED = 1
+EXIT_FAILED = 2
+
+class Command(BaseCommand):
+    help = 'Checks the given watch items (or all items) without the web server. ' \
+           'Exits with 0 if nothing changed, 1 if changes were found and 2 if the check failed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('item_id', nargs='*', type=int,
+                            help='ids of the watch items to check (default all items)')
+        parser.add_argument('--no-notify', dest='notify', action='store_false', default=True,
+                            help='do not send notification mails')
+        parser.add_argument('--incremental', dest='incremental', action='store_true', default=None,
+                            help='only list the directories which changed since the last check (default CHECK_INCREMENTAL)')
+        parser.add_argument('--no-incremental', dest='incremental', action='store_false',
+                            help='list all directories, even when CHECK_INCREMENTAL is enabled')
+        parser.add_argument('--full', dest='full', action='store_true', default=False,
+                            help='list all directories, even when checking incrementally')
+        parser.add_argument('--scan-workers', dest='scan_workers', type=int, default=None,
+                            help='number of threads scanning the files (default CHECK_SCAN_WORKERS)')
+        parser.add_argument('--hash-workers', dest='hash_workers', type=int, default=None,
+                            help='number of threads hashing the files (default CHECK_HASH_WORKERS)')
+        parser.add_argument('--format', dest='output_format', choices=[OUTPUT_TEXT, OUTPUT_JSON], default=OUTPUT_TEXT,
+                            help='format of the output')
+        parser.add_argument('--no-ionice', dest='ionice', action='store_false', default=True,
+                            help='keep the I/O scheduling class of the process')
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        item_ids = options['item_id']
+        if item_ids:
+            items = list(FileWatchModel.objects.filter(id__in=item_ids))
+            missing = set(item_ids) - set([ item.id for item in items ])
+            if missing:
+                self.stderr.write('Item %s does not exist' % ', '.join([ str(item_id) for item_id in sorted(missing) ]))
+                sys.exit(EXIT_FAILED)
+        else:
+            items = list(FileWatchModel.objects.filter(host=''))
+        if options['ionice']:
+            set_io_priority()
+        if not os.path.isdir(settings.JOB_LOG_DIR):
+            os.makedirs(settings.JOB_LOG_DIR)
+
+        output = self.stdout.write if verbosity > 0 else None
+        worker = CheckJobWorker(output=output)
+        worker.recover()
+        # the check is recorded as job, so it shows up in /job/<job>/status
+        # and locks the items like the checks run by the worker
+        job = FileWatchJobModel.objects.create(watchid=items[0] if len(items) == 1 else None,
+                                               verbose=verbosity > 1, notify=options['notify'],
+                                               incremental=options['incremental'], full=options['full'],
+                                               output_format=options['output_format'])
+        if not worker.lock(job, items):
+            self.stderr.write('Another check of the items is running')
+            sys.exit(EXIT_FAILED)
+        handler = CheckItemHandler(item_id=[ item.id for item in items ] if item_ids else None, verbose=verbosity > 1, notify=options['notify'],
+                                   incremental=options['incremental'], full=options['full'],
+                                   output_format=options['output_format'],
+                                   scan_workers=options['scan_workers'], hash_workers=options['hash_workers'],
+                                   job_id=job.id)
+        state = worker.run_job(job, handler)
+        # do not exit before the notifications are delivered
+        get_dispatcher().wait()
+        if state != FileWatchJobModel.STATE_DONE:
+            sys.exit(EXIT_FAILED)
+        sys.exit(EXIT_CHANGED if handler.num_changed else EXIT_UNCHANGED)
@@ -0,0 +1,23 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.core.management.base import BaseCommand, CommandError
+from arsoft.web.filewatch.history import compact_events
+
+class Command(BaseCommand):
+    help = 'Rolls the old change events up into daily summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', dest='days', type=int, default=None,
+                            help='keep the change events of this number of days (default EVENT_RETENTION_DAYS)')
+        parser.add_argument('--summary-days', dest='summary_days', type=int, default=None,
+                            help='keep the summaries of this number of days (default EVENT_SUMMARY_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        if options['days'] is not None and options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        (num_events, num_summaries) = compact_events(retention_days=options['days'], summary_retention_days=options['summary_days'])
+        if verbosity > 0:
+            self.stdout.write('compacted %i change events, removed %i summaries' % (num_events, num_summaries))
@@ -0,0 +1,41 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.core.management.base import BaseCommand, CommandError
+from arsoft.web.filewatch.baseline import BaselineReader, diff_baselines
+from arsoft.web.filewatch.compare import FILE_ADDED, FILE_CHANGED, FILE_DELETED
+
+import sys
+
+class Command(BaseCommand):
+    help = 'Compares two baseline files without using the database. ' \
+           'Exits with 0 if they are equal and 1 if they differ, like diff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('old', help='baseline file to compare against (e.g. a golden baseline)')
+        parser.add_argument('new', help='baseline file to compare')
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        readers = []
+        try:
+            for filename in (options['old'], options['new']):
+                try:
+                    readers.append(BaselineReader(filename))
+                except (IOError, OSError, ValueError) as e:
+                    raise CommandError('Unable to read %s: %s' % (filename, e))
+            counts = { FILE_ADDED: 0, FILE_CHANGED: 0, FILE_DELETED: 0 }
+            for (state, new_item, old_item, changes) in diff_baselines(readers[0], readers[1]):
+                if state not in counts:
+                    continue
+                counts[state] += 1
+                if verbosity > 0:
+                    filename = new_item.filename if new_item is not None else old_item.filename
+                    self.stdout.write('%s: %s' % (filename, ', '.join(changes)))
+        finally:
+            for reader in readers:
+                reader.close()
+        if verbosity > 1:
+            self.stdout.write('%i added, %i changed, %i deleted' % (counts[FILE_ADDED], counts[FILE_CHANGED], counts[FILE_DELETED]))
+        sys.exit(1 if sum(counts.values()) else 0)
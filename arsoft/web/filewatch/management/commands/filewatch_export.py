@@ -0,0 +1,35 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.core.management.base import BaseCommand, CommandError
+from arsoft.web.filewatch.models import FileWatchModel
+from arsoft.web.filewatch.baseline import write_baseline
+from arsoft.web.filewatch.persist import open_baseline, iter_db_rows
+
+class Command(BaseCommand):
+    help = 'Writes the file entries of a watch item as baseline file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('item_id', type=int, help='id of the watch item')
+        parser.add_argument('filename', help='name of the baseline file to write')
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        try:
+            item = FileWatchModel.objects.get(id=options['item_id'])
+        except FileWatchModel.DoesNotExist:
+            raise CommandError('Item %i does not exist' % options['item_id'])
+        # a current baseline is copied, otherwise the entries are read from
+        # the database
+        reader = open_baseline(item)
+        try:
+            entries = iter(reader) if reader is not None else iter_db_rows(item)
+            num_records = write_baseline(options['filename'], item.id, item.revision, entries)
+        except (IOError, OSError) as e:
+            raise CommandError('Unable to write %s: %s' % (options['filename'], e))
+        finally:
+            if reader is not None:
+                reader.close()
+        if verbosity > 0:
+            self.stdout.write('exported %i files of %s (revision %i) to %s' % (num_records, item.filename, item.revision, options['filename']))
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.core.management.base import BaseCommand, CommandError
+from arsoft.web.filewatch.models import FileWatchModel, FileWatchItemModel, FileWatchDirectoryModel
+from arsoft.web.filewatch.baseline import BaselineReader, write_baseline
+from arsoft.web.filewatch.persist import baseline_filename
+from arsoft.web.filewatch.jobs import worker_name, lock_item, unlock_item
+
+class Command(BaseCommand):
+    help = 'Replaces the file entries of a watch item by those of a baseline file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('item_id', type=int, help='id of the watch item')
+        parser.add_argument('filename', help='name of the baseline file to read')
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        try:
+            item = FileWatchModel.objects.get(id=options['item_id'])
+        except FileWatchModel.DoesNotExist:
+            raise CommandError('Item %i does not exist' % options['item_id'])
+        try:
+            reader = BaselineReader(options['filename'])
+        except (IOError, OSError, ValueError) as e:
+            raise CommandError('Unable to read %s: %s' % (options['filename'], e))
+        chunk_size = settings.CHECK_BULK_CHUNK_SIZE
+        num_records = 0
+        name = worker_name()
+        # no check, worker or watch daemon may change the item meanwhile
+        if not lock_item(item, name):
+            reader.close()
+            raise CommandError('Item %i is locked by a running check' % item.id)
+        try:
+            with transaction.atomic():
+                FileWatchItemModel.objects.filter(watchid=item).delete()
+                # the directories of the last scan do not match the imported
+                # files, so the next check has to list all directories
+                FileWatchDirectoryModel.objects.filter(watchid=item).delete()
+                chunk = []
+                for entry in reader:
+                    chunk.append(FileWatchItemModel(watchid=item, filename=entry.filename, ctime_ns=entry.ctime_ns,
+                                                    mtime_ns=entry.mtime_ns, uid=entry.uid, gid=entry.gid, mode=entry.mode,
+                                                    size=entry.size, inode=entry.inode, device=entry.device,
+                                                    checksum=entry.checksum))
+                    if len(chunk) >= chunk_size:
+                        FileWatchItemModel.objects.bulk_create(chunk)
+                        num_records += len(chunk)
+                        chunk = []
+                FileWatchItemModel.objects.bulk_create(chunk)
+                num_records += len(chunk)
+                FileWatchModel.objects.filter(pk=item.pk).update(revision=F('revision') + 1, last_full_scan=None)
+            revision = FileWatchModel.objects.filter(pk=item.pk).values_list('revision', flat=True)[0]
+            # the imported entries become the baseline of the next check
+            write_baseline(baseline_filename(item.id), item.id, revision, reader)
+        finally:
+            reader.close()
+            unlock_item(item, name)
+        if verbosity > 0:
+            if reader.item_id != item.id:
+                self.stdout.write('the baseline was exported from item %i' % reader.item_id)
+            self.stdout.write('imported %i files into %s (revision %i)' % (num_records, item.filename, revision))
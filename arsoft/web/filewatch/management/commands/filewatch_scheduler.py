@@ -0,0 +1,28 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.core.management.base import BaseCommand
+from arsoft.web.filewatch.jobs import CheckScheduler, CheckJobWorker, set_io_priority
+
+class Command(BaseCommand):
+    help = 'Queues the checks of the items with a check interval when they are due and runs them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-worker', dest='worker', action='store_false', default=True,
+                            help='only queue the checks, they are run by filewatch_worker')
+        parser.add_argument('--once', dest='once', action='store_true', default=False,
+                            help='queue (and run) the due checks once and exit')
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        output = self.stdout.write if verbosity > 1 else None
+        worker = None
+        if options['worker']:
+            set_io_priority()
+            worker = CheckJobWorker(output=output)
+        scheduler = CheckScheduler(worker=worker, output=output)
+        try:
+            scheduler.run(once=options['once'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,32 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.core.management.base import BaseCommand, CommandError
+from arsoft.web.filewatch.models import FileWatchModel
+from arsoft.web.filewatch.watcher import FileWatchDaemon
+
+class Command(BaseCommand):
+    help = 'Watches the configured files and directories with inotify and updates the database on every change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--item', dest='item_ids', type=int, action='append', default=[],
+                            help='watch only the item with the given id (can be given multiple times)')
+        parser.add_argument('--no-notify', dest='notify', action='store_false', default=True,
+                            help='do not send notification mails')
+
+    def handle(self, *args, **options):
+        item_list = FileWatchModel.objects.filter(host='')
+        if options['item_ids']:
+            item_list = item_list.filter(id__in=options['item_ids'])
+        item_list = list(item_list)
+        if not item_list:
+            raise CommandError('No items to watch')
+
+        verbosity = int(options['verbosity'])
+        output = self.stdout.write if verbosity > 1 else None
+        daemon = FileWatchDaemon(item_list, notify=options['notify'], output=output)
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,25 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.core.management.base import BaseCommand
+from arsoft.web.filewatch.jobs import CheckJobWorker, set_io_priority
+
+class Command(BaseCommand):
+    help = 'Runs the check jobs queued by the check view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', dest='once', action='store_true', default=False,
+                            help='exit when no job is queued')
+        parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=None,
+                            help='seconds to wait before looking for new jobs')
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        output = self.stdout.write if verbosity > 1 else None
+        set_io_priority()
+        worker = CheckJobWorker(poll_interval=options['poll_interval'], output=output)
+        try:
+            worker.run(once=options['once'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from collections import OrderedDict
+import os
+import json
+import time
+import fcntl
+
+# import the logging library
+import logging
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+OUTPUT_TEXT = 'text'
+OUTPUT_JSON = 'json'
+
+OUTPUT_FORMAT_CHOICES = (
+    (OUTPUT_TEXT, 'Text'),
+    (OUTPUT_JSON, 'JSON lines'),
+    )
+
+# counters of a watch root and their description
+ROOT_COUNTERS = OrderedDict([
+    ('files_scanned', 'Number of files found on disk'),
+    ('dirs_listed', 'Number of directories listed'),
+    ('stat_calls', 'Number of stat calls'),
+    ('db_rows_read', 'Number of file entries read from the database'),
+    ('db_rows_written', 'Number of file entries written to the database'),
+    ('files_changed', 'Number of added, changed and deleted files'),
+    ('files_hashed', 'Number of hashed files'),
+    ('bytes_hashed', 'Number of bytes hashed'),
+    ])
+
+# timers of a watch root (in seconds) and their description
+ROOT_TIMERS = OrderedDict([
+    ('duration', 'Time spent checking the root'),
+    ('db_write', 'Time spent writing to the database'),
+    ('hash', 'Time spent hashing, summed over all hashing threads'),
+    ('io_wait', 'Time the check was throttled by the I/O budget'),
+    ])
+
+class MetricsLine(str):
+    """
+    An output line of a check which carries the metrics it reports, so
+    they can be written as separate fields in the JSON lines output.
+    """
+    def __new__(cls, text, data):
+        ret = str.__new__(cls, text)
+        ret.data = data
+        return ret
+
+    def __reduce__(self):
+        return (MetricsLine, (str(self), self.data))
+
+def format_line(line, output_format):
+    """
+    Returns an output line ('<stage>: <message>\\r\\n') in the given output
+    format. As JSON the line becomes an object with the time, the stage, the
+    message and the fields of a MetricsLine.
+    """
+    if output_format != OUTPUT_JSON:
+        return line
+    (stage, sep, message) = line.rstrip('\r\n').partition(': ')
+    if not sep:
+        (stage, message) = ('', stage)
+    record = OrderedDict([ ('time', round(time.time(), 3)), ('stage', stage), ('message', message) ])
+    record.update(getattr(line, 'data', {}))
+    return json.dumps(record) + '\n'
+
+def timed(iterable, add):
+    """
+    Yields the values of the given iterable and passes the time spent
+    producing each of them to add. The time the consumer needs is not
+    counted, so the output of a generator can be timed while streaming it.
+    """
+    it = iter(iterable)
+    while True:
+        start = time.time()
+        try:
+            value = next(it)
+        except StopIteration:
+            add(time.time() - start)
+            return
+        add(time.time() - start)
+        yield value
+
+class RootMetrics(object):
+    """
+    The counters and timers of one watch root within a check.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.counters = OrderedDict([ (name, 0) for name in ROOT_COUNTERS ])
+        self.timers = OrderedDict([ (name, 0.0) for name in ROOT_TIMERS ])
+
+    def add_duration(self, seconds):
+        self.timers['duration'] += seconds
+
+    def as_dict(self):
+        ret = OrderedDict(self.counters)
+        for (name, value) in self.timers.items():
+            ret[name + '_seconds'] = round(value, 6)
+        return ret
+
+class CheckMetrics(object):
+    """
+    Timers of the stages (the handlers of CheckItemHandler) and the
+    counters of every watch root of a single check.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.stages = OrderedDict()
+        self.roots = OrderedDict()
+        self.mails_queued = 0
+
+    def add_stage_time(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def stage_timer(self, stage):
+        return lambda seconds: self.add_stage_time(stage, seconds)
+
+    def root(self, root):
+        ret = self.roots.get(root)
+        if ret is None:
+            ret = RootMetrics(root)
+            self.roots[root] = ret
+        return ret
+
+def _lock_metrics_file(filename):
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    f = open(filename + '.lock', 'a')
+    fcntl.flock(f, fcntl.LOCK_EX)
+    return f
+
+def load_metrics(filename=None):
+    """
+    Returns the metrics recorded in the metrics file, or an empty record if
+    there is none yet.
+    """
+    if filename is None:
+        filename = settings.METRICS_FILE
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f, object_pairs_hook=OrderedDict)
+    except (IOError, OSError, ValueError):
+        return OrderedDict()
+
+def _update_metrics(func, filename=None):
+    # the checks run in the workers and the web server reads the metrics,
+    # so the file is shared by several processes: it is updated while
+    # holding a lock and replaced atomically
+    if filename is None:
+        filename = settings.METRICS_FILE
+    lock = _lock_metrics_file(filename)
+    try:
+        data = load_metrics(filename)
+        func(data)
+        tmpname = filename + '.tmp'
+        with open(tmpname, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmpname, filename)
+    finally:
+        lock.close()
+
+def record_check(metrics, filename=None):
+    """
+    Adds the metrics of a finished check to the metrics file. The values of
+    a root are replaced by those of its last check, the totals are summed up.
+    """
+    now = time.time()
+    def update(data):
+        data['checks_total'] = data.get('checks_total', 0) + 1
+        data['mails_queued_total'] = data.get('mails_queued_total', 0) + metrics.mails_queued
+        data['last_check'] = now
+        data['last_check_duration_seconds'] = round(now - metrics.started, 6)
+        data['stages'] = OrderedDict([ (stage, round(seconds, 6)) for (stage, seconds) in metrics.stages.items() ])
+        roots = data.setdefault('roots', OrderedDict())
+        for (root, root_metrics) in metrics.roots.items():
+            record = root_metrics.as_dict()
+            record['checks_total'] = roots.get(root, {}).get('checks_total', 0) + 1
+            record['last_check'] = now
+            roots[root] = record
+    try:
+        _update_metrics(update, filename)
+    except (IOError, OSError) as e:
+        logger.error('Unable to record the metrics of the check: %s' % e)
+
+def record_mails(num_sent, num_failed, filename=None):
+    """
+    Adds the number of delivered and failed notification mails to the
+    metrics file.
+    """
+    def update(data):
+        data['mails_sent_total'] = data.get('mails_sent_total', 0) + num_sent
+        data['mails_failed_total'] = data.get('mails_failed_total', 0) + num_failed
+    try:
+        _update_metrics(update, filename)
+    except (IOError, OSError) as e:
+        logger.error('Unable to record the metrics of the notifications: %s' % e)
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def format_prometheus(data):
+    """
+    Returns the recorded metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    def metric(name, kind, description, samples):
+        lines.append('# HELP filewatch_%s %s' % (name, description))
+        lines.append('# TYPE filewatch_%s %s' % (name, kind))
+        for (labels, value) in samples:
+            if labels:
+                label_text = ','.join([ '%s="%s"' % (key, _escape_label(label)) for (key, label) in labels ])
+                lines.append('filewatch_%s{%s} %s' % (name, label_text, _format_value(value)))
+            else:
+                lines.append('filewatch_%s %s' % (name, _format_value(value)))
+
+    metric('checks_total', 'counter', 'Number of finished checks', [ ((), data.get('checks_total', 0)) ])
+    metric('mails_queued_total', 'counter', 'Number of notification mails queued', [ ((), data.get('mails_queued_total', 0)) ])
+    metric('mails_sent_total', 'counter', 'Number of notification mails sent', [ ((), data.get('mails_sent_total', 0)) ])
+    metric('mails_failed_total', 'counter', 'Number of notification mails which could not be sent', [ ((), data.get('mails_failed_total', 0)) ])
+    if 'last_check' in data:
+        metric('last_check_timestamp_seconds', 'gauge', 'Time of the last finished check', [ ((), data['last_check']) ])
+        metric('last_check_duration_seconds', 'gauge', 'Duration of the last finished check', [ ((), data['last_check_duration_seconds']) ])
+    stages = data.get('stages', {})
+    if stages:
+        metric('stage_seconds', 'gauge', 'Time spent in each stage of the last check',
+               [ ((('stage', stage),), seconds) for (stage, seconds) in stages.items() ])
+    roots = data.get('roots', {})
+    if roots:
+        metric('root_checks_total', 'counter', 'Number of checks of the root',
+               [ ((('root', root),), record.get('checks_total', 0)) for (root, record) in roots.items() ])
+        metric('root_last_check_timestamp_seconds', 'gauge', 'Time of the last check of the root',
+               [ ((('root', root),), record.get('last_check', 0)) for (root, record) in roots.items() ])
+        for (name, description) in ROOT_COUNTERS.items():
+            metric('root_' + name, 'gauge', description + ' (last check of the root)',
+                   [ ((('root', root),), record.get(name, 0)) for (root, record) in roots.items() ])
+        for (name, description) in ROOT_TIMERS.items():
+            metric('root_%s_seconds' % name, 'gauge', description + ' (last check of the root)',
+                   [ ((('root', root),), record.get(name + '_seconds', 0.0)) for (root, record) in roots.items() ])
+    return '\n'.join(lines) + '\n'
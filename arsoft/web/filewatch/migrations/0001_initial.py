@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileWatchItemModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('filename', models.CharField(verbose_name='Filename', max_length=512, unique=True, help_text='Enter full path for a file to watch')),
+                ('created', models.DateTimeField(verbose_name='Created')),
+                ('modified', models.DateTimeField(verbose_name='Modified')),
+                ('uid', models.IntegerField(verbose_name='uid')),
+                ('gid', models.IntegerField(verbose_name='gid')),
+                ('mode', models.IntegerField(verbose_name='mode')),
+                ('size', models.IntegerField(verbose_name='size')),
+            ],
+            options={
+                'verbose_name': 'file',
+                'verbose_name_plural': 'files',
+            },
+        ),
+        migrations.CreateModel(
+            name='FileWatchModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('filename', models.CharField(verbose_name='Filename', max_length=512, unique=True, help_text='Enter full path for a file/directory to watch')),
+                ('recursive', models.BooleanField(verbose_name='Recursive', default=True, help_text='Check for files inside the given directory')),
+                ('notify', models.EmailField(verbose_name='notify', max_length=254, help_text='email address for the notification')),
+            ],
+            options={
+                'verbose_name': 'file',
+                'verbose_name_plural': 'files',
+            },
+        ),
+        migrations.AddField(
+            model_name='filewatchitemmodel',
+            name='watchid',
+            field=models.ForeignKey(to='filewatch.FileWatchModel'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileWatchDirectoryModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('dirname', models.CharField(verbose_name='Directory', max_length=512)),
+                ('mtime_ns', models.BigIntegerField(verbose_name='Modified (ns)')),
+                ('ctime_ns', models.BigIntegerField(verbose_name='Changed (ns)')),
+                ('num_children', models.IntegerField(verbose_name='Number of entries')),
+            ],
+            options={
+                'verbose_name': 'directory',
+                'verbose_name_plural': 'directories',
+            },
+        ),
+        migrations.AddField(
+            model_name='filewatchmodel',
+            name='last_full_scan',
+            field=models.DateTimeField(verbose_name='Last full scan', blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='filewatchdirectorymodel',
+            name='watchid',
+            field=models.ForeignKey(to='filewatch.FileWatchModel'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='filewatchdirectorymodel',
+            unique_together=set([('watchid', 'dirname')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0002_incremental'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchitemmodel',
+            name='checksum',
+            field=models.CharField(verbose_name='checksum', max_length=160, blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='filewatchitemmodel',
+            name='inode',
+            field=models.BigIntegerField(verbose_name='inode', blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='filewatchmodel',
+            name='checksum',
+            field=models.CharField(verbose_name='Checksum', max_length=16, blank=True, default='', choices=[('', 'None'), ('sha256', 'SHA-256'), ('sha512', 'SHA-512'), ('blake2b', 'BLAKE2b')], help_text='Algorithm to check the content of the files'),
+        ),
+    ]
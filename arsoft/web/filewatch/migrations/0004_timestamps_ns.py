@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.conf import settings
+from django.utils import timezone
+from datetime import datetime, timedelta
+
+
+# number of rows converted with one statement
+CHUNK_SIZE = 1000
+
+# the conversion is done here, so the migration does not depend on the
+# application code; naive datetimes are taken as UTC
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _datetime_to_ns(dt):
+    delta = dt - (_EPOCH if dt.tzinfo is None else _EPOCH_UTC)
+    return ((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds) * 1000
+
+
+def _ns_to_datetime(ns):
+    return (_EPOCH_UTC if settings.USE_TZ else _EPOCH) + timedelta(microseconds=ns // 1000)
+
+
+def _convert_rows(apps, schema_editor, source, target, convert):
+    # the rows are read in chunks by primary key and written with one
+    # executemany per chunk instead of a save() per row, so large tables
+    # are converted quickly
+    FileWatchItemModel = apps.get_model('filewatch', 'FileWatchItemModel')
+    connection = schema_editor.connection
+    qn = connection.ops.quote_name
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (qn(FileWatchItemModel._meta.db_table),
+                                               ', '.join([ '%s = %%s' % qn(column) for column in target ]), qn('id'))
+    qs = FileWatchItemModel.objects.order_by('pk').values_list('pk', *source)
+    last_pk = None
+    while True:
+        rows = list((qs.filter(pk__gt=last_pk) if last_pk is not None else qs)[:CHUNK_SIZE])
+        if not rows:
+            break
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [ convert(*row[1:]) + (row[0],) for row in rows ])
+        last_pk = rows[-1][0]
+
+
+def datetimes_to_ns(apps, schema_editor):
+    # the datetimes only have a resolution of microseconds, so the
+    # converted timestamps are multiples of 1000 (see timestamp_changed)
+    _convert_rows(apps, schema_editor, ('created', 'modified'), ('ctime_ns', 'mtime_ns'),
+                  lambda created, modified: (_datetime_to_ns(created), _datetime_to_ns(modified)))
+
+
+def ns_to_datetimes(apps, schema_editor):
+    ops = schema_editor.connection.ops
+    # renamed in Django 1.9
+    adapt = getattr(ops, 'adapt_datetimefield_value', None) or ops.value_to_db_datetime
+    _convert_rows(apps, schema_editor, ('ctime_ns', 'mtime_ns'), ('created', 'modified'),
+                  lambda ctime_ns, mtime_ns: (adapt(_ns_to_datetime(ctime_ns)), adapt(_ns_to_datetime(mtime_ns))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0003_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchitemmodel',
+            name='ctime_ns',
+            field=models.BigIntegerField(verbose_name='Created (ns)', default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='filewatchitemmodel',
+            name='mtime_ns',
+            field=models.BigIntegerField(verbose_name='Modified (ns)', default=0),
+            preserve_default=False,
+        ),
+        # allow empty datetimes, so the migration can be reversed
+        migrations.AlterField(
+            model_name='filewatchitemmodel',
+            name='created',
+            field=models.DateTimeField(verbose_name='Created', null=True),
+        ),
+        migrations.AlterField(
+            model_name='filewatchitemmodel',
+            name='modified',
+            field=models.DateTimeField(verbose_name='Modified', null=True),
+        ),
+        migrations.RunPython(datetimes_to_ns, ns_to_datetimes),
+        migrations.RemoveField(
+            model_name='filewatchitemmodel',
+            name='created',
+        ),
+        migrations.RemoveField(
+            model_name='filewatchitemmodel',
+            name='modified',
+        ),
+        migrations.AlterField(
+            model_name='filewatchitemmodel',
+            name='filename',
+            field=models.CharField(verbose_name='Filename', max_length=512, help_text='Enter full path for a file to watch'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='filewatchitemmodel',
+            unique_together=set([('watchid', 'filename')]),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0004_timestamps_ns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileWatchJobModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('state', models.CharField(verbose_name='State', max_length=16, default='queued', choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')])),
+                ('verbose', models.BooleanField(verbose_name='Verbose', default=False)),
+                ('notify', models.BooleanField(verbose_name='Notify', default=True)),
+                ('incremental', models.NullBooleanField(verbose_name='Incremental')),
+                ('full', models.BooleanField(verbose_name='Full scan', default=False)),
+                ('created', models.DateTimeField(verbose_name='Created', default=django.utils.timezone.now)),
+                ('started', models.DateTimeField(verbose_name='Started', blank=True, null=True)),
+                ('finished', models.DateTimeField(verbose_name='Finished', blank=True, null=True)),
+                ('worker', models.CharField(verbose_name='Worker', max_length=128, blank=True, default='')),
+                ('watchid', models.ForeignKey(blank=True, null=True, to='filewatch.FileWatchModel')),
+            ],
+            options={
+                'verbose_name': 'check job',
+                'verbose_name_plural': 'check jobs',
+            },
+        ),
+        migrations.CreateModel(
+            name='FileWatchLockModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('acquired', models.DateTimeField(verbose_name='Acquired', default=django.utils.timezone.now)),
+                ('job', models.ForeignKey(to='filewatch.FileWatchJobModel')),
+                ('watchid', models.OneToOneField(to='filewatch.FileWatchModel')),
+            ],
+            options={
+                'verbose_name': 'lock',
+                'verbose_name_plural': 'locks',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0005_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchjobmodel',
+            name='exclude',
+            field=models.TextField(verbose_name='Exclude', blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='filewatchjobmodel',
+            name='include',
+            field=models.TextField(verbose_name='Include', blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='filewatchjobmodel',
+            name='subtree',
+            field=models.CharField(verbose_name='Subtree', max_length=512, blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='filewatchmodel',
+            name='exclude',
+            field=models.TextField(verbose_name='Exclude', blank=True, default='', help_text='Skip the files and directories matching these glob patterns (one per line)'),
+        ),
+        migrations.AddField(
+            model_name='filewatchmodel',
+            name='include',
+            field=models.TextField(verbose_name='Include', blank=True, default='', help_text='Only check the files matching these glob patterns (one per line)'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0006_filters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchmodel',
+            name='check_interval',
+            field=models.IntegerField(verbose_name='Check interval', default=0, help_text='Seconds between the checks by the scheduler (0 disables the scheduled checks)'),
+        ),
+        migrations.AddField(
+            model_name='filewatchmodel',
+            name='last_check',
+            field=models.DateTimeField(verbose_name='Last check', blank=True, null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='filewatchmodel',
+            name='priority',
+            field=models.IntegerField(verbose_name='Priority', default=0, help_text='Items with a higher priority are checked first when several are due'),
+        ),
+    ]
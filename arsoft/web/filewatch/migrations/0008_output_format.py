@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0007_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchjobmodel',
+            name='output_format',
+            field=models.CharField(verbose_name='Output format', max_length=8, default='text', choices=[('text', 'Text'), ('json', 'JSON lines')]),
+        ),
+    ]
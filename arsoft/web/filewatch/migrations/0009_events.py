@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0008_output_format'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileWatchEventModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('run_id', models.CharField(verbose_name='Run', max_length=32, db_index=True)),
+                ('time', models.DateTimeField(verbose_name='Time', db_index=True)),
+                ('filename', models.CharField(verbose_name='Filename', max_length=512)),
+                ('kind', models.CharField(verbose_name='Change', max_length=16, choices=[('added', 'Added'), ('deleted', 'Deleted'), ('ctime', 'Create time'), ('mtime', 'Modification time'), ('owner', 'Owner'), ('group', 'Group'), ('mode', 'Mode'), ('size', 'Size'), ('checksum', 'Checksum')])),
+                ('old_value', models.CharField(verbose_name='Old value', max_length=160, blank=True, default='')),
+                ('new_value', models.CharField(verbose_name='New value', max_length=160, blank=True, default='')),
+                ('watchid', models.ForeignKey(to='filewatch.FileWatchModel', db_index=False)),
+            ],
+            options={
+                'verbose_name': 'change event',
+                'verbose_name_plural': 'change events',
+            },
+        ),
+        migrations.CreateModel(
+            name='FileWatchEventSummaryModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('day', models.DateField(verbose_name='Day')),
+                ('kind', models.CharField(verbose_name='Change', max_length=16, choices=[('added', 'Added'), ('deleted', 'Deleted'), ('ctime', 'Create time'), ('mtime', 'Modification time'), ('owner', 'Owner'), ('group', 'Group'), ('mode', 'Mode'), ('size', 'Size'), ('checksum', 'Checksum')])),
+                ('num_events', models.IntegerField(verbose_name='Number of events')),
+                ('num_files', models.IntegerField(verbose_name='Number of files')),
+                ('watchid', models.ForeignKey(to='filewatch.FileWatchModel')),
+            ],
+            options={
+                'verbose_name': 'change summary',
+                'verbose_name_plural': 'change summaries',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='filewatcheventsummarymodel',
+            unique_together=set([('watchid', 'day', 'kind')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='filewatcheventmodel',
+            index_together=set([('watchid', 'time'), ('watchid', 'filename', 'time')]),
+        ),
+    ]
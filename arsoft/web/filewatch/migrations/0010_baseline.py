@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0009_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchmodel',
+            name='revision',
+            field=models.IntegerField(verbose_name='Revision', default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0010_baseline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchitemmodel',
+            name='device',
+            field=models.BigIntegerField(verbose_name='device', blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='filewatcheventmodel',
+            name='kind',
+            field=models.CharField(verbose_name='Change', max_length=16, choices=[('added', 'Added'), ('deleted', 'Deleted'), ('ctime', 'Create time'), ('mtime', 'Modification time'), ('owner', 'Owner'), ('group', 'Group'), ('mode', 'Mode'), ('size', 'Size'), ('checksum', 'Checksum'), ('moved', 'Moved')]),
+        ),
+        migrations.AlterField(
+            model_name='filewatcheventsummarymodel',
+            name='kind',
+            field=models.CharField(verbose_name='Change', max_length=16, choices=[('added', 'Added'), ('deleted', 'Deleted'), ('ctime', 'Create time'), ('mtime', 'Modification time'), ('owner', 'Owner'), ('group', 'Group'), ('mode', 'Mode'), ('size', 'Size'), ('checksum', 'Checksum'), ('moved', 'Moved')]),
+        ),
+    ]
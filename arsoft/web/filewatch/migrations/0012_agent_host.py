@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0011_moves'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchmodel',
+            name='host',
+            field=models.CharField(verbose_name='Host', max_length=255, blank=True, default='', help_text='Host whose agent checks the item (empty for this host)'),
+        ),
+    ]
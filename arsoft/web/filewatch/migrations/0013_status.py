@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def count_files(apps, schema_editor):
+    # the items checked before get their totals once, the counts of the
+    # changes follow with their next check
+    FileWatchModel = apps.get_model('filewatch', 'FileWatchModel')
+    FileWatchItemModel = apps.get_model('filewatch', 'FileWatchItemModel')
+    FileWatchStatusModel = apps.get_model('filewatch', 'FileWatchStatusModel')
+    for item in FileWatchModel.objects.filter(last_check__isnull=False):
+        totals = FileWatchItemModel.objects.filter(watchid=item).aggregate(num_files=Count('id'), total_size=Sum('size'))
+        FileWatchStatusModel.objects.create(watchid=item, num_files=totals['num_files'], total_size=totals['total_size'] or 0,
+                                            last_run=item.last_check)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0012_agent_host'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileWatchStatusModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('num_files', models.IntegerField(verbose_name='Files', default=0)),
+                ('total_size', models.BigIntegerField(verbose_name='Total size', default=0)),
+                ('last_run', models.DateTimeField(verbose_name='Last run')),
+                ('duration', models.FloatField(verbose_name='Duration (s)', default=0)),
+                ('num_added', models.IntegerField(verbose_name='Added', default=0)),
+                ('num_changed', models.IntegerField(verbose_name='Changed', default=0)),
+                ('num_moved', models.IntegerField(verbose_name='Moved', default=0)),
+                ('num_deleted', models.IntegerField(verbose_name='Deleted', default=0)),
+                ('watchid', models.OneToOneField(related_name='status', to='filewatch.FileWatchModel')),
+            ],
+            options={
+                'verbose_name': 'status',
+                'verbose_name_plural': 'status',
+            },
+        ),
+        migrations.RunPython(count_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0013_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchjobmodel',
+            name='num_mails_failed',
+            field=models.IntegerField(verbose_name='Mails failed', blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='filewatchjobmodel',
+            name='num_mails_ok',
+            field=models.IntegerField(verbose_name='Mails sent', blank=True, null=True),
+        ),
+    ]
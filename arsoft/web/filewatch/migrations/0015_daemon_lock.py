@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0014_job_mails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchlockmodel',
+            name='worker',
+            field=models.CharField(verbose_name='Worker', max_length=128, blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='filewatchlockmodel',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, to='filewatch.FileWatchJobModel'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0015_daemon_lock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filewatchjobmodel',
+            name='queue_key',
+            field=models.CharField(verbose_name='Queue key', max_length=40, unique=True, blank=True, null=True, editable=False),
+        ),
+    ]
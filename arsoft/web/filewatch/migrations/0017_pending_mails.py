@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0016_job_queue_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileWatchMailModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('message', models.BinaryField(verbose_name='Message')),
+                ('attempt', models.IntegerField(verbose_name='Attempt', default=0)),
+                ('next_attempt', models.DateTimeField(verbose_name='Next attempt', default=django.utils.timezone.now)),
+                ('worker', models.CharField(verbose_name='Worker', max_length=128, blank=True, db_index=True, default='')),
+                ('created', models.DateTimeField(verbose_name='Created', default=django.utils.timezone.now)),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='filewatch.FileWatchJobModel')),
+            ],
+            options={
+                'verbose_name': 'mail',
+                'verbose_name_plural': 'mails',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0017_pending_mails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileWatchAgentNonceModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('nonce', models.CharField(verbose_name='Nonce', max_length=32)),
+                ('time', models.DateTimeField(verbose_name='Time', db_index=True, default=django.utils.timezone.now)),
+                ('watchid', models.ForeignKey(to='filewatch.FileWatchModel')),
+            ],
+            options={
+                'verbose_name': 'agent nonce',
+                'verbose_name_plural': 'agent nonces',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='filewatchagentnoncemodel',
+            unique_together=set([('watchid', 'nonce')]),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# (table, column) pairs read in code point order by merge_files and
+# load_directory_snapshot
+COLUMNS = [
+    ('filewatch_filewatchitemmodel', 'filename'),
+    ('filewatch_filewatchdirectorymodel', 'dirname'),
+    ]
+
+
+def _index_name(table, column):
+    return '%s_%s_c' % (table, column)
+
+
+def _mysql_modify(schema_editor, table, column, binary):
+    qn = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT CHARACTER_SET_NAME, COLLATION_NAME FROM information_schema.COLUMNS '
+                       'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s', [table, column])
+        charset, collation = cursor.fetchone()
+    if binary:
+        collation = '%s_bin' % charset
+    else:
+        collation = '%s_general_ci' % charset
+    schema_editor.execute('ALTER TABLE %s MODIFY %s VARCHAR(512) CHARACTER SET %s COLLATE %s NOT NULL' %
+                          (qn(table), qn(column), charset, collation))
+
+
+def forwards(apps, schema_editor):
+    # SQLite already compares the UTF-8 bytes, which sort like the code
+    # points. PostgreSQL gets an index matching the COLLATE "C" ordering
+    # of the queries, MySQL a binary collation on the columns.
+    vendor = schema_editor.connection.vendor
+    qn = schema_editor.quote_name
+    for table, column in COLUMNS:
+        if vendor == 'postgresql':
+            schema_editor.execute('CREATE INDEX %s ON %s (%s, %s COLLATE "C")' %
+                                  (qn(_index_name(table, column)), qn(table), qn('watchid_id'), qn(column)))
+        elif vendor == 'mysql':
+            _mysql_modify(schema_editor, table, column, binary=True)
+
+
+def backwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    qn = schema_editor.quote_name
+    for table, column in COLUMNS:
+        if vendor == 'postgresql':
+            schema_editor.execute('DROP INDEX %s' % qn(_index_name(table, column)))
+        elif vendor == 'mysql':
+            _mysql_modify(schema_editor, table, column, binary=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filewatch', '0018_agent_nonce'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
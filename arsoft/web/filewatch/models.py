@@ -3,14 +3,28 @@
 # kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
 
 from django.db import models
-from django import forms
-from datetime import datetime
+from django.utils import timezone
 from arsoft.timestamp import utc_timestamp_to_datetime
+from arsoft.web.filewatch.scan import ns_to_timestamp
+from arsoft.web.filewatch.hashing import CHECKSUM_CHOICES, CHECKSUM_NONE
+from arsoft.web.filewatch.metrics import OUTPUT_FORMAT_CHOICES, OUTPUT_TEXT
+from arsoft.web.filewatch.compare import CHANGE_CHOICES
 
 class FileWatchModel(models.Model):
     filename = models.CharField('Filename', max_length=512, unique=True, help_text='Enter full path for a file/directory to watch')
     recursive = models.BooleanField('Recursive', default=True, help_text='Check for files inside the given directory')
     notify = models.EmailField('notify', help_text='email address for the notification')
+    checksum = models.CharField('Checksum', max_length=16, choices=CHECKSUM_CHOICES, default=CHECKSUM_NONE, blank=True, help_text='Algorithm to check the content of the files')
+    include = models.TextField('Include', blank=True, default='', help_text='Only check the files matching these glob patterns (one per line)')
+    exclude = models.TextField('Exclude', blank=True, default='', help_text='Skip the files and directories matching these glob patterns (one per line)')
+    check_interval = models.IntegerField('Check interval', default=0, help_text='Seconds between the checks by the scheduler (0 disables the scheduled checks)')
+    priority = models.IntegerField('Priority', default=0, help_text='Items with a higher priority are checked first when several are due')
+    host = models.CharField('Host', max_length=255, blank=True, default='', help_text='Host whose agent checks the item (empty for this host)')
+    last_check = models.DateTimeField('Last check', null=True, blank=True, editable=False)
+    last_full_scan = models.DateTimeField('Last full scan', null=True, blank=True, editable=False)
+    # incremented whenever the file entries of the item change, so a
+    # baseline file can tell whether it is up to date
+    revision = models.IntegerField('Revision', default=0, editable=False)
 
     class Meta:
         verbose_name = "file"
@@ -22,28 +36,194 @@ class FileWatchModel(models.Model):
 
 class FileWatchItemModel(models.Model):
     watchid = models.ForeignKey(FileWatchModel)
-    filename = models.CharField('Filename', max_length=512, unique=True, help_text='Enter full path for a file to watch')
-    created = models.DateTimeField('Created')
-    modified = models.DateTimeField('Modified')
+    filename = models.CharField('Filename', max_length=512, help_text='Enter full path for a file to watch')
+    ctime_ns = models.BigIntegerField('Created (ns)')
+    mtime_ns = models.BigIntegerField('Modified (ns)')
     uid = models.IntegerField('uid')
     gid = models.IntegerField('gid')
     mode = models.IntegerField('mode')
     size = models.IntegerField('size')
+    inode = models.BigIntegerField('inode', null=True, blank=True)
+    device = models.BigIntegerField('device', null=True, blank=True)
+    checksum = models.CharField('checksum', max_length=160, blank=True, default='')
 
     class Meta:
         verbose_name = "file"
         verbose_name_plural = "files"
+        # the files are always looked up by watch item and filename
+        unique_together = (('watchid', 'filename'),)
 
     def __unicode__(self):
         return '%s' % (self.filename)
 
-class FileWatchItemFromDisk(object):
-    def __init__(self, filename, file_stats):
-        self.filename = filename
-        self.created = utc_timestamp_to_datetime(file_stats.st_ctime)
-        self.modified = utc_timestamp_to_datetime(file_stats.st_mtime)
-        self.uid = file_stats.st_uid
-        self.gid = file_stats.st_gid
-        self.mode = file_stats.st_mode
-        self.size = file_stats.st_size
-        
+    @property
+    def created(self):
+        return utc_timestamp_to_datetime(ns_to_timestamp(self.ctime_ns))
+
+    @property
+    def modified(self):
+        return utc_timestamp_to_datetime(ns_to_timestamp(self.mtime_ns))
+
+class FileWatchDirectoryModel(models.Model):
+    watchid = models.ForeignKey(FileWatchModel)
+    dirname = models.CharField('Directory', max_length=512)
+    mtime_ns = models.BigIntegerField('Modified (ns)')
+    ctime_ns = models.BigIntegerField('Changed (ns)')
+    num_children = models.IntegerField('Number of entries')
+
+    class Meta:
+        verbose_name = "directory"
+        verbose_name_plural = "directories"
+        unique_together = (('watchid', 'dirname'),)
+
+    def __unicode__(self):
+        return '%s' % (self.dirname)
+
+class FileWatchEventModel(models.Model):
+    # the history of the changes, which is only appended to. The composite
+    # indexes serve the queries by watch item and time and by file, so the
+    # foreign key does not need an index of its own.
+    watchid = models.ForeignKey(FileWatchModel, db_index=False)
+    run_id = models.CharField('Run', max_length=32, db_index=True)
+    time = models.DateTimeField('Time', db_index=True)
+    filename = models.CharField('Filename', max_length=512)
+    kind = models.CharField('Change', max_length=16, choices=CHANGE_CHOICES)
+    old_value = models.CharField('Old value', max_length=160, blank=True, default='')
+    new_value = models.CharField('New value', max_length=160, blank=True, default='')
+
+    class Meta:
+        verbose_name = "change event"
+        verbose_name_plural = "change events"
+        index_together = (('watchid', 'time'), ('watchid', 'filename', 'time'))
+
+    def __unicode__(self):
+        return '%s %s' % (self.filename, self.kind)
+
+class FileWatchEventSummaryModel(models.Model):
+    # the change events older than EVENT_RETENTION_DAYS rolled up per day
+    watchid = models.ForeignKey(FileWatchModel)
+    day = models.DateField('Day')
+    kind = models.CharField('Change', max_length=16, choices=CHANGE_CHOICES)
+    num_events = models.IntegerField('Number of events')
+    num_files = models.IntegerField('Number of files')
+
+    class Meta:
+        verbose_name = "change summary"
+        verbose_name_plural = "change summaries"
+        unique_together = (('watchid', 'day', 'kind'),)
+
+    def __unicode__(self):
+        return '%s %s' % (self.day, self.kind)
+
+class FileWatchStatusModel(models.Model):
+    # the totals of each watch item after its last check, so the dashboard
+    # does not need to read the files
+    watchid = models.OneToOneField(FileWatchModel, related_name='status')
+    num_files = models.IntegerField('Files', default=0)
+    total_size = models.BigIntegerField('Total size', default=0)
+    last_run = models.DateTimeField('Last run')
+    duration = models.FloatField('Duration (s)', default=0)
+    num_added = models.IntegerField('Added', default=0)
+    num_changed = models.IntegerField('Changed', default=0)
+    num_moved = models.IntegerField('Moved', default=0)
+    num_deleted = models.IntegerField('Deleted', default=0)
+
+    class Meta:
+        verbose_name = "status"
+        verbose_name_plural = "status"
+
+    def __unicode__(self):
+        return '%s' % (self.watchid)
+
+class FileWatchJobModel(models.Model):
+    STATE_QUEUED = 'queued'
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+    STATE_FAILED = 'failed'
+    STATE_CHOICES = (
+        (STATE_QUEUED, 'Queued'),
+        (STATE_RUNNING, 'Running'),
+        (STATE_DONE, 'Done'),
+        (STATE_FAILED, 'Failed'),
+        )
+
+    # no watch item means all items
+    watchid = models.ForeignKey(FileWatchModel, null=True, blank=True)
+    state = models.CharField('State', max_length=16, choices=STATE_CHOICES, default=STATE_QUEUED)
+    verbose = models.BooleanField('Verbose', default=False)
+    notify = models.BooleanField('Notify', default=True)
+    incremental = models.NullBooleanField('Incremental')
+    full = models.BooleanField('Full scan', default=False)
+    subtree = models.CharField('Subtree', max_length=512, blank=True, default='')
+    include = models.TextField('Include', blank=True, default='')
+    exclude = models.TextField('Exclude', blank=True, default='')
+    output_format = models.CharField('Output format', max_length=8, choices=OUTPUT_FORMAT_CHOICES, default=OUTPUT_TEXT)
+    created = models.DateTimeField('Created', default=timezone.now)
+    started = models.DateTimeField('Started', null=True, blank=True)
+    finished = models.DateTimeField('Finished', null=True, blank=True)
+    worker = models.CharField('Worker', max_length=128, blank=True, default='')
+    # identifies the queued jobs with the same options, so the same check
+    # is not queued twice; cleared when the job starts
+    queue_key = models.CharField('Queue key', max_length=40, null=True, blank=True, unique=True, editable=False)
+    # set when the notification mails of the check are delivered
+    num_mails_ok = models.IntegerField('Mails sent', null=True, blank=True)
+    num_mails_failed = models.IntegerField('Mails failed', null=True, blank=True)
+
+    class Meta:
+        verbose_name = "check job"
+        verbose_name_plural = "check jobs"
+
+    def __unicode__(self):
+        return '%i' % (self.id)
+
+    @property
+    def is_finished(self):
+        return self.state == self.STATE_DONE or self.state == self.STATE_FAILED
+
+class FileWatchMailModel(models.Model):
+    # a notification mail which is not delivered yet, so it is delivered by
+    # the worker when the process which sent it exits before
+    job = models.ForeignKey(FileWatchJobModel, null=True, blank=True, on_delete=models.SET_NULL)
+    message = models.BinaryField('Message')
+    attempt = models.IntegerField('Attempt', default=0)
+    next_attempt = models.DateTimeField('Next attempt', default=timezone.now)
+    # the process delivering the mail, empty if it is left to the worker
+    worker = models.CharField('Worker', max_length=128, blank=True, default='', db_index=True)
+    created = models.DateTimeField('Created', default=timezone.now)
+
+    class Meta:
+        verbose_name = "mail"
+        verbose_name_plural = "mails"
+
+    def __unicode__(self):
+        return '%i' % (self.id)
+
+class FileWatchAgentNonceModel(models.Model):
+    # the nonces of the recent requests of the agent of a watch item, so a
+    # captured request cannot be sent again
+    watchid = models.ForeignKey(FileWatchModel)
+    nonce = models.CharField('Nonce', max_length=32)
+    time = models.DateTimeField('Time', default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "agent nonce"
+        verbose_name_plural = "agent nonces"
+        unique_together = (('watchid', 'nonce'),)
+
+    def __unicode__(self):
+        return '%s' % (self.nonce)
+
+class FileWatchLockModel(models.Model):
+    # only one job at a time may check a watch item; the watch daemon
+    # locks an item without a job, identified by its worker name
+    watchid = models.OneToOneField(FileWatchModel)
+    job = models.ForeignKey(FileWatchJobModel, null=True, blank=True)
+    worker = models.CharField('Worker', max_length=128, blank=True, default='')
+    acquired = models.DateTimeField('Acquired', default=timezone.now)
+
+    class Meta:
+        verbose_name = "lock"
+        verbose_name_plural = "locks"
+
+    def __unicode__(self):
+        return '%s' % (self.watchid)
@@ -0,0 +1,276 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import connections
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from arsoft.web.filewatch.models import FileWatchJobModel, FileWatchMailModel
+from arsoft.web.filewatch.metrics import record_mails
+
+import atexit
+import heapq
+import pickle
+import threading
+import time
+from datetime import timedelta
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# import the logging library
+import logging
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+class NotificationJob(object):
+    """
+    A list of messages handed to the dispatcher, each with the id of its
+    FileWatchMailModel row. The messages which could not be delivered are
+    retried until NOTIFY_RETRY_COUNT attempts failed. The number of
+    delivered and failed mails is added to the FileWatchJobModel job_id.
+    """
+    def __init__(self, mails, job_id=None, attempt=0):
+        self.mails = list(mails)
+        self.job_id = job_id
+        self.num_mails_ok = 0
+        self.num_mails_failed = 0
+        self.attempt = attempt
+        self.last_error = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits until all messages are delivered or given up and returns
+        whether the job is done.
+        """
+        return self._done.wait(timeout)
+
+class NotificationDispatcher(object):
+    """
+    Delivers the notification mails in a background thread, so sending
+    does not block the check. All pending messages are sent over a single
+    connection of the mail backend. Failed messages are retried after
+    NOTIFY_RETRY_DELAY seconds, doubling the delay for every attempt.
+
+    The messages are stored in the database until they are delivered. The
+    mails left when the process exits, or of a process which is gone, are
+    taken over by the dispatcher of the worker (see resume).
+    """
+    def __init__(self, retry_count=None, retry_delay=None):
+        self._retry_count = settings.NOTIFY_RETRY_COUNT if retry_count is None else retry_count
+        self._retry_delay = settings.NOTIFY_RETRY_DELAY if retry_delay is None else retry_delay
+        self._queue = queue.Queue()
+        self._retries = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._jobs = []
+        self._name = None
+
+    @property
+    def name(self):
+        # the jobs module queues the checks with this module
+        from arsoft.web.filewatch.jobs import worker_name
+        name = worker_name()
+        if name != self._name:
+            # once per process, the dispatcher may be inherited by fork
+            self._name = name
+            atexit.register(self.release)
+        return name
+
+    def submit(self, messages, job_id=None):
+        """
+        Stores the given messages and queues them for delivery. The
+        delivery is recorded on the FileWatchJobModel job_id.
+        """
+        name = self.name
+        mails = []
+        for message in messages:
+            mail = FileWatchMailModel.objects.create(job_id=job_id, message=pickle.dumps(message, pickle.HIGHEST_PROTOCOL), worker=name)
+            mails.append( (mail.id, message) )
+        job = NotificationJob(mails, job_id)
+        if not job.mails:
+            job._done.set()
+            return job
+        self._start(job)
+        self._queue.put(job)
+        return job
+
+    def _start(self, job):
+        with self._lock:
+            self._jobs = [ j for j in self._jobs if not j.done ]
+            self._jobs.append(job)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='filewatch-notify')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def resume(self):
+        """
+        Takes over the stored mails which are left by their process or
+        whose process on this host is gone and queues them. Returns the
+        number of mails taken over.
+        """
+        from arsoft.web.filewatch.jobs import process_alive
+        name = self.name
+        hostname = name.rsplit(':', 1)[0]
+        for worker in set(FileWatchMailModel.objects.filter(worker__startswith=hostname + ':').exclude(worker=name).values_list('worker', flat=True)):
+            if not process_alive(int(worker.rsplit(':', 1)[1])):
+                FileWatchMailModel.objects.filter(worker=worker).update(worker='')
+        jobs = {}
+        for mail in FileWatchMailModel.objects.filter(worker='').order_by('id'):
+            # only one process can take over the mail
+            if not FileWatchMailModel.objects.filter(id=mail.id, worker='').update(worker=name):
+                continue
+            try:
+                message = pickle.loads(bytes(mail.message))
+            except Exception as e:
+                logger.error('Unable to load notification mail %i, dropping it: %s' % (mail.id, e))
+                mail.delete()
+                continue
+            key = (mail.job_id, mail.attempt, mail.next_attempt)
+            if key not in jobs:
+                jobs[key] = NotificationJob([], mail.job_id, mail.attempt)
+            jobs[key].mails.append( (mail.id, message) )
+        for ((job_id, attempt, next_attempt), job) in jobs.items():
+            self._start(job)
+            delay = (next_attempt - timezone.now()).total_seconds()
+            if delay > 0:
+                self._queue.put( (time.time() + delay, job) )
+            else:
+                self._queue.put(job)
+        return sum([ len(job.mails) for job in jobs.values() ])
+
+    def release(self):
+        """
+        Leaves the mails of this process which are not delivered yet to the
+        worker; called when the process exits.
+        """
+        try:
+            FileWatchMailModel.objects.filter(worker=self.name).update(worker='')
+        except Exception:
+            logger.exception('Unable to release the pending notification mails')
+
+    def wait(self, timeout=None):
+        """
+        Waits until all submitted jobs are done and returns whether they are.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            if not job.wait(max(0, deadline - time.time()) if deadline is not None else None):
+                return False
+        return True
+
+    def _next_jobs(self):
+        jobs = []
+        timeout = None
+        if self._retries:
+            timeout = max(0, self._retries[0][0] - time.time())
+        try:
+            jobs.append(self._queue.get(timeout=timeout))
+            while True:
+                jobs.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        ret = []
+        for job in jobs:
+            if isinstance(job, tuple):
+                # a resumed job which is retried later
+                heapq.heappush(self._retries, (job[0], id(job[1]), job[1]))
+            else:
+                ret.append(job)
+        now = time.time()
+        while self._retries and self._retries[0][0] <= now:
+            ret.append(heapq.heappop(self._retries)[2])
+        return ret
+
+    def _send(self, jobs):
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+        except Exception as e:
+            for job in jobs:
+                self._failed(job, job.mails, e)
+            return
+        try:
+            for job in jobs:
+                failed = []
+                error = None
+                for (mail_id, message) in job.mails:
+                    try:
+                        connection.send_messages([message])
+                        job.num_mails_ok += 1
+                    except Exception as e:
+                        failed.append( (mail_id, message) )
+                        error = e
+                    else:
+                        FileWatchMailModel.objects.filter(id=mail_id).delete()
+                if failed:
+                    self._failed(job, failed, error)
+                else:
+                    job.mails = []
+                    self._done(job)
+        finally:
+            connection.close()
+
+    def _failed(self, job, mails, error):
+        job.attempt += 1
+        job.last_error = error
+        job.mails = mails
+        mail_ids = [ mail_id for (mail_id, message) in mails ]
+        if job.attempt >= self._retry_count:
+            logger.error('Unable to send %i notification mails, giving up: %s' % (len(mails), error))
+            FileWatchMailModel.objects.filter(id__in=mail_ids).delete()
+            job.num_mails_failed += len(mails)
+            job.mails = []
+            self._done(job)
+        else:
+            delay = self._retry_delay * (2 ** (job.attempt - 1))
+            logger.warning('Unable to send %i notification mails, retry in %i seconds: %s' % (len(mails), delay, error))
+            FileWatchMailModel.objects.filter(id__in=mail_ids).update(attempt=job.attempt,
+                                                                     next_attempt=timezone.now() + timedelta(seconds=delay))
+            heapq.heappush(self._retries, (time.time() + delay, id(job), job))
+
+    def _done(self, job):
+        record_mails(job.num_mails_ok, job.num_mails_failed)
+        if job.job_id is not None:
+            # a job resumed by the worker adds to the counts of the check
+            FileWatchJobModel.objects.filter(id=job.job_id).update(
+                num_mails_ok=Coalesce(F('num_mails_ok'), 0) + job.num_mails_ok,
+                num_mails_failed=Coalesce(F('num_mails_failed'), 0) + job.num_mails_failed)
+        # the waiting threads see the recorded counts
+        job._done.set()
+
+    def _run(self):
+        while True:
+            jobs = self._next_jobs()
+            if jobs:
+                try:
+                    self._send(jobs)
+                finally:
+                    # the thread has its own database connection
+                    connections.close_all()
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    """
+    Returns the dispatcher shared by all checks of this process.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+        return _dispatcher
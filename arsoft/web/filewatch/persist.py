@@ -0,0 +1,411 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from arsoft.web.filewatch.models import FileWatchModel, FileWatchItemModel, FileWatchDirectoryModel, FileWatchEventModel
+from arsoft.web.filewatch.baseline import BaselineItem, BaselineReader, write_baseline, merge_delta
+
+import os
+import time
+
+class RevisionConflict(Exception):
+    """
+    The file entries of a watch item were changed by someone else.
+    """
+    pass
+
+class FileWatchItemWriter(object):
+    """
+    Collects the inserts, updates and deletes of the file entries for a
+    single watch item and writes them to the database in chunks. Each chunk
+    is written inside a single transaction, so the database does not need
+    to sync once for every file. With per_item all chunks of the watch item
+    share one transaction, which is committed by close().
+
+    With a run_id the changes passed to insert, update and delete are
+    appended to the change history as well, all with the time the writer
+    was created.
+
+    The entries may be model instances or BaselineItem read from a
+    baseline file, which are updated and deleted by their filename. The
+    first chunk written increments the revision of the watch item; delta
+    keeps the written entries by filename (None for deleted ones), so the
+    baseline can be updated without reading the database, until more than
+    CHECK_BASELINE_MAX_DELTA entries were written. With expected_revision
+    the writer raises RevisionConflict instead if the revision of the watch
+    item is not the expected one.
+    """
+
+    UPDATE_FIELDS = ['ctime_ns', 'mtime_ns', 'uid', 'gid', 'mode', 'size', 'inode', 'device', 'checksum']
+
+    def __init__(self, item, chunk_size=None, per_item=None, run_id=None, expected_revision=None):
+        self._item = item
+        self._expected_revision = expected_revision
+        self._run_id = run_id
+        self._time = timezone.now()
+        self._chunk_size = chunk_size if chunk_size else settings.CHECK_BULK_CHUNK_SIZE
+        if per_item is None:
+            per_item = settings.CHECK_BULK_TRANSACTION == 'item'
+        self._item_transaction = transaction.atomic() if per_item else None
+        if self._item_transaction is not None:
+            self._item_transaction.__enter__()
+        self._inserts = []
+        self._updates = []
+        self._deletes = []
+        self._moves = []
+        self._events = []
+        self._revision_changed = False
+        self.delta = {}
+        self.num_events = 0
+        self.num_inserted = 0
+        self.num_updated = 0
+        self.num_moved = 0
+        self.num_deleted = 0
+        self.elapsed = 0.0
+
+    @property
+    def num_written(self):
+        return self.num_inserted + self.num_updated + self.num_moved + self.num_deleted
+
+    @property
+    def rows_per_second(self):
+        return self.num_written / self.elapsed if self.elapsed > 0 else 0.0
+
+    def _record(self, filename, changes):
+        for change in changes:
+            self._events.append(FileWatchEventModel(watchid=self._item,
+                                                    run_id=self._run_id,
+                                                    time=self._time,
+                                                    filename=filename,
+                                                    kind=getattr(change, 'kind', ''),
+                                                    old_value=getattr(change, 'old', None) or '',
+                                                    new_value=getattr(change, 'new', None) or ''
+                                                    ))
+        if len(self._events) >= self._chunk_size:
+            self._flush_events()
+
+    def _keep(self, filename, entry):
+        if self.delta is None:
+            return
+        if len(self.delta) >= settings.CHECK_BASELINE_MAX_DELTA:
+            self.delta = None
+        else:
+            self.delta[filename] = entry
+
+    def _change_revision(self):
+        # within the transaction of the first chunk, so a baseline is never
+        # taken as current for changed entries
+        if not self._revision_changed:
+            qs = FileWatchModel.objects.filter(pk=self._item.pk)
+            if self._expected_revision is not None:
+                qs = qs.filter(revision=self._expected_revision)
+            if not qs.update(revision=F('revision') + 1) and self._expected_revision is not None:
+                raise RevisionConflict('revision of %s is not %i' % (self._item.filename, self._expected_revision))
+            self._revision_changed = True
+
+    def insert(self, disk_item, changes=None):
+        self._inserts.append(FileWatchItemModel(watchid=self._item,
+                                                filename=disk_item.filename,
+                                                ctime_ns=disk_item.ctime_ns,
+                                                mtime_ns=disk_item.mtime_ns,
+                                                uid=disk_item.uid,
+                                                gid=disk_item.gid,
+                                                mode=disk_item.mode,
+                                                size=disk_item.size,
+                                                inode=disk_item.ino,
+                                                device=disk_item.dev,
+                                                checksum=disk_item.checksum if disk_item.checksum else ''
+                                                ))
+        if len(self._inserts) >= self._chunk_size:
+            self._flush_inserts()
+        self._keep(disk_item.filename, BaselineItem.from_item(disk_item))
+        if changes and self._run_id is not None:
+            self._record(disk_item.filename, changes)
+
+    def update(self, db_item, changes=None):
+        self._updates.append(db_item)
+        if len(self._updates) >= self._chunk_size:
+            self._flush_updates()
+        self._keep(db_item.filename, BaselineItem.from_item(db_item))
+        if changes and self._run_id is not None:
+            self._record(db_item.filename, changes)
+
+    def delete(self, db_item, changes=None):
+        self._deletes.append(db_item)
+        self._keep(db_item.filename, None)
+        if len(self._deletes) >= self._chunk_size:
+            self._flush_deletes()
+        if changes and self._run_id is not None:
+            self._record(db_item.filename, changes)
+
+    def move(self, db_item, disk_item, changes=None):
+        """
+        Renames the entry db_item to the filename of disk_item; the other
+        values must have been taken over by db_item already.
+        """
+        old_filename = db_item.filename
+        db_item.filename = disk_item.filename
+        self._moves.append( (old_filename, db_item) )
+        if len(self._moves) >= self._chunk_size:
+            self._flush_moves()
+        self._keep(old_filename, None)
+        self._keep(db_item.filename, BaselineItem.from_item(db_item))
+        if changes and self._run_id is not None:
+            self._record(db_item.filename, changes)
+
+    def flush(self):
+        self._flush_inserts()
+        self._flush_updates()
+        self._flush_moves()
+        self._flush_deletes()
+        self._flush_events()
+
+    def close(self, exc_info=(None, None, None)):
+        """
+        Writes all pending changes and commits the transaction of the watch
+        item. When called with the exc_info of an error the pending changes
+        are discarded and the transaction is rolled back.
+        """
+        if exc_info[0] is None:
+            self.flush()
+        else:
+            self._inserts = []
+            self._updates = []
+            self._deletes = []
+            self._moves = []
+            self._events = []
+        if self._item_transaction is not None:
+            item_transaction = self._item_transaction
+            self._item_transaction = None
+            start = time.time()
+            item_transaction.__exit__(*exc_info)
+            self.elapsed += time.time() - start
+        if self._revision_changed:
+            self._item.revision = FileWatchModel.objects.filter(pk=self._item.pk).values_list('revision', flat=True)[0]
+
+    def _flush_inserts(self):
+        if not self._inserts:
+            return
+        start = time.time()
+        with transaction.atomic():
+            self._change_revision()
+            # the batches of the inserts are sized by the database backend,
+            # so they stay within the variable limit of SQLite
+            FileWatchItemModel.objects.bulk_create(self._inserts)
+        self.elapsed += time.time() - start
+        self.num_inserted += len(self._inserts)
+        self._inserts = []
+
+    def _flush_updates(self):
+        if not self._updates:
+            return
+        start = time.time()
+        # there is no bulk update for different values per row, but saving
+        # all rows within one transaction avoids the sync after every row.
+        with transaction.atomic():
+            self._change_revision()
+            for db_item in self._updates:
+                if db_item.pk is not None:
+                    db_item.save(update_fields=self.UPDATE_FIELDS)
+                else:
+                    values = dict([ (name, getattr(db_item, name)) for name in self.UPDATE_FIELDS ])
+                    FileWatchItemModel.objects.filter(watchid=self._item, filename=db_item.filename).update(**values)
+        self.elapsed += time.time() - start
+        self.num_updated += len(self._updates)
+        self._updates = []
+
+    def _flush_moves(self):
+        if not self._moves:
+            return
+        start = time.time()
+        with transaction.atomic():
+            self._change_revision()
+            for (old_filename, db_item) in self._moves:
+                if db_item.pk is not None:
+                    db_item.save(update_fields=self.UPDATE_FIELDS + ['filename'])
+                else:
+                    values = dict([ (name, getattr(db_item, name)) for name in self.UPDATE_FIELDS ])
+                    FileWatchItemModel.objects.filter(watchid=self._item, filename=old_filename).update(filename=db_item.filename, **values)
+        self.elapsed += time.time() - start
+        self.num_moved += len(self._moves)
+        self._moves = []
+
+    def _flush_deletes(self):
+        if not self._deletes:
+            return
+        start = time.time()
+        pks = [ db_item.pk for db_item in self._deletes if db_item.pk is not None ]
+        filenames = [ db_item.filename for db_item in self._deletes if db_item.pk is None ]
+        with transaction.atomic():
+            self._change_revision()
+            if pks:
+                FileWatchItemModel.objects.filter(pk__in=pks).delete()
+            if filenames:
+                FileWatchItemModel.objects.filter(watchid=self._item, filename__in=filenames).delete()
+        self.elapsed += time.time() - start
+        self.num_deleted += len(self._deletes)
+        self._deletes = []
+
+    def _flush_events(self):
+        if not self._events:
+            return
+        start = time.time()
+        with transaction.atomic():
+            FileWatchEventModel.objects.bulk_create(self._events)
+        self.elapsed += time.time() - start
+        self.num_events += len(self._events)
+        self._events = []
+
+def baseline_filename(item_id):
+    return os.path.join(settings.CHECK_BASELINE_DIR, '%i.fwb' % item_id)
+
+def open_baseline(item):
+    """
+    Returns a BaselineReader for the baseline of the given watch item or
+    None if there is none or it does not match the revision of the file
+    entries in the database.
+    """
+    try:
+        reader = BaselineReader(baseline_filename(item.id))
+    except (IOError, OSError, ValueError):
+        return None
+    if reader.item_id != item.id or reader.revision != item.revision:
+        reader.close()
+        return None
+    return reader
+
+def _binary_column(column):
+    # the column compared by the code points of its characters; SQLite
+    # compares the UTF-8 bytes, which gives the same order, and on MySQL
+    # the filename columns have a binary collation (migration 0019)
+    ret = connection.ops.quote_name(column)
+    if connection.vendor == 'postgresql':
+        ret += ' COLLATE "C"'
+    return ret
+
+def _next_filenames(qs, column, subtree=None, after=None):
+    """
+    Returns the given queryset ordered by the given filename column in the
+    order of the code points, which is the order of the walker and of the
+    baseline, and restricted to the names below subtree and after the given
+    name in the same order. The collation of the database would order the
+    names differently, e.g. ignoring the punctuation.
+    """
+    expr = _binary_column(column)
+    where = []
+    params = []
+    if subtree is not None:
+        prefix = os.path.join(subtree, '')
+        where += [ '%s >= %%s' % expr, '%s < %%s' % expr ]
+        params += [ prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1) ]
+    if after is not None:
+        where.append('%s > %%s' % expr)
+        params.append(after)
+    if where:
+        qs = qs.extra(where=where, params=params)
+    return qs.order_by(RawSQL(expr, []).asc())
+
+def iter_db_rows(item, batch_size=None):
+    """
+    Yields the file entries of the given watch item in the database as
+    BaselineItem sorted by filename, fetched in batches like
+    iter_files_in_db but without creating model instances.
+    """
+    if not batch_size:
+        batch_size = settings.CHECK_DB_FETCH_SIZE
+    last_filename = None
+    while True:
+        qs = _next_filenames(FileWatchItemModel.objects.filter(watchid=item), 'filename', after=last_filename)
+        batch = list(qs.values_list('filename', 'ctime_ns', 'mtime_ns', 'uid', 'gid', 'mode', 'size', 'inode', 'device', 'checksum')[:batch_size])
+        for row in batch:
+            yield BaselineItem(*row)
+        if len(batch) < batch_size:
+            break
+        last_filename = batch[-1][0]
+
+def build_baseline(item):
+    """
+    Writes the baseline of the given watch item from the file entries in the
+    database.
+    """
+    revision = FileWatchModel.objects.filter(pk=item.pk).values_list('revision', flat=True)[0]
+    return write_baseline(baseline_filename(item.id), item.id, revision, iter_db_rows(item))
+
+def update_baseline(item, reader, item_writer):
+    """
+    Brings the baseline of the given watch item up to date after a check,
+    which read the baseline from reader (or None if it read the database)
+    and wrote the changes with item_writer. If the writer kept all changes
+    they are merged into the old baseline, otherwise the baseline is built
+    from the database. Returns the tuple (number of entries, rebuilt) or
+    None if the baseline was still up to date.
+    """
+    if reader is not None and reader.revision == item.revision:
+        return None
+    if reader is not None and item_writer.delta is not None and reader.revision + 1 == item.revision:
+        num_records = write_baseline(baseline_filename(item.id), item.id, item.revision,
+                                     merge_delta(reader, item_writer.delta))
+        return (num_records, False)
+    return (build_baseline(item), True)
+
+def iter_files_in_db(item, batch_size=None, subtree=None):
+    """
+    Yields the file entries of the given watch item sorted by filename in
+    the order of the code points (see merge_files). The entries are fetched
+    in batches of batch_size rows, each starting after the last filename of
+    the previous batch, so only one batch is kept in memory and no cursor
+    stays open while the entries are written. With a subtree only the files
+    below that directory are returned.
+    """
+    if not batch_size:
+        batch_size = settings.CHECK_DB_FETCH_SIZE
+    last_filename = None
+    while True:
+        # a range instead of startswith, so the index can be used
+        qs = _next_filenames(FileWatchItemModel.objects.filter(watchid=item), 'filename', subtree=subtree, after=last_filename)
+        batch = list(qs[:batch_size])
+        for db_item in batch:
+            yield db_item
+        if len(batch) < batch_size:
+            break
+        last_filename = batch[-1].filename
+
+def load_directory_snapshot(item, subtree=None):
+    """
+    Returns the directories recorded by the last scan of the given watch
+    item as dict of directory name to (mtime_ns, ctime_ns, num_children).
+    With a subtree only that directory and the directories below it are
+    returned.
+    """
+    ret = {}
+    qs = FileWatchDirectoryModel.objects.filter(watchid=item)
+    if subtree is not None:
+        expr = _binary_column('dirname')
+        prefix = os.path.join(subtree, '')
+        qs = qs.extra(where=[ '(%s = %%s OR (%s >= %%s AND %s < %%s))' % (expr, expr, expr) ],
+                      params=[ subtree, prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1) ])
+    for (dirname, mtime_ns, ctime_ns, num_children) in qs.values_list('dirname', 'mtime_ns', 'ctime_ns', 'num_children').iterator():
+        ret[dirname] = (mtime_ns, ctime_ns, num_children)
+    return ret
+
+def save_directory_snapshot(item, old_snapshot, new_snapshot, chunk_size=None):
+    """
+    Replaces the directories recorded for the given watch item. Only the
+    directories which differ between the old and the new snapshot are
+    written.
+    """
+    if not chunk_size:
+        chunk_size = settings.CHECK_BULK_CHUNK_SIZE
+    removed = [ dirname for dirname in old_snapshot.keys() if new_snapshot.get(dirname) != old_snapshot[dirname] ]
+    added = [ FileWatchDirectoryModel(watchid=item, dirname=dirname, mtime_ns=record[0], ctime_ns=record[1], num_children=record[2])
+                for (dirname, record) in new_snapshot.items() if old_snapshot.get(dirname) != record ]
+    with transaction.atomic():
+        for i in range(0, len(removed), chunk_size):
+            FileWatchDirectoryModel.objects.filter(watchid=item, dirname__in=removed[i:i + chunk_size]).delete()
+        FileWatchDirectoryModel.objects.bulk_create(added)
+    return len(removed) + len(added)
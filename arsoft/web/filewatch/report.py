@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from collections import Counter
+from itertools import chain, islice
+from arsoft.web.filewatch.compare import Change, CHANGE_MOVED
+import os
+import io
+import csv
+import gzip
+import shutil
+import tempfile
+
+REPORT_ATTACHMENT_NAME = 'filewatch-changes.csv.gz'
+REPORT_ATTACHMENT_MIMETYPE = 'application/gzip'
+# size of the CSV rows of a watch item kept in memory, larger ones are
+# written to a temporary file
+REPORT_SPOOL_SIZE = 1024 * 1024
+
+def _moved_roots(old_filename, new_filename):
+    # strips the trailing path components both names have in common, which
+    # gives the directory (or file) which actually has been renamed
+    old_parts = old_filename.split(os.sep)
+    new_parts = new_filename.split(os.sep)
+    n = 0
+    while n < min(len(old_parts), len(new_parts)) - 1 and old_parts[-1 - n] == new_parts[-1 - n]:
+        n += 1
+    return (os.sep.join(old_parts[:len(old_parts) - n]), os.sep.join(new_parts[:len(new_parts) - n]))
+
+class ChangeList(object):
+    """
+    The changed files of one watch item, filled with append((filename,
+    changes)) while the check runs. Only the first max_changes entries are
+    kept for the report, together with the number of changes by kind and
+    directory; files moved along with other files from one directory to
+    another are listed as a single entry for the directory, which takes
+    the place of the first of its files. All changes are written as CSV
+    rows to a temporary file, which stays in memory while it is small.
+    len() gives the number of changed files.
+    """
+    def __init__(self, item_filename, max_changes):
+        self.item_filename = item_filename
+        self.max_changes = max_changes
+        self.kinds = Counter()
+        self.directories = Counter()
+        self._entries = []
+        # index into _entries of the listed move groups
+        self._moves = {}
+        self._num_files = 0
+        self._num_listed = 0
+        self._csv_file = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_SIZE, mode='w+', encoding='utf-8', newline='')
+        self._csv = csv.writer(self._csv_file)
+
+    def __len__(self):
+        return self._num_files
+
+    def __iter__(self):
+        for (filename, changes, num_files, key) in self._entries:
+            if num_files > 1:
+                (old_root, new_root) = key
+                yield (new_root, [ Change(CHANGE_MOVED, 'Directory moved from %s (%i files)' % (old_root, num_files), old_root, new_root) ])
+            else:
+                yield (filename, changes)
+
+    @property
+    def num_entries(self):
+        return len(self._entries)
+
+    @property
+    def truncated(self):
+        return self._num_listed < self._num_files
+
+    def append(self, entry):
+        (filename, changes) = entry
+        self._num_files += 1
+        dirname = os.path.dirname(filename)
+        for change in changes:
+            kind = getattr(change, 'kind', 'other')
+            self.kinds[kind] += 1
+            self.directories[(kind, dirname)] += 1
+            self._csv.writerow([self.item_filename, filename, kind, change])
+        if len(changes) == 1 and getattr(changes[0], 'kind', None) == CHANGE_MOVED:
+            key = _moved_roots(changes[0].old, changes[0].new)
+            index = self._moves.get(key)
+            if index is not None:
+                self._entries[index][2] += 1
+                self._num_listed += 1
+                return
+        else:
+            key = None
+        if len(self._entries) < self.max_changes:
+            if key is not None:
+                self._moves[key] = len(self._entries)
+            self._entries.append( [filename, changes, 1, key] )
+            self._num_listed += 1
+
+    def copy_csv(self, f):
+        """
+        Copies the CSV rows of all changes to the given text file.
+        """
+        self._csv_file.seek(0)
+        shutil.copyfileobj(self._csv_file, f)
+        self._csv_file.seek(0, io.SEEK_END)
+
+class ChangeReport(object):
+    """
+    Summary of the changes of one or more watch items for a notification,
+    built from the ChangeList of each item. At most max_changes files are
+    listed, so the report stays small even when all files changed. The
+    complete list can be written as compressed CSV file.
+    """
+    def __init__(self, result_items, max_changes, max_directories):
+        self.result_items = result_items
+        self.num_files = sum([ result_item.num_files for result_item in result_items ])
+        self.num_changed = sum([ result_item.num_changed for result_item in result_items ])
+        self.num_unchanged = sum([ result_item.num_unchanged for result_item in result_items ])
+        kinds = Counter()
+        directories = Counter()
+        for result_item in result_items:
+            kinds.update(result_item.changed_list.kinds)
+            directories.update(result_item.changed_list.directories)
+        self.kind_list = kinds.most_common()
+        self.directory_list = [ (kind, dirname, count) for ((kind, dirname), count) in directories.most_common(max_directories) ]
+        self.changed_list = list(islice(chain(*[ result_item.changed_list for result_item in result_items ]), max_changes))
+        self.truncated = any([ result_item.changed_list.truncated for result_item in result_items ]) or \
+            sum([ result_item.changed_list.num_entries for result_item in result_items ]) > max_changes
+        self.unchanged_list = list(islice(chain(*[ result_item.unchanged_list for result_item in result_items ]), max_changes))
+
+    def write_csv(self, f):
+        """
+        Writes all changes as CSV to the given text file with one line per
+        change: watch item, filename, kind and message.
+        """
+        writer = csv.writer(f)
+        writer.writerow(['item', 'filename', 'kind', 'change'])
+        for result_item in self.result_items:
+            result_item.changed_list.copy_csv(f)
+
+    def csv_attachment(self):
+        """
+        Returns the gzip compressed CSV file with all changes.
+        """
+        buf = io.BytesIO()
+        with gzip.GzipFile(filename=REPORT_ATTACHMENT_NAME[:-3], mode='wb', fileobj=buf) as gz:
+            f = io.TextIOWrapper(gz, encoding='utf-8', newline='')
+            self.write_csv(f)
+            f.flush()
+            f.detach()
+        return buf.getvalue()
@@ -0,0 +1,604 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+import os, stat
+import re
+import fnmatch
+import array
+import functools
+import math
+from datetime import datetime, timezone
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from concurrent.futures import ThreadPoolExecutor
+from arsoft.timestamp import utc_timestamp_to_datetime
+
+# do not report symbolic links at all
+SYMLINKS_IGNORE = 'ignore'
+# report symbolic links to files, but do not descend into linked directories
+SYMLINKS_FILES = 'files'
+# report symbolic links to files and descend into linked directories
+SYMLINKS_FOLLOW = 'follow'
+
+# silently skip files and directories which cannot be accessed
+ERRORS_IGNORE = 'ignore'
+# abort the scan on the first inaccessible file or directory
+ERRORS_RAISE = 'raise'
+
+# number of chunks and files per chunk a prefetching worker keeps in memory
+PREFETCH_QUEUE_SIZE = 16
+PREFETCH_CHUNK_SIZE = 256
+
+# directories modified less than this number of seconds before the scan
+# are listed again by the next incremental scan
+RACY_INTERVAL = 2
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def ns_to_timestamp(ns):
+    """
+    Returns the float timestamp for the given nanoseconds, exactly as
+    os.stat() calculates st_mtime from st_mtime_ns.
+    """
+    sec, nsec = divmod(ns, 1000000000)
+    return sec + nsec * 1e-9
+
+def ns_to_us(ns):
+    """
+    Returns the microseconds since the epoch for the given nanoseconds,
+    rounded like a datetime created from the float timestamp.
+    """
+    frac, whole = math.modf(ns_to_timestamp(ns))
+    return int(whole) * 1000000 + int(round(frac * 1e6))
+
+def datetime_to_us(dt):
+    """
+    Returns the microseconds since the epoch for the given datetime. Naive
+    datetimes are taken as UTC.
+    """
+    delta = dt - (_EPOCH if dt.tzinfo is None else _EPOCH_UTC)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+class FileWatchItemFromDisk(object):
+    """
+    A file found on disk. Only the raw integer values of the stat result
+    are stored; the datetimes are created on demand, which is only required
+    for the files which changed. checksum is set when the content of the
+    file has been hashed.
+    """
+    __slots__ = ('filename', 'ctime_ns', 'mtime_ns', 'uid', 'gid', 'mode', 'size', 'dev', 'ino', 'checksum')
+
+    def __init__(self, filename, file_stats):
+        self.filename = filename
+        self.ctime_ns = file_stats.st_ctime_ns
+        self.mtime_ns = file_stats.st_mtime_ns
+        self.uid = file_stats.st_uid
+        self.gid = file_stats.st_gid
+        self.mode = file_stats.st_mode
+        self.size = file_stats.st_size
+        self.dev = file_stats.st_dev
+        self.ino = file_stats.st_ino
+        self.checksum = None
+
+    @staticmethod
+    def from_values(filename, ctime_ns, mtime_ns, uid, gid, mode, size, ino=0, dev=0):
+        ret = FileWatchItemFromDisk.__new__(FileWatchItemFromDisk)
+        ret.filename = filename
+        ret.ctime_ns = ctime_ns
+        ret.mtime_ns = mtime_ns
+        ret.uid = uid
+        ret.gid = gid
+        ret.mode = mode
+        ret.size = size
+        ret.dev = dev
+        ret.ino = ino
+        ret.checksum = None
+        return ret
+
+    @property
+    def created(self):
+        return utc_timestamp_to_datetime(ns_to_timestamp(self.ctime_ns))
+
+    @property
+    def modified(self):
+        return utc_timestamp_to_datetime(ns_to_timestamp(self.mtime_ns))
+
+class FileWatchItemBatch(object):
+    """
+    Stores a sequence of files found on disk column by column in arrays of
+    integers instead of one object per file. Indexing and iterating return
+    FileWatchItemFromDisk objects, which are created on demand. Other
+    objects (like SkippedDirectory) can be appended as well and are
+    returned as they are.
+    """
+    def __init__(self, items=None):
+        self._filenames = []
+        self._ctime_ns = array.array('q')
+        self._mtime_ns = array.array('q')
+        self._uid = array.array('L')
+        self._gid = array.array('L')
+        self._mode = array.array('L')
+        self._size = array.array('q')
+        self._dev = array.array('Q')
+        self._ino = array.array('Q')
+        if items is not None:
+            for item in items:
+                self.append(item)
+
+    def __len__(self):
+        return len(self._filenames)
+
+    def append(self, item):
+        if isinstance(item, FileWatchItemFromDisk):
+            self._filenames.append(item.filename)
+            self._ctime_ns.append(item.ctime_ns)
+            self._mtime_ns.append(item.mtime_ns)
+            self._uid.append(item.uid)
+            self._gid.append(item.gid)
+            self._mode.append(item.mode)
+            self._size.append(item.size)
+            self._dev.append(item.dev)
+            self._ino.append(item.ino)
+        else:
+            self._filenames.append(item)
+            self._ctime_ns.append(0)
+            self._mtime_ns.append(0)
+            self._uid.append(0)
+            self._gid.append(0)
+            self._mode.append(0)
+            self._size.append(0)
+            self._dev.append(0)
+            self._ino.append(0)
+
+    def __getitem__(self, index):
+        filename = self._filenames[index]
+        if not isinstance(filename, str):
+            return filename
+        return FileWatchItemFromDisk.from_values(filename, self._ctime_ns[index], self._mtime_ns[index],
+                                                self._uid[index], self._gid[index], self._mode[index], self._size[index],
+                                                self._ino[index], self._dev[index])
+
+    def __iter__(self):
+        for index in range(len(self._filenames)):
+            yield self[index]
+
+class SkippedDirectory(object):
+    """
+    Marks a directory in the stream of files which was not listed, because
+    it did not change since the last scan. The files directly inside of it
+    are taken over from the last scan. filename ends with a separator, so
+    the marker is sorted in front of all files of the directory.
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.filename = os.path.join(dirname, '')
+
+def _dirkey(path):
+    return path.rstrip(os.sep) or os.sep
+
+class IOBudget(object):
+    """
+    Token bucket which limits the rate of I/O operations (like stat calls or
+    bytes read) to rate per second, allowing bursts of up to burst. It is
+    shared by all threads of a check; consume() blocks the calling thread
+    until the consumed amount is within the budget.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else self.rate
+        self.waited = 0.0
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """
+        Consumes the given amount and returns the number of seconds the
+        caller has been delayed.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited += delay
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+def parse_patterns(text):
+    """
+    Returns the glob patterns from the given text, one per line. Empty lines
+    and lines starting with # are ignored.
+    """
+    ret = []
+    for line in (text or '').splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            ret.append(line)
+    return ret
+
+class PathFilter(object):
+    """
+    Selects the files and directories below root with glob patterns. A
+    pattern containing a separator is matched against the path relative to
+    the root, any other pattern against the name only. Exclude patterns
+    apply to files and directories; the walker does not descend into
+    excluded directories. Include patterns only apply to files. When a
+    parent filter is given, it must accept the path as well.
+    """
+    def __init__(self, root, include=None, exclude=None, parent=None):
+        self._root = _dirkey(root)
+        self._prefix_len = len(os.path.join(self._root, ''))
+        self._include = self._compile(include)
+        self._exclude = self._compile(exclude)
+        self._parent = parent
+        self._excluded_dirs = {}
+
+    @staticmethod
+    def _compile(patterns):
+        if not patterns:
+            return None
+        names = [ fnmatch.translate(p) for p in patterns if os.sep not in p ]
+        paths = [ fnmatch.translate(p.strip(os.sep)) for p in patterns if os.sep in p ]
+        return (re.compile('|'.join(names)) if names else None, re.compile('|'.join(paths)) if paths else None)
+
+    def _match(self, patterns, path):
+        (names, paths) = patterns
+        if names is not None and names.match(os.path.basename(path)) is not None:
+            return True
+        return paths is not None and paths.match(path[self._prefix_len:]) is not None
+
+    def exclude_dir(self, path):
+        """
+        Returns whether the given directory below the root is excluded.
+        """
+        if self._exclude is not None and self._match(self._exclude, path):
+            return True
+        return self._parent is not None and self._parent.exclude_dir(path)
+
+    def include_file(self, path):
+        """
+        Returns whether the given file is included, not taking the
+        directories it is in into account.
+        """
+        if self._exclude is not None and self._match(self._exclude, path):
+            return False
+        if self._include is not None and not self._match(self._include, path):
+            return False
+        return self._parent is None or self._parent.include_file(path)
+
+    def dir_excluded(self, path):
+        """
+        Returns whether the given directory or one of its parents below the
+        root is excluded.
+        """
+        path = _dirkey(path)
+        if len(path) <= len(self._root):
+            return False
+        ret = self._excluded_dirs.get(path)
+        if ret is None:
+            ret = self.exclude_dir(path) or self.dir_excluded(os.path.dirname(path))
+            self._excluded_dirs[path] = ret
+        return ret
+
+    def include_path(self, path):
+        """
+        Returns whether the given file is included and not in an excluded
+        directory, like the walker would report it.
+        """
+        return not self.dir_excluded(os.path.dirname(path)) and self.include_file(path)
+
+class FileWalker(object):
+    """
+    Walks a directory tree with os.scandir and yields a FileWatchItemFromDisk
+    for every regular file. The tree is walked with an explicit stack, so the
+    depth of the tree is not limited by the recursion limit, and the type
+    information of the directory entries is used to detect subdirectories
+    without an additional stat call.
+
+    symlinks selects how symbolic links are handled (SYMLINKS_*),
+    one_file_system skips directories on other file systems than the root
+    and errors selects whether inaccessible entries are skipped or abort the
+    scan (ERRORS_*). Skipped entries are recorded in the errors list as
+    tuples of (path, error message).
+
+    When a snapshot of the directories from the last scan is given (a dict
+    of directory name to (mtime_ns, ctime_ns, num_children)), all walked
+    directories are recorded in the directories dict in the same format.
+    Directories whose mtime and ctime did not change are not listed again;
+    a SkippedDirectory is yielded for them instead.
+
+    With a path_filter (PathFilter) excluded directories are not walked
+    and only the included files are reported. An io_budget (IOBudget)
+    limits the number of stat calls per second. The number of listed
+    directories and of stat calls is counted in num_dirs_listed and
+    num_stat_calls.
+    """
+    def __init__(self, symlinks=SYMLINKS_FOLLOW, one_file_system=False, errors=ERRORS_IGNORE, snapshot=None, path_filter=None,
+                 io_budget=None):
+        self.symlinks = symlinks
+        self.path_filter = path_filter
+        self.io_budget = io_budget
+        self.one_file_system = one_file_system
+        self.error_policy = errors
+        self.errors = []
+        self.snapshot = snapshot
+        self.directories = {}
+        self.skipped = []
+        self.num_dirs_listed = 0
+        self.num_stat_calls = 0
+        self._lock = threading.Lock()
+        self._subdirs = {}
+        if snapshot:
+            for dirname in snapshot.keys():
+                self._subdirs.setdefault(os.path.dirname(dirname), []).append(dirname)
+        # a directory which changed shortly before it was listed may change
+        # again within the resolution of its timestamps, so it must not be
+        # trusted by the next scan.
+        self._racy_ns = int((time.time() - RACY_INTERVAL) * 1000000000)
+
+    def _error(self, path, e):
+        if self.error_policy == ERRORS_RAISE:
+            raise e
+        self.errors.append( (path, e.strerror) )
+
+    def _is_loop(self, entry, parent):
+        # a linked directory which points to one of its parent directories
+        # would be walked forever
+        target = os.path.realpath(entry.path)
+        parent = os.path.realpath(parent)
+        return parent == target or parent.startswith(target.rstrip(os.sep) + os.sep)
+
+    def _skip_dir(self, path, dir_stat):
+        """
+        Returns the entries for a directory which did not change since the
+        last scan: the marker for its files and its subdirectories from the
+        snapshot.
+        """
+        key = _dirkey(path)
+        record = self.snapshot.get(key)
+        if record is None or record[0] == 0 or \
+            record[0] != dir_stat.st_mtime_ns or record[1] != dir_stat.st_ctime_ns:
+            return None
+        self.directories[key] = record
+        self.skipped.append(key)
+        ret = [ ('', False, SkippedDirectory(path)) ]
+        for subdir in self._subdirs.get(key, []):
+            if self.path_filter is not None and self.path_filter.exclude_dir(subdir):
+                continue
+            ret.append( (os.path.basename(subdir) + os.sep, True, (subdir, None)) )
+        ret.sort(key=lambda x: x[0])
+        return ret
+
+    def _count(self, num_dirs, num_stat_calls):
+        # the subdirectories may be listed by several threads
+        with self._lock:
+            self.num_dirs_listed += num_dirs
+            self.num_stat_calls += num_stat_calls
+
+    def _list_dir(self, path, root_dev=None, dir_stat=None):
+        """
+        Lists a single directory and returns its entries as tuples of
+        (key, is_dir, value), sorted by key. value is a tuple of the path and
+        the stat result (if already known) for subdirectories or the
+        FileWatchItemFromDisk for files. The key of a directory has a
+        trailing separator, so walking the entries in order returns all
+        files sorted by their full path.
+        """
+        ret = []
+        if self.io_budget is not None:
+            self.io_budget.consume(1)
+        if self.snapshot is not None:
+            try:
+                if dir_stat is None:
+                    self._count(0, 1)
+                    dir_stat = os.stat(path)
+            except FileNotFoundError:
+                return ret
+            except OSError as e:
+                self._error(path, e)
+                return ret
+            skipped = self._skip_dir(path, dir_stat)
+            if skipped is not None:
+                return skipped
+        try:
+            entries = list(os.scandir(path))
+        except FileNotFoundError:
+            return ret
+        except OSError as e:
+            self._error(path, e)
+            if self.snapshot is not None:
+                # keep it in the snapshot, so it is listed again next time
+                self.directories[_dirkey(path)] = (0, 0, 0)
+            return ret
+        if self.io_budget is not None:
+            # at most one stat call per entry
+            self.io_budget.consume(len(entries))
+        num_stat_calls = 0
+        for entry in entries:
+            try:
+                if entry.is_symlink():
+                    if self.symlinks == SYMLINKS_IGNORE:
+                        continue
+                    if entry.is_dir():
+                        if self.symlinks != SYMLINKS_FOLLOW or self._is_loop(entry, path):
+                            continue
+                        is_dir = True
+                    else:
+                        is_dir = False
+                else:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir:
+                    if self.path_filter is not None and self.path_filter.exclude_dir(entry.path):
+                        continue
+                    # the stat of a directory is only needed to compare it
+                    # with the snapshot or the device of the root
+                    if self.snapshot is not None or self.one_file_system:
+                        num_stat_calls += 1
+                        subdir_stat = entry.stat()
+                        if self.one_file_system and root_dev is not None and subdir_stat.st_dev != root_dev:
+                            continue
+                    else:
+                        subdir_stat = None
+                    ret.append( (entry.name + os.sep, True, (entry.path, subdir_stat)) )
+                else:
+                    if self.path_filter is not None and not self.path_filter.include_file(entry.path):
+                        continue
+                    num_stat_calls += 1
+                    s = entry.stat()
+                    if stat.S_ISREG(s.st_mode):
+                        ret.append( (entry.name, False, FileWatchItemFromDisk(entry.path, s)) )
+            except FileNotFoundError:
+                # removed while scanning
+                pass
+            except OSError as e:
+                self._error(entry.path, e)
+        self._count(1, num_stat_calls)
+        if self.snapshot is not None:
+            mtime_ns = dir_stat.st_mtime_ns
+            if mtime_ns >= self._racy_ns or dir_stat.st_ctime_ns >= self._racy_ns:
+                mtime_ns = 0
+            self.directories[_dirkey(path)] = (mtime_ns, dir_stat.st_ctime_ns, len(entries))
+        ret.sort(key=lambda x: x[0])
+        return ret
+
+    def root_dev(self, root):
+        return os.stat(root).st_dev if self.one_file_system else None
+
+    def walk(self, root, root_dev=None, root_stat=None):
+        """
+        Yields all files below the given directory sorted by filename. root_dev
+        is the device of the watch root when walking a part of it with
+        one_file_system.
+        """
+        if root_dev is None:
+            root_dev = self.root_dev(root)
+        stack = [ iter(self._list_dir(root, root_dev, root_stat)) ]
+        while stack:
+            for (key, is_dir, value) in stack[-1]:
+                if is_dir:
+                    stack.append(iter(self._list_dir(value[0], root_dev, value[1])))
+                    break
+                yield value
+            else:
+                stack.pop()
+
+    def walk_parallel(self, root, workers, root_dev=None):
+        """
+        Yields the same files as walk(), but walks the subdirectories of the
+        given directory on up to workers threads.
+        """
+        if root_dev is None:
+            root_dev = self.root_dev(root)
+        sources = []
+        files = []
+        for (key, is_dir, value) in self._list_dir(root, root_dev):
+            if is_dir:
+                if files:
+                    sources.append(functools.partial(iter, files))
+                    files = []
+                sources.append(functools.partial(self.walk, value[0], root_dev, value[1]))
+            else:
+                files.append(value)
+        if files:
+            sources.append(functools.partial(iter, files))
+        for stream in prefetch(sources, workers):
+            for disk_item in stream:
+                yield disk_item
+
+class _PrefetchStream(object):
+    _END = object()
+
+    def __init__(self, source, queue_size, chunk_size):
+        self._source = source
+        self._queue = queue.Queue(queue_size)
+        self._chunk_size = chunk_size
+        self._stop = threading.Event()
+        self._future = None
+
+    def start(self, executor):
+        self._future = executor.submit(self._run)
+
+    def _put(self, value):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(value, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        it = None
+        try:
+            it = iter(self._source())
+            chunk = FileWatchItemBatch()
+            for item in it:
+                chunk.append(item)
+                if len(chunk) >= self._chunk_size:
+                    if not self._put(chunk):
+                        return
+                    chunk = FileWatchItemBatch()
+            if chunk:
+                self._put(chunk)
+        finally:
+            # stop a generator source early when the consumer went away
+            close = getattr(it, 'close', None)
+            if close is not None:
+                close()
+            self._put(_PrefetchStream._END)
+
+    def close(self):
+        self._stop.set()
+
+    def __iter__(self):
+        if self._future is None:
+            # not started in a worker thread, so run the source directly
+            for item in self._source():
+                yield item
+            return
+        while True:
+            chunk = self._queue.get()
+            if chunk is _PrefetchStream._END:
+                break
+            for item in chunk:
+                yield item
+        # raises the exception from the worker thread, if any
+        self._future.result()
+
+def prefetch(sources, workers, queue_size=PREFETCH_QUEUE_SIZE, chunk_size=PREFETCH_CHUNK_SIZE):
+    """
+    Yields an iterator for each of the given sources (callables returning an
+    iterable) in order, while up to workers of the following sources are
+    already read by worker threads. Each iterator must be consumed before
+    the next one is requested. A worker only keeps up to queue_size chunks
+    of items in memory, and the sources are started strictly in order, so
+    the consumer never waits for a source which is not running.
+    """
+    streams = [ _PrefetchStream(source, queue_size, chunk_size) for source in sources ]
+    if workers <= 1:
+        for stream in streams:
+            yield stream
+        return
+    executor = ThreadPoolExecutor(max_workers=workers)
+    next_start = 0
+    index = 0
+    try:
+        for index, stream in enumerate(streams):
+            while next_start < len(streams) and next_start - index < workers:
+                streams[next_start].start(executor)
+                next_start += 1
+            yield stream
+            stream.close()
+    finally:
+        for stream in streams[index:next_start]:
+            stream.close()
+        executor.shutdown(wait=True)
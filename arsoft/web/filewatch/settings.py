@@ -32,5 +32,165 @@ ALLOWED_HOSTS = ['*']
 EMAIL_SUBJECT_FORMAT = '[FILEWATCH]: %(filename)s changed (%(num_changed)i changed, %(num_unchanged)i unchanged)'
 EMAIL_SENDER = 'root@localhost'
 EMAIL_BACKEND = 'arsoft.web.backends.SendmailBackend'
+# Subject of a mail which covers several watch items.
+EMAIL_DIGEST_SUBJECT_FORMAT = '[FILEWATCH]: %(num_items)i items changed (%(num_changed)i changed, %(num_unchanged)i unchanged)'
+
+# The notification mails are delivered in the background. Failed mails are
+# retried NOTIFY_RETRY_COUNT times, the first time after NOTIFY_RETRY_DELAY
+# seconds and doubling the delay each time. A check waits up to
+# NOTIFY_WAIT_TIMEOUT seconds for the delivery to report the result. The
+# mails are kept in the database until they are delivered; those left by
+# a process which exited are delivered by the worker.
+NOTIFY_RETRY_COUNT = 5
+NOTIFY_RETRY_DELAY = 30
+NOTIFY_WAIT_TIMEOUT = 0
 
 REPORT_UNCHANGED = False
+# Maximum number of files listed in a notification. When more files
+# changed, the notification contains the number of changes by kind and
+# directory and the complete list as compressed CSV attachment. Only these
+# files (and as many unchanged files) are kept in memory during a check,
+# the CSV rows are written to a temporary file.
+REPORT_MAX_CHANGES = 1000
+REPORT_MAX_DIRECTORIES = 20
+
+# Number of file entries which are written to the database at once during
+# a check. Deletes use one statement per chunk and SQLite allows at most
+# 999 variables per statement, so keep it below that limit; inserts are
+# split into statements by the database backend.
+CHECK_BULK_CHUNK_SIZE = 500
+# Use one transaction per chunk ('chunk') or one transaction for all files
+# of a watch item ('item').
+CHECK_BULK_TRANSACTION = 'chunk'
+
+# Number of threads which scan the watched files and directories in
+# parallel. Each watch root is scanned as a separate task; with
+# CHECK_SCAN_SPLIT_SUBDIRS each subdirectory of a root is a separate task.
+CHECK_SCAN_WORKERS = 4
+CHECK_SCAN_SPLIT_SUBDIRS = True
+
+# Handling of symbolic links during the scan: 'follow' reports linked files
+# and descends into linked directories, 'files' only reports linked files
+# and 'ignore' skips all symbolic links.
+CHECK_SCAN_SYMLINKS = 'follow'
+# Do not descend into directories on other file systems than the watch root.
+CHECK_SCAN_ONE_FILE_SYSTEM = False
+# Skip ('ignore') inaccessible files and directories or abort ('raise').
+CHECK_SCAN_ERRORS = 'ignore'
+
+# Number of file entries which are read from the database at once during a
+# check.
+CHECK_DB_FETCH_SIZE = 2000
+
+# Only list the directories which changed since the last check. The files
+# inside of unchanged directories are not checked, so a full check is done
+# when the last one is older than CHECK_FULL_SCAN_INTERVAL seconds or when
+# requested with the parameter full=1.
+CHECK_INCREMENTAL = False
+CHECK_FULL_SCAN_INTERVAL = 7 * 24 * 3600
+
+# Number of threads which hash the content of the files for watch items
+# with a checksum algorithm.
+CHECK_HASH_WORKERS = 4
+
+# Limits the I/O of a check, so it does not saturate the disk: the number
+# of stat calls per second and the number of bytes hashed per second (0
+# for no limit). The worker and the scheduler set the I/O scheduling class
+# of their process (like ionice) to CHECK_IONICE_CLASS ('idle', 'best-effort'
+# or None to keep it) and CHECK_IONICE_LEVEL (0-7, for best-effort).
+CHECK_STAT_RATE = 0
+CHECK_HASH_RATE = 0
+CHECK_IONICE_CLASS = 'idle'
+CHECK_IONICE_LEVEL = 7
+
+# Keep a compressed copy of the file entries of each watch item sorted by
+# filename in CHECK_BASELINE_DIR, which the check reads instead of the
+# database. After the check the changes (if not more than
+# CHECK_BASELINE_MAX_DELTA files changed) are merged into it; otherwise it
+# is written again from the database.
+CHECK_BASELINE = True
+CHECK_BASELINE_DIR = os.path.join(APP_DATA_DIR, 'baseline')
+CHECK_BASELINE_MAX_DELTA = 100000
+
+# Report a file which was deleted in one place and added in another one
+# with the same device, inode, size and modification time as moved, so
+# its entry is renamed instead of deleted and added again. At most
+# CHECK_MOVE_MAX_PENDING added and deleted files each are held back while
+# looking for their counterpart.
+CHECK_DETECT_MOVES = True
+CHECK_MOVE_MAX_PENDING = 100000
+
+# Number of files per page in the list of tracked files in the admin
+# pages. The number of files matching the filters is only counted every
+# ADMIN_COUNT_CACHE_TIMEOUT seconds.
+ADMIN_FILES_PER_PAGE = 100
+ADMIN_COUNT_CACHE_TIMEOUT = 300
+
+# The home page shows the status of each item stored by its last check.
+# It is cached for DASHBOARD_CACHE_TIMEOUT seconds, but refreshed as soon
+# as a check stores a new status or an item is changed. The checks run in
+# the worker and the scheduler, so the cache has to be shared between the
+# processes; a local memory cache only sees their changes after the
+# timeout.
+DASHBOARD_CACHE_TIMEOUT = 600
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(APP_DATA_DIR, 'cache'),
+    }
+}
+
+# Puts the SQLite database into write-ahead log mode, so the web pages can
+# read while a check is writing.
+DATABASE_SQLITE_WAL = True
+
+# Keys of the agents (arsoft-filewatch-agent) which check the watch items
+# of other hosts, by host name. The requests of an agent must be signed
+# with the key of its host and a time within AGENT_MAX_CLOCK_SKEW seconds
+# of the time of the server, and each request is accepted only once; a
+# batch of changes may not be larger than AGENT_MAX_DELTA_SIZE bytes when
+# decompressed.
+AGENT_KEYS = {}
+AGENT_MAX_CLOCK_SKEW = 300
+AGENT_MAX_DELTA_SIZE = 256 * 1024 * 1024
+
+# The checks requested with /check are queued and run by the worker
+# (manage.py filewatch_worker), which looks for new jobs every
+# JOB_POLL_INTERVAL seconds. The output of each job is kept in JOB_LOG_DIR
+# for JOB_KEEP_DAYS days.
+JOB_POLL_INTERVAL = 5
+JOB_LOG_DIR = os.path.join(APP_DATA_DIR, 'jobs')
+JOB_KEEP_DAYS = 30
+# Interval in seconds in which /job/<job>/log looks for new output.
+JOB_FOLLOW_INTERVAL = 1
+
+# The scheduler (manage.py filewatch_scheduler) queues a check for each
+# item with a check interval when it is due, but keeps at most
+# SCHEDULER_MAX_JOBS jobs queued or running at the same time, so the items
+# are checked one after another. Items which have never been checked are
+# spread over their interval. When the check of an item fails, it is
+# retried after SCHEDULER_RETRY_DELAY seconds, doubling the delay with each
+# further failure up to the check interval of the item.
+SCHEDULER_MAX_JOBS = 1
+SCHEDULER_POLL_INTERVAL = 30
+SCHEDULER_RETRY_DELAY = 300
+
+# Every change found by a check is appended to the change history
+# (/events). Events older than EVENT_RETENTION_DAYS are rolled up into
+# daily summaries by the worker or manage.py filewatch_compact, and the
+# summaries are kept for EVENT_SUMMARY_RETENTION_DAYS (0 keeps them).
+EVENT_LOG = True
+EVENT_RETENTION_DAYS = 90
+EVENT_SUMMARY_RETENTION_DAYS = 0
+
+# The metrics of the last checks of each root, which are available at
+# /metrics in the Prometheus text format.
+METRICS_FILE = os.path.join(APP_DATA_DIR, 'metrics.json')
+
+# The watch daemon (manage.py filewatch_watch) handles a burst of events
+# when no new event arrived for WATCH_COALESCE_DELAY seconds, but at least
+# every WATCH_MAX_DELAY seconds. The notifications are collected and sent
+# at most every WATCH_NOTIFY_INTERVAL seconds.
+WATCH_COALESCE_DELAY = 2
+WATCH_MAX_DELAY = 30
+WATCH_NOTIFY_INTERVAL = 300
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from arsoft.web.filewatch.models import FileWatchModel, FileWatchItemModel, FileWatchStatusModel
+from arsoft.web.filewatch.compare import FILE_ADDED, FILE_CHANGED, FILE_MOVED, FILE_DELETED, CHANGE_SIZE
+
+import time
+
+DASHBOARD_CACHE_KEY = 'filewatch-dashboard'
+DASHBOARD_VERSION_KEY = 'filewatch-dashboard-version'
+
+class StatusCounter(object):
+    """
+    Counts the results of a check of one watch item: the files and bytes
+    found on disk, the changed files and how the total size changed.
+    """
+    def __init__(self):
+        self.num_files = 0
+        self.total_size = 0
+        self.num_added = 0
+        self.num_changed = 0
+        self.num_moved = 0
+        self.num_deleted = 0
+        self.size_delta = 0
+
+    def add(self, state, disk_item, db_item, changes):
+        if disk_item is not None:
+            self.num_files += 1
+            self.total_size += disk_item.size
+        if state == FILE_ADDED:
+            self.num_added += 1
+            self.size_delta += disk_item.size
+        elif state == FILE_DELETED:
+            self.num_deleted += 1
+            self.size_delta -= db_item.size
+        else:
+            if state == FILE_CHANGED:
+                self.num_changed += 1
+            elif state == FILE_MOVED:
+                self.num_moved += 1
+            # the comparison has taken over the new size into db_item already
+            for change in changes:
+                if getattr(change, 'kind', None) == CHANGE_SIZE:
+                    self.size_delta += int(change.new) - int(change.old)
+
+    @property
+    def file_delta(self):
+        return self.num_added - self.num_deleted
+
+def save_status(item, last_run, duration, counter, complete):
+    """
+    Stores the status of the given watch item after a check. A complete
+    check found all files, so its totals are taken over; otherwise the
+    changes are applied to the stored totals, which are counted by the
+    database only if the item has no status yet.
+    """
+    try:
+        status = FileWatchStatusModel.objects.get(watchid=item)
+    except FileWatchStatusModel.DoesNotExist:
+        status = FileWatchStatusModel(watchid=item)
+        if not complete:
+            # the changes are written already
+            totals = FileWatchItemModel.objects.filter(watchid=item).aggregate(num_files=Count('id'), total_size=Sum('size'))
+            status.num_files = totals['num_files']
+            status.total_size = totals['total_size'] or 0
+    if complete:
+        status.num_files = counter.num_files
+        status.total_size = counter.total_size
+    elif status.pk is not None:
+        status.num_files = max(0, status.num_files + counter.file_delta)
+        status.total_size = max(0, status.total_size + counter.size_delta)
+    status.last_run = last_run
+    status.duration = duration
+    status.num_added = counter.num_added
+    status.num_changed = counter.num_changed
+    status.num_moved = counter.num_moved
+    status.num_deleted = counter.num_deleted
+    status.save()
+    invalidate_dashboard()
+    return status
+
+def dashboard_version():
+    """
+    Returns the version of the dashboard, which is part of its cache key.
+    The version is kept in the cache and starts with the current time, so
+    a version lost from the cache does not bring back an old dashboard.
+    """
+    ret = cache.get(DASHBOARD_VERSION_KEY)
+    if ret is None:
+        cache.add(DASHBOARD_VERSION_KEY, int(time.time() * 1000), None)
+        ret = cache.get(DASHBOARD_VERSION_KEY, 0)
+    return ret
+
+def invalidate_dashboard():
+    """
+    Makes the next dashboard_rows read the items and their status again,
+    in all processes sharing the cache.
+    """
+    try:
+        cache.incr(DASHBOARD_VERSION_KEY)
+    except ValueError:
+        dashboard_version()
+
+def dashboard_rows():
+    """
+    Returns the list of (item, status) of all watch items ordered by
+    filename; status is None for items which were never checked. Only the
+    items and their status are read, and the list is cached until the next
+    check stores a status or an item changes (see invalidate_dashboard).
+    """
+    key = '%s-%i' % (DASHBOARD_CACHE_KEY, dashboard_version())
+    ret = cache.get(key)
+    if ret is None:
+        statuses = dict([ (status.watchid_id, status) for status in FileWatchStatusModel.objects.all() ])
+        ret = [ (item, statuses.get(item.id)) for item in FileWatchModel.objects.order_by('filename') ]
+        cache.set(key, ret, settings.DASHBOARD_CACHE_TIMEOUT)
+    return ret
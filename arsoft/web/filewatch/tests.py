@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.test import SimpleTestCase
+from arsoft.web.filewatch.compare import merge_files, detect_moves, \
+    FILE_ADDED, FILE_CHANGED, FILE_UNCHANGED, FILE_DELETED, FILE_UPDATED, FILE_MOVED, \
+    CHANGE_MOVED, CHANGE_SIZE
+from arsoft.web.filewatch.scan import FileWatchItemFromDisk, SkippedDirectory, ns_to_timestamp
+from arsoft.timestamp import utc_timestamp_to_datetime
+
+MTIME_NS = 1500000000 * 1000000000
+
+class DbItem(object):
+    """
+    Stands in for a FileWatchItemModel row.
+    """
+    def __init__(self, filename, size=10, mtime_ns=MTIME_NS, inode=0, device=0):
+        self.filename = filename
+        self.ctime_ns = MTIME_NS
+        self.mtime_ns = mtime_ns
+        self.uid = 0
+        self.gid = 0
+        self.mode = 0o100644
+        self.size = size
+        self.inode = inode
+        self.device = device
+        self.checksum = None
+
+    @property
+    def created(self):
+        return utc_timestamp_to_datetime(ns_to_timestamp(self.ctime_ns))
+
+    @property
+    def modified(self):
+        return utc_timestamp_to_datetime(ns_to_timestamp(self.mtime_ns))
+
+def disk_item(filename, size=10, mtime_ns=MTIME_NS, ino=0, dev=0):
+    return FileWatchItemFromDisk.from_values(filename, MTIME_NS, mtime_ns, 0, 0, 0o100644, size, ino=ino, dev=dev)
+
+def states(results):
+    return [ (state, (disk or db).filename) for (state, disk, db, changes) in results ]
+
+class MergeFilesTest(SimpleTestCase):
+    def test_added_deleted_changed(self):
+        disk = [ disk_item('/w/a'), disk_item('/w/b', size=20), disk_item('/w/d') ]
+        db = [ DbItem('/w/b'), DbItem('/w/c'), DbItem('/w/d') ]
+        results = list(merge_files(disk, db))
+        self.assertEqual(states(results), [ (FILE_ADDED, '/w/a'), (FILE_CHANGED, '/w/b'),
+                                            (FILE_DELETED, '/w/c'), (FILE_UNCHANGED, '/w/d') ])
+        self.assertEqual([ change.kind for change in results[1][3] ], [ CHANGE_SIZE ])
+        # the database entry is brought up to date
+        self.assertEqual(db[0].size, 20)
+
+    def test_code_point_order(self):
+        # upper case letters and '/' sort in front of '_' and the lower case
+        # letters, whatever the collation of the database would say
+        names = sorted([ '/w/B', '/w/_x', '/w/a', '/w/a/b', '/w/a_b', '/w/\xe4' ])
+        results = list(merge_files([ disk_item(name) for name in names ], [ DbItem(name) for name in names ]))
+        self.assertEqual(states(results), [ (FILE_UNCHANGED, name) for name in names ])
+
+    def test_skipped_directory(self):
+        disk = [ disk_item('/w/a'), SkippedDirectory('/w/sub'), disk_item('/w/sub/deeper/x') ]
+        db = [ DbItem('/w/a'), DbItem('/w/sub/deeper/x'), DbItem('/w/sub/deeper/y'), DbItem('/w/sub/f') ]
+        results = list(merge_files(disk, db))
+        self.assertEqual(states(results), [ (FILE_UNCHANGED, '/w/a'), (FILE_UNCHANGED, '/w/sub/deeper/x'),
+                                            (FILE_DELETED, '/w/sub/deeper/y'), (FILE_UNCHANGED, '/w/sub/f') ])
+        # the files of the skipped directory are taken over without a disk item
+        self.assertIsNone(results[3][1])
+
+    def test_unsorted_input(self):
+        with self.assertRaises(ValueError):
+            list(merge_files([ disk_item('/w/b'), disk_item('/w/a') ], []))
+        with self.assertRaises(ValueError):
+            list(merge_files([], [ DbItem('/w/b'), DbItem('/w/a') ]))
+
+class DetectMovesTest(SimpleTestCase):
+    def test_move(self):
+        results = [ (FILE_ADDED, disk_item('/w/new', ino=5, dev=1), None, []),
+                    (FILE_DELETED, None, DbItem('/w/old', inode=5, device=1), []) ]
+        moves = list(detect_moves(results))
+        self.assertEqual(len(moves), 1)
+        (state, disk, db, changes) = moves[0]
+        self.assertEqual(state, FILE_MOVED)
+        self.assertEqual((disk.filename, db.filename), ('/w/new', '/w/old'))
+        self.assertEqual(changes[0].kind, CHANGE_MOVED)
+
+    def test_hard_links(self):
+        # only one of the added hard links can be the moved file
+        results = [ (FILE_ADDED, disk_item('/w/link1', ino=5, dev=1), None, []),
+                    (FILE_ADDED, disk_item('/w/link2', ino=5, dev=1), None, []),
+                    (FILE_DELETED, None, DbItem('/w/old', inode=5, device=1), []) ]
+        self.assertEqual(states(detect_moves(results)), [ (FILE_ADDED, '/w/link2'), (FILE_MOVED, '/w/link1') ])
+
+    def test_inode_reuse(self):
+        # same inode, but different content: a new file in a reused inode
+        results = [ (FILE_DELETED, None, DbItem('/w/old', inode=5, device=1), []),
+                    (FILE_ADDED, disk_item('/w/new', size=99, ino=5, dev=1), None, []),
+                    (FILE_ADDED, disk_item('/w/newer', mtime_ns=MTIME_NS + 1, ino=6, dev=1), None, []),
+                    (FILE_DELETED, None, DbItem('/w/older', inode=6, device=1), []) ]
+        self.assertEqual(sorted(states(detect_moves(results))), [ (FILE_ADDED, '/w/new'), (FILE_ADDED, '/w/newer'),
+                                                                  (FILE_DELETED, '/w/old'), (FILE_DELETED, '/w/older') ])
+
+    def test_max_pending(self):
+        results = [ (FILE_ADDED, disk_item('/w/a%i' % i, ino=i + 1, dev=1), None, []) for i in range(3) ]
+        results.append( (FILE_DELETED, None, DbItem('/w/old', inode=1, device=1), []) )
+        # the oldest added file is passed on before its counterpart shows up
+        self.assertEqual(states(detect_moves(results, max_pending=2)),
+                         [ (FILE_ADDED, '/w/a0'), (FILE_ADDED, '/w/a1'), (FILE_ADDED, '/w/a2'), (FILE_DELETED, '/w/old') ])
+        self.assertEqual(states(detect_moves(results)),
+                         [ (FILE_MOVED, '/w/a0'), (FILE_ADDED, '/w/a1'), (FILE_ADDED, '/w/a2') ])
+
+    def test_inode_updated(self):
+        disk = disk_item('/w/a', ino=7, dev=1)
+        db = DbItem('/w/a', inode=3, device=1)
+        self.assertEqual(states(detect_moves([ (FILE_UNCHANGED, disk, db, []) ])), [ (FILE_UPDATED, '/w/a') ])
+        self.assertEqual(db.inode, 7)
@@ -15,6 +15,13 @@ urlpatterns = patterns('',
     # Examples:
     url(r'^$', 'arsoft.web.filewatch.views.home', name='home'),
     url(r'^check$', 'arsoft.web.filewatch.views.check', name='check'),
+    url(r'^check/(?P<item_id>[0-9]+)$', 'arsoft.web.filewatch.views.check', name='check_item'),
+    url(r'^job/(?P<job_id>[0-9]+)/status$', 'arsoft.web.filewatch.views.job_status', name='job_status'),
+    url(r'^job/(?P<job_id>[0-9]+)/log$', 'arsoft.web.filewatch.views.job_log', name='job_log'),
+    url(r'^events$', 'arsoft.web.filewatch.views.events', name='events'),
+    url(r'^events/(?P<item_id>[0-9]+)$', 'arsoft.web.filewatch.views.events', name='item_events'),
+    url(r'^metrics$', 'arsoft.web.filewatch.views.metrics', name='metrics'),
+    url(r'^agent/(?P<item_id>[0-9]+)$', 'arsoft.web.filewatch.views.agent', name='agent'),
 
     # Uncomment the next line to enable the admin:
     url(r'^admin/', include(admin.site.urls)),
@@ -4,14 +4,36 @@
 
 from django.template import RequestContext, Template, Context, loader
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, StreamingHttpResponse
-from django.core.mail import send_mail
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed, \
+    StreamingHttpResponse, JsonResponse, Http404
+from django.views.decorators.csrf import csrf_exempt
+from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
-from arsoft.web.filewatch.models import FileWatchModel, FileWatchItemModel, FileWatchItemFromDisk
-from django.db import transaction
+from arsoft.web.filewatch.models import FileWatchModel, FileWatchJobModel
+from arsoft.web.filewatch.compare import merge_files, detect_moves, FILE_ADDED, FILE_CHANGED, FILE_UNCHANGED, FILE_DELETED, FILE_UPDATED, FILE_MOVED
+from arsoft.web.filewatch.hashing import FileHasher
+from arsoft.web.filewatch.notify import get_dispatcher
+from arsoft.web.filewatch.jobs import enqueue_check, job_log_filename
+from arsoft.web.filewatch.report import ChangeList, ChangeReport, REPORT_ATTACHMENT_NAME, REPORT_ATTACHMENT_MIMETYPE
+from arsoft.web.filewatch.persist import FileWatchItemWriter, iter_files_in_db, load_directory_snapshot, save_directory_snapshot, \
+    open_baseline, update_baseline
+from arsoft.web.filewatch.history import new_run_id, query_events, query_summaries, event_change
+from arsoft.web.filewatch.ingest import AgentAuthError, verify_request, agent_config, agent_status, apply_delta
+from arsoft.web.filewatch.persist import RevisionConflict
+from arsoft.web.filewatch.agent import decode_delta
+from arsoft.web.filewatch.status import StatusCounter, save_status, dashboard_rows
+from arsoft.web.filewatch.scan import FileWalker, FileWatchItemFromDisk, PathFilter, IOBudget, parse_patterns, prefetch
+from arsoft.web.filewatch.metrics import CheckMetrics, MetricsLine, OUTPUT_TEXT, OUTPUT_JSON, format_line, timed, \
+    record_check, load_metrics, format_prometheus
+from django.db import transaction, IntegrityError, DataError
+from django.utils import timezone
 
 import sys
-import os, stat
+import os
+import functools
+import time
+from collections import OrderedDict
+from itertools import groupby
 try:
     from StringIO import StringIO
 except ImportError:
@@ -26,10 +48,14 @@ import logging
 logger = logging.getLogger(__name__)
 
 def home(request):
-
+    # only reads the status of each item, not the files
+    rows = dashboard_rows()
     t = loader.get_template('home.html')
     c = RequestContext( request, { 
-        'title':'home'
+        'title':'filewatch',
+        'rows':rows,
+        'num_files':sum([ status.num_files for (item, status) in rows if status is not None ]),
+        'total_size':sum([ status.total_size for (item, status) in rows if status is not None ]),
         })
     return HttpResponse(t.render(c))
 
@@ -46,53 +72,151 @@ def _get_request_param(request, paramname, default_value=None):
         ret = default_value
     return ret
 
-def _get_files_recursive(filename):
-    ret = []
-    files = []
-    try:
-        files = os.listdir(filename)
-    except OSError:
-        pass
-    enc = sys.getfilesystemencoding()
-    for f in files:
-        if f == '.' or f == '..':
+_check_view_template = None
+
+def _get_check_view_template():
+    # compiled once, the template can be rendered any number of times
+    global _check_view_template
+    if _check_view_template is None:
+        _check_view_template = Template(FILEWATCH_CHECK_VIEW_TEMPLATE, name='check view template')
+    return _check_view_template
+
+def _notification_message(result_items, request=None):
+    report = ChangeReport(result_items, settings.REPORT_MAX_CHANGES, settings.REPORT_MAX_DIRECTORIES)
+    stat_dict = {
+                'filename': ', '.join([ result_item.filename for result_item in result_items ]),
+                'num_items': len(result_items),
+                'num_files': report.num_files,
+                'num_changed': report.num_changed,
+                'num_unchanged': report.num_unchanged,
+                }
+    if len(result_items) == 1:
+        subject = settings.EMAIL_SUBJECT_FORMAT % stat_dict
+    else:
+        subject = settings.EMAIL_DIGEST_SUBJECT_FORMAT % stat_dict
+    d = {
+        'request':request,
+        'item':result_items[0].item if len(result_items) == 1 else None,
+        'filename': stat_dict['filename'],
+        'num_files': report.num_files,
+        'num_changed': report.num_changed,
+        'num_unchanged': report.num_unchanged,
+        'changed_list':report.changed_list,
+        'unchanged_list':report.unchanged_list,
+        'report_unchanged': settings.REPORT_UNCHANGED,
+        'kind_list': report.kind_list,
+        'directory_list': report.directory_list,
+        'truncated': report.truncated,
+        'attachment_name': REPORT_ATTACHMENT_NAME,
+        }
+    c = RequestContext(request, d) if request is not None else Context(d)
+    return subject, _get_check_view_template().render(c), report
+
+def build_notification_messages(result_item_list, request=None):
+    """
+    Returns the notification mails for the given result items with changed
+    files. Each recipient gets a single mail (digest) covering all of its
+    watch items; recipients of the same watch items share one mail.
+    """
+    items_by_recipient = OrderedDict()
+    for result_item in result_item_list:
+        if not result_item.changed_list:
             continue
-        try:
-            full = os.path.join(filename, f)
-        except UnicodeDecodeError as e:
-            raise Exception('failure at %s: %s-%s, %s' % (enc, filename, f.decode('utf8'), e))
-        try:
-            s = os.stat(full)
-            if stat.S_ISDIR(s.st_mode):
-                subdir_files = _get_files_recursive(full)
-                ret.extend(subdir_files)
-            elif stat.S_ISREG(s.st_mode):
-                ret.append( FileWatchItemFromDisk(full, s) )
-        except FileNotFoundError:
-            pass
+        for recipient in result_item.recipient_list:
+            items_by_recipient.setdefault(recipient, []).append(result_item)
+    groups = OrderedDict()
+    for recipient, result_items in items_by_recipient.items():
+        key = tuple([ result_item.id for result_item in result_items ])
+        if key not in groups:
+            groups[key] = (result_items, [])
+        groups[key][1].append(recipient)
+
+    ret = []
+    for (result_items, recipient_list) in groups.values():
+        subject, html_message, report = _notification_message(result_items, request)
+        message = EmailMultiAlternatives(subject=subject, body='', from_email=settings.EMAIL_SENDER, to=recipient_list)
+        message.attach_alternative(html_message, 'text/html')
+        if report.truncated:
+            message.attach(REPORT_ATTACHMENT_NAME, report.csv_attachment(), REPORT_ATTACHMENT_MIMETYPE)
+        ret.append(message)
     return ret
 
+def send_email_notifications(result_item_list, request=None, timeout=0, metrics=None, job_id=None):
+    """
+    Queues the notification mails for the given result items and yields the
+    progress lines. The mails are delivered in the background; the number
+    of delivered and failed mails is only reported when delivery finished
+    within timeout seconds (None waits until it finished), but it is
+    recorded on the FileWatchJobModel job_id in any case. Without a request
+    the report is rendered with a plain context, so it can be used outside
+    of a HTTP request. The number of queued mails is counted in the given
+    CheckMetrics.
+    """
+    messages = build_notification_messages(result_item_list, request=request)
+    if metrics is not None:
+        metrics.mails_queued += len(messages)
+    if not messages:
+        yield 'send_notification: nothing to send\r\n'
+        return
+    for message in messages:
+        yield 'send_notification: about to send %s to %s\r\n' % (message.subject, message.to)
+    job = get_dispatcher().submit(messages, job_id=job_id)
+    if (timeout is None or timeout > 0) and job.wait(timeout):
+        yield 'send_notification: %i mails sent, %i failed\r\n' % (job.num_mails_ok, job.num_mails_failed)
+    else:
+        yield 'send_notification: %i mails queued\r\n' % len(messages)
+
 class CheckItemHandler(object):
-    def __init__(self, request=None, item_id=None, verbose=False, notify=True):
+    """
+    Checks the given watch item (an id or a list of ids, None checks all
+    items) and yields the progress lines. scan_workers and hash_workers
+    override CHECK_SCAN_WORKERS and CHECK_HASH_WORKERS. The delivery of the
+    notification mails is recorded on the FileWatchJobModel job_id.
+    """
+    def __init__(self, request=None, item_id=None, verbose=False, notify=True, incremental=None, full=False,
+                 subtree=None, include=None, exclude=None, output_format=OUTPUT_TEXT, run_id=None,
+                 scan_workers=None, hash_workers=None, job_id=None):
         self._pos = 0
+        self._job_id = job_id
         self._request = request
         self._item_id = item_id
         self._verbose = verbose
         self._notify = notify
+        self._incremental = settings.CHECK_INCREMENTAL if incremental is None else incremental
+        self._full = full
+        self._subtree = subtree
+        self._include = include
+        self._exclude = exclude
+        self._output_format = output_format
+        self._scan_workers = scan_workers if scan_workers else settings.CHECK_SCAN_WORKERS
+        self._hash_workers = hash_workers if hash_workers else settings.CHECK_HASH_WORKERS
+        # identifies the change events of this check
+        self.run_id = run_id if run_id else new_run_id()
+        self.metrics = CheckMetrics()
+        self._io_waited = 0.0
+        # shared by all walkers and hashers of the check
+        self._stat_budget = IOBudget(settings.CHECK_STAT_RATE) if settings.CHECK_STAT_RATE else None
+        self._hash_budget = IOBudget(settings.CHECK_HASH_RATE) if settings.CHECK_HASH_RATE else None
         self._handler_list = [ self._send_header, 
-                              self._load_disk_files, 
-                              self._load_db_files, 
-                              self._compare_files,
+                              self._check_items, 
                               self._send_email_notifications, 
+                              self._send_metrics,
                               self._send_footer ]
         self._result_item_list = []
         
     class ResultItem(object):
         def __init__(self, item):
-            self.changed_list = []
+            self.changed_list = ChangeList(item.filename, settings.REPORT_MAX_CHANGES)
             self.unchanged_list = []
-            self.files_on_disk = []
-            self.files_in_db = []
+            self.num_unchanged = 0
+            self.num_files_on_disk = 0
+            self.num_files_in_db = 0
+            self.scan_errors = []
+            self.walker = None
+            self.snapshot = None
+            self.incremental = False
+            self.subtree = None
+            self.path_filter = None
             self.item = item
 
         @property
@@ -103,6 +227,18 @@ class CheckItemHandler(object):
         def filename(self):
             return self.item.filename
 
+        @property
+        def root(self):
+            return self.subtree if self.subtree is not None else self.item.filename
+
+        @property
+        def num_changed(self):
+            return len(self.changed_list)
+
+        @property
+        def num_files(self):
+            return self.num_changed + self.num_unchanged
+
         @property
         def recipient_list(self):
             if isinstance(self.item.notify, list):
@@ -113,22 +249,31 @@ class CheckItemHandler(object):
                 return [ self.item.notify ]
 
 
+    @property
+    def num_changed(self):
+        return sum([ result_item.num_changed for result_item in self._result_item_list ])
+
     def _send_header(self):
-        if self._item_id:
+        if isinstance(self._item_id, (list, tuple)):
+            yield 'begin: check items %s\r\n' % ', '.join([ str(item_id) for item_id in self._item_id ])
+        elif self._item_id:
             yield 'begin: check item %i\r\n' % self._item_id
         else:
             yield 'begin: check all items\r\n'
         
     def _send_footer(self):
-        if self._item_id:
+        if isinstance(self._item_id, (list, tuple)):
+            yield 'complete: check items %s\r\n' % ', '.join([ str(item_id) for item_id in self._item_id ])
+        elif self._item_id:
             yield 'complete: check item %i\r\n' % self._item_id
         else:
             yield 'complete: check all items\r\n'
-        
-    def _load_disk_files(self):
 
+    def _get_item_list(self):
         item_list = []
-        if self._item_id:
+        if isinstance(self._item_id, (list, tuple)):
+            item_list = list(FileWatchModel.objects.filter(id__in=self._item_id).order_by('id'))
+        elif self._item_id:
             try:
                 item = FileWatchModel.objects.get(id=self._item_id)
                 if item:
@@ -136,161 +281,432 @@ class CheckItemHandler(object):
             except FileWatchModel.DoesNotExist:
                 pass
         else:
-            item_list = FileWatchModel.objects.all()
-                
-        for item in item_list:
+            item_list = list(FileWatchModel.objects.all())
+        return item_list
+
+    def _files_on_disk(self, result_item):
+        item = result_item.item
+        if not os.path.exists(result_item.root):
+            return []
+        elif os.path.isdir(item.filename) and item.recursive:
+            if result_item.path_filter is not None and result_item.path_filter.dir_excluded(result_item.root):
+                return []
+            if result_item.snapshot is None:
+                snapshot = None
+            elif result_item.incremental:
+                snapshot = result_item.snapshot
+            else:
+                # record the directories, but list all of them
+                snapshot = {}
+            walker = FileWalker(symlinks=settings.CHECK_SCAN_SYMLINKS,
+                                one_file_system=settings.CHECK_SCAN_ONE_FILE_SYSTEM,
+                                errors=settings.CHECK_SCAN_ERRORS,
+                                snapshot=snapshot,
+                                path_filter=result_item.path_filter,
+                                io_budget=self._stat_budget)
+            result_item.walker = walker
+            result_item.scan_errors = walker.errors
+            # a subtree is on the device of the watch root
+            root_dev = walker.root_dev(item.filename)
+            if settings.CHECK_SCAN_SPLIT_SUBDIRS:
+                return walker.walk_parallel(result_item.root, self._scan_workers, root_dev)
+            else:
+                return walker.walk(result_item.root, root_dev)
+        else:
+            s = os.stat(item.filename)
+            return [ FileWatchItemFromDisk(item.filename, s) ]
+
+    def _check_items(self):
+        # the files of each watch root are read by a separate worker, so
+        # a slow file system does not stall the other roots. The workers
+        # only read ahead a limited number of files; each watch item is
+        # compared and written before the next one is processed, so the
+        # memory usage does not grow with the number of watched files.
+        result_items = []
+        for item in self._get_item_list():
+            if item.host:
+                if self._item_id:
+                    yield 'check: %s is checked by the agent on %s\r\n' % (item.filename, item.host)
+                continue
             result_item = CheckItemHandler.ResultItem(item)
-            if os.path.exists(item.filename):
-                yield 'disk: Scanning %s for files\r\n' % (result_item.filename)
-                if os.path.isdir(item.filename) and item.recursive:
-                    result_item.files_on_disk = _get_files_recursive(item.filename)
+            if item.recursive:
+                item_filter = None
+                if item.include or item.exclude:
+                    item_filter = PathFilter(item.filename, include=parse_patterns(item.include), exclude=parse_patterns(item.exclude))
+                if self._include or self._exclude:
+                    result_item.path_filter = PathFilter(item.filename, include=self._include, exclude=self._exclude, parent=item_filter)
                 else:
-                    s = os.stat(item.filename)
-                    result_item.files_on_disk = [ FileWatchItemFromDisk(item.filename, s) ]
-            else:
-                yield 'disk: %s does not exist\r\n' % (result_item.filename)
+                    result_item.path_filter = item_filter
+            if self._subtree:
+                subtree = os.path.normpath(os.path.join(item.filename, self._subtree))
+                if subtree != item.filename:
+                    if not item.recursive or not subtree.startswith(os.path.join(item.filename, '')):
+                        yield 'check: %s is not a subtree of %s\r\n' % (self._subtree, item.filename)
+                        continue
+                    result_item.subtree = subtree
+            result_items.append(result_item)
+        if self._incremental:
+            now = timezone.now()
+            for result_item in result_items:
+                last_full_scan = result_item.item.last_full_scan
+                result_item.snapshot = load_directory_snapshot(result_item.item, result_item.subtree)
+                result_item.incremental = not self._full and last_full_scan is not None and \
+                    (now - last_full_scan).total_seconds() < settings.CHECK_FULL_SCAN_INTERVAL
+        sources = [ functools.partial(self._files_on_disk, result_item) for result_item in result_items ]
+        for result_item, files_on_disk in zip(result_items, prefetch(sources, self._scan_workers)):
             self._result_item_list.append(result_item)
-            yield 'disk: %s found %i files\r\n' % (result_item.filename, len(result_item.files_on_disk))
-
-    def _load_db_files(self):
-        for result_item in self._result_item_list:
-            yield 'database: %s loading files\r\n' % (result_item.filename)
-            try:
-                result_item.files_in_db = FileWatchItemModel.objects.filter(watchid=result_item.id)
-            except FileWatchItemModel.DoesNotExist:
-                pass
-            yield 'database: %s loaded %i files\r\n' % (result_item.filename, len(result_item.files_in_db))
+            root_metrics = self.metrics.root(result_item.root)
+            for line in timed(self._check_item(result_item, files_on_disk), root_metrics.add_duration):
+                yield line
 
-    def _compare_files(self):
-
-        for result_item in self._result_item_list:
-            yield 'compare: %s start\r\n' % (result_item.filename)
-            # expect all files from DB to be found on disk
-            missing_files_from_db = []
-            for db_item in result_item.files_in_db:
-                missing_files_from_db.append(db_item)
+    def _check_item(self, result_item, files_on_disk):
+        started = time.time()
+        if os.path.exists(result_item.root):
+            if result_item.incremental:
+                yield 'disk: Scanning %s for files in changed directories\r\n' % (result_item.root)
+            else:
+                yield 'disk: Scanning %s for files\r\n' % (result_item.root)
+        else:
+            yield 'disk: %s does not exist\r\n' % (result_item.root)
+        yield 'compare: %s start\r\n' % (result_item.filename)
 
-            result_item.changed_list = []
-            result_item.unchanged_list = []
+        hasher = None
+        if result_item.item.checksum:
+            try:
+                hasher = FileHasher(result_item.item.checksum, self._hash_workers, io_budget=self._hash_budget)
+            except ValueError:
+                yield 'hash: %s checksum algorithm %s not supported\r\n' % (result_item.filename, result_item.item.checksum)
 
-            for disk_item in result_item.files_on_disk:
-                found = False
-                for db_item in result_item.files_in_db:
-                    if db_item.filename == disk_item.filename:
-                        found = True
-                        break
-                changes = []
-                if not found:
-                    with transaction.atomic():
-                        model = FileWatchItemModel.objects.create(watchid=result_item.item, 
-                                                                filename=disk_item.filename, 
-                                                                created=disk_item.created,
-                                                                modified=disk_item.modified,
-                                                                uid=disk_item.uid,
-                                                                gid=disk_item.gid,
-                                                                mode=disk_item.mode,
-                                                                size=disk_item.size
-                                                                )
-                    changes.append( 'File added' )
+        baseline = open_baseline(result_item.item) if settings.CHECK_BASELINE else None
+        if baseline is None:
+            files_in_db = iter_files_in_db(result_item.item, subtree=result_item.subtree)
+        elif result_item.subtree is not None:
+            files_in_db = baseline.iter_subtree(result_item.subtree)
+        else:
+            files_in_db = iter(baseline)
+        if result_item.path_filter is not None:
+            # the files which are not selected are neither reported as
+            # deleted nor removed from the database
+            path_filter = result_item.path_filter
+            files_in_db = ( db_item for db_item in files_in_db if path_filter.include_path(db_item.filename) )
+        results = merge_files(files_on_disk, files_in_db)
+        if hasher is not None:
+            results = hasher.process(results)
+        if settings.CHECK_DETECT_MOVES:
+            results = detect_moves(results, settings.CHECK_MOVE_MAX_PENDING)
+        writer = FileWatchItemWriter(result_item.item, run_id=self.run_id if settings.EVENT_LOG else None)
+        counter = StatusCounter()
+        try:
+            for (state, disk_item, db_item, changes) in results:
+                counter.add(state, disk_item, db_item, changes)
+                if disk_item is not None:
+                    result_item.num_files_on_disk += 1
+                if db_item is not None:
+                    result_item.num_files_in_db += 1
+                if state == FILE_ADDED:
+                    writer.insert(disk_item, changes)
+                    result_item.changed_list.append( (disk_item.filename, changes) )
                     yield 'compare: %s: file %s added\r\n' % (result_item.filename, disk_item.filename)
-                else:
-                    missing_files_from_db.remove(db_item)
-
-                    #logger.error('%s %s, %s' % (disk_item.filename, disk_item.created, as_local_time(disk_item.created)))
-                    #logger.error('%s %s, %s' % (db_item.filename, db_item.created, as_local_time(db_item.created)))
-                    db_item_dirty = False
-                    if disk_item.created != db_item.created:
-                        changes.append( 'Create time changed from %s to %s' % (as_local_time(db_item.created), as_local_time(disk_item.created)) )
-                        db_item.created = disk_item.created
-                        db_item_dirty = True
-                    if disk_item.modified != db_item.modified:
-                        changes.append( 'Modification time changed from %s to %s' % (as_local_time(db_item.modified), as_local_time(disk_item.modified)) )
-                        db_item.modified = disk_item.modified
-                        db_item_dirty = True
-                    if disk_item.uid != db_item.uid:
-                        changes.append( 'Owner changed from %i to %i' % (db_item.uid, disk_item.uid) )
-                        db_item.uid = disk_item.uid
-                        db_item_dirty = True
-                    if disk_item.gid != db_item.gid:
-                        changes.append( 'Group changed from %i to %i' % (db_item.gid, disk_item.gid) )
-                        db_item.gid = disk_item.gid
-                        db_item_dirty = True
-                    if disk_item.mode != db_item.mode:
-                        changes.append( 'Mode changed from %o to %o' % (db_item.mode, disk_item.mode) )
-                        db_item.mode = disk_item.mode
-                        db_item_dirty = True
-                    if disk_item.size != db_item.size:
-                        changes.append( 'Size changed from %o to %o' % (db_item.size, disk_item.size) )
-                        db_item.size = disk_item.size
-                        db_item_dirty = True
-                    if db_item_dirty:
-                        yield 'compare: %s: file %s changed\r\n' % (result_item.filename, disk_item.filename)
-                        with transaction.atomic():
-                            db_item.save()
-                    else:
-                        yield 'compare: %s: file %s unchanged\r\n' % (result_item.filename, disk_item.filename)
+                elif state == FILE_CHANGED:
+                    writer.update(db_item, changes)
+                    result_item.changed_list.append( (disk_item.filename, changes) )
+                    yield 'compare: %s: file %s changed\r\n' % (result_item.filename, disk_item.filename)
+                elif state == FILE_UNCHANGED or state == FILE_UPDATED:
+                    if state == FILE_UPDATED:
+                        writer.update(db_item)
+                    yield 'compare: %s: file %s unchanged\r\n' % (result_item.filename, db_item.filename)
+                    result_item.num_unchanged += 1
+                    if settings.REPORT_UNCHANGED and len(result_item.unchanged_list) < settings.REPORT_MAX_CHANGES:
                         result_item.unchanged_list.append( (db_item.filename, []) )
-
-                if changes:
+                elif state == FILE_DELETED:
+                    writer.delete(db_item, changes)
+                    result_item.changed_list.append( (db_item.filename, changes) )
+                    yield 'compare: %s: file %s deleted\r\n' % (result_item.filename, db_item.filename)
+                elif state == FILE_MOVED:
+                    old_filename = db_item.filename
+                    writer.move(db_item, disk_item, changes)
                     result_item.changed_list.append( (disk_item.filename, changes) )
-            for db_item in missing_files_from_db:
-                changes = ['File deleted']
-                result_item.changed_list.append( (db_item.filename, changes) )
-                with transaction.atomic():
-                    db_item.delete()
-                yield 'compare: %s: file %s deleted\r\n' % (result_item.filename, db_item.filename)
-            yield 'compare: %s done\r\n' % (result_item.filename)
+                    yield 'compare: %s: file %s moved to %s\r\n' % (result_item.filename, old_filename, disk_item.filename)
+        except BaseException:
+            writer.close(sys.exc_info())
+            if baseline is not None:
+                baseline.close()
+            raise
+        writer.close()
+        if settings.CHECK_BASELINE:
+            try:
+                baseline_result = update_baseline(result_item.item, baseline, writer)
+            finally:
+                if baseline is not None:
+                    baseline.close()
+            if baseline_result is not None:
+                yield 'baseline: %s %s %i files\r\n' % (result_item.filename, 'wrote' if baseline_result[1] else 'updated', baseline_result[0])
+        walker = result_item.walker
+        complete = result_item.subtree is None and not self._include and not self._exclude
+        if complete:
+            result_item.item.last_check = timezone.now()
+            result_item.item.save(update_fields=['last_check'])
+        # an incremental check does not see the files of the unchanged
+        # directories, so only its changes are applied to the totals
+        save_status(result_item.item, timezone.now(), time.time() - started, counter, complete and not result_item.incremental)
+        if walker is not None and walker.snapshot is not None:
+            num_dirs_written = save_directory_snapshot(result_item.item, result_item.snapshot, walker.directories)
+            if not result_item.incremental and complete:
+                result_item.item.last_full_scan = timezone.now()
+                result_item.item.save(update_fields=['last_full_scan'])
+            yield 'disk: %s listed %i of %i directories\r\n' % (result_item.filename, len(walker.directories) - len(walker.skipped), len(walker.directories))
+            yield 'database: %s wrote %i directories\r\n' % (result_item.filename, num_dirs_written)
+        for (path, error) in result_item.scan_errors:
+            yield 'disk: unable to access %s: %s\r\n' % (path, error)
+        if hasher is not None:
+            for (path, error) in hasher.errors:
+                yield 'hash: unable to read %s: %s\r\n' % (path, error)
+            yield 'hash: %s hashed %i files (%i unchanged), %.1f MB in %.2fs, %.1f MB/s\r\n' % \
+                (result_item.filename, hasher.num_hashed, hasher.num_cached, hasher.bytes_hashed / 1048576.0,
+                 hasher.elapsed, hasher.megabytes_per_second)
+        yield 'disk: %s found %i files\r\n' % (result_item.filename, result_item.num_files_on_disk)
+        yield '%s: %s loaded %i files\r\n' % ('baseline' if baseline is not None else 'database', result_item.filename, result_item.num_files_in_db)
+        yield 'database: %s wrote %i rows (%i added, %i changed, %i moved, %i deleted) in %.2fs, %.0f rows/s\r\n' % \
+            (result_item.filename, writer.num_written, writer.num_inserted, writer.num_updated, writer.num_moved, writer.num_deleted,
+             writer.elapsed, writer.rows_per_second)
+        if writer.num_events:
+            yield 'database: %s recorded %i change events for run %s\r\n' % (result_item.filename, writer.num_events, self.run_id)
+        stat_waited = self._stat_budget.waited if self._stat_budget is not None else 0.0
+        hash_waited = self._hash_budget.waited if self._hash_budget is not None else 0.0
+        if self._stat_budget is not None or self._hash_budget is not None:
+            yield 'io: %s throttled for %.2fs (stat) and %.2fs (hash) so far\r\n' % (result_item.filename, stat_waited, hash_waited)
+
+        root_metrics = self.metrics.root(result_item.root)
+        counters = root_metrics.counters
+        counters['files_scanned'] = result_item.num_files_on_disk
+        counters['db_rows_read'] = result_item.num_files_in_db
+        counters['db_rows_written'] = writer.num_written
+        counters['files_changed'] = result_item.num_changed
+        if walker is not None:
+            counters['dirs_listed'] = walker.num_dirs_listed
+            counters['stat_calls'] = walker.num_stat_calls
+        elif result_item.num_files_on_disk:
+            counters['stat_calls'] = 1
+        root_metrics.timers['db_write'] = writer.elapsed
+        if hasher is not None:
+            counters['files_hashed'] = hasher.num_hashed
+            counters['bytes_hashed'] = hasher.bytes_hashed
+            root_metrics.timers['hash'] = hasher.elapsed
+        # the budgets are shared by all roots of the check
+        root_metrics.timers['io_wait'] = stat_waited + hash_waited - self._io_waited
+        self._io_waited = stat_waited + hash_waited
+        yield 'compare: %s done\r\n' % (result_item.filename)
 
     def _send_email_notifications(self):
         if not self._notify:
             yield 'send_notification: skipped\r\n'
             return
+        for line in send_email_notifications(self._result_item_list, request=self._request, timeout=settings.NOTIFY_WAIT_TIMEOUT,
+                                             metrics=self.metrics, job_id=self._job_id):
+            yield line
 
-        for result_item in self._result_item_list:
-            if not result_item.changed_list:
-                continue
-            stat_dict = { 
-                        'filename': result_item.filename, 
-                        'num_files': len(result_item.changed_list) + len(result_item.unchanged_list),
-                        'num_changed': len(result_item.changed_list), 
-                        'num_unchanged': len(result_item.unchanged_list) 
-                        }
-            
-            subject = settings.EMAIL_SUBJECT_FORMAT % stat_dict
-            from_email = settings.EMAIL_SENDER
-            recipient_list = result_item.recipient_list
-
-            t = Template(FILEWATCH_CHECK_VIEW_TEMPLATE, name='check view template')
-            c = RequestContext( self._request, { 
-                'request':self._request,
-                'item':result_item.item,
-                'filename': result_item.filename, 
-                'num_files': len(result_item.changed_list) + len(result_item.unchanged_list),
-                'num_changed': len(result_item.changed_list), 
-                'num_unchanged': len(result_item.unchanged_list),
-                'changed_list':result_item.changed_list,
-                'unchanged_list':result_item.unchanged_list,
-                'report_unchanged': settings.REPORT_UNCHANGED,
-                })
-            yield 'send_notification: about to %s sent to %s\r\n' % (result_item.filename, recipient_list)
-            send_mail(subject=subject, from_email=from_email, recipient_list=recipient_list, message='', html_message=t.render(c), fail_silently=False)
-            yield 'send_notification: %s sent to %s\r\n' % (result_item.filename, recipient_list)
+    def _send_metrics(self):
+        for root_metrics in self.metrics.roots.values():
+            data = root_metrics.as_dict()
+            data['root'] = root_metrics.root
+            yield MetricsLine('metrics: %s %s\r\n' % (root_metrics.root,
+                ' '.join([ '%s=%s' % (name, ('%.3f' % value) if isinstance(value, float) else value) for (name, value) in data.items() if name != 'root' ])),
+                data)
+        for (stage, seconds) in self.metrics.stages.items():
+            yield MetricsLine('metrics: stage %s took %.3fs\r\n' % (stage, seconds),
+                              OrderedDict([ ('stage_name', stage), ('seconds', round(seconds, 6)) ]))
+        record_check(self.metrics)
 
     def __iter__(self):
         for func in self._handler_list:
-            for func_result in func():
-                yield func_result
+            # only the time spent in the handler is counted, not the time
+            # needed to send its output
+            stage = func.__name__.lstrip('_')
+            for func_result in timed(func(), self.metrics.stage_timer(stage)):
+                yield format_line(func_result, self._output_format)
+
+def check(request, item_id=None):
 
-@transaction.non_atomic_requests
-def check(request):
-    
     verbose = _get_request_param(request, 'verbose', 0)
     notify = _get_request_param(request, 'notify', 1)
+    incremental = _get_request_param(request, 'incremental', 1 if settings.CHECK_INCREMENTAL else 0)
+    full = _get_request_param(request, 'full', 0)
+    subtree = _get_request_param(request, 'subtree', '')
+    include = request.GET.getlist('include')
+    exclude = request.GET.getlist('exclude')
+    output_format = _get_request_param(request, 'format', OUTPUT_TEXT)
+    if output_format not in (OUTPUT_TEXT, OUTPUT_JSON):
+        return HttpResponseBadRequest('format %s not supported\r\n' % output_format, content_type="text/plain")
+
+    item = None
+    if item_id is not None:
+        try:
+            item = FileWatchModel.objects.get(id=item_id)
+        except FileWatchModel.DoesNotExist:
+            raise Http404('Item %s does not exist' % item_id)
+    elif subtree:
+        return HttpResponseBadRequest('subtree requires an item\r\n', content_type="text/plain")
+
+    job, created = enqueue_check(item=item, verbose=bool(verbose), notify=bool(notify), incremental=bool(incremental), full=bool(full),
+                                 subtree=subtree, include='\n'.join(include), exclude='\n'.join(exclude), output_format=output_format)
+    if created:
+        content = 'job: %i queued\r\n' % job.id
+    else:
+        content = 'job: %i already queued\r\n' % job.id
+    return HttpResponse(content, status=202, content_type="text/plain")
+
+def _get_job(job_id):
+    try:
+        return FileWatchJobModel.objects.get(id=job_id)
+    except FileWatchJobModel.DoesNotExist:
+        raise Http404('Job %s does not exist' % job_id)
+
+def job_status(request, job_id):
+    job = _get_job(job_id)
+    lines = [ 'job: %i\r\n' % job.id,
+              'item: %s\r\n' % (job.watchid.filename if job.watchid is not None else 'all'),
+              'state: %s\r\n' % job.state,
+              'created: %s\r\n' % as_local_time(job.created) ]
+    if job.subtree:
+        lines.append('subtree: %s\r\n' % job.subtree)
+    for pattern in parse_patterns(job.include):
+        lines.append('include: %s\r\n' % pattern)
+    for pattern in parse_patterns(job.exclude):
+        lines.append('exclude: %s\r\n' % pattern)
+    if job.started is not None:
+        lines.append('started: %s\r\n' % as_local_time(job.started))
+    if job.finished is not None:
+        lines.append('finished: %s\r\n' % as_local_time(job.finished))
+    if job.worker:
+        lines.append('worker: %s\r\n' % job.worker)
+    if job.num_mails_ok is not None:
+        lines.append('mails: %i sent, %i failed\r\n' % (job.num_mails_ok, job.num_mails_failed))
+    return HttpResponse(''.join(lines), content_type="text/plain")
+
+def _follow_job_log(job):
+    # waits for the worker to start the job and follows its output until
+    # the job is finished
+    f = None
+    try:
+        while True:
+            finished = job.is_finished
+            if f is None:
+                try:
+                    f = open(job_log_filename(job), 'r', newline='')
+                except (IOError, OSError):
+                    if finished:
+                        yield format_line('job: %i has no log\r\n' % job.id, job.output_format)
+                        return
+            if f is not None:
+                while True:
+                    line = f.readline()
+                    if not line:
+                        break
+                    yield line
+            if finished:
+                yield format_line('job: %i %s\r\n' % (job.id, job.state), job.output_format)
+                return
+            time.sleep(settings.JOB_FOLLOW_INTERVAL)
+            job.refresh_from_db()
+    finally:
+        if f is not None:
+            f.close()
 
-    response_status = 200
-    response = StreamingHttpResponse(streaming_content=CheckItemHandler(request=request, verbose=verbose, notify=notify), 
-                                     status=response_status, content_type="text/plain")
-    return response
+@transaction.non_atomic_requests
+def job_log(request, job_id):
+    job = _get_job(job_id)
+    content_type = "application/x-ndjson" if job.output_format == OUTPUT_JSON else "text/plain"
+    return StreamingHttpResponse(streaming_content=_follow_job_log(job), content_type=content_type)
+
+def _parse_time_param(request, paramname):
+    value = _get_request_param(request, paramname, '')
+    if not value:
+        return None
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return timezone.make_aware(datetime.strptime(value, fmt), timezone.get_current_timezone())
+        except ValueError:
+            pass
+    raise ValueError('invalid time %s for %s' % (value, paramname))
+
+def events(request, item_id=None):
+    item = None
+    if item_id is not None:
+        try:
+            item = FileWatchModel.objects.get(id=item_id)
+        except FileWatchModel.DoesNotExist:
+            raise Http404('Item %s does not exist' % item_id)
+    try:
+        since = _parse_time_param(request, 'since')
+        until = _parse_time_param(request, 'until')
+    except ValueError as e:
+        return HttpResponseBadRequest('%s\r\n' % e, content_type="text/plain")
+    limit = _get_request_param(request, 'limit', 1000)
+    lines = []
+    if _get_request_param(request, 'summary', 0):
+        qs = query_summaries(item, since.date() if since else None, until.date() if until else None)
+        for summary in qs.select_related('watchid')[:limit]:
+            lines.append('summary: %s %s %s %i events, %i files\r\n' % (summary.day, summary.watchid.filename, summary.kind,
+                                                                        summary.num_events, summary.num_files))
+    else:
+        qs = query_events(item, _get_request_param(request, 'path', ''), since, until, _get_request_param(request, 'run', ''))
+        for event in qs[:limit]:
+            line = 'event: %s %s %s %s' % (as_local_time(event.time), event.run_id, event.kind, event.filename)
+            if event.old_value or event.new_value:
+                line += ' %s -> %s' % (event.old_value, event.new_value)
+            lines.append(line + '\r\n')
+    return HttpResponse(''.join(lines), content_type="text/plain")
+
+def metrics(request):
+    data = load_metrics()
+    return HttpResponse(format_prometheus(data), content_type="text/plain; version=0.0.4")
+
+def _agent_notification(item, run_id, num_files):
+    # the changes of all batches of the check are taken from the history,
+    # grouped by file
+    result_item = CheckItemHandler.ResultItem(item)
+    events = query_events(item, run_id=run_id).order_by('filename', 'time', 'id').iterator()
+    for (filename, file_events) in groupby(events, lambda event: event.filename):
+        result_item.changed_list.append( (filename, [ event_change(event) for event in file_events ]) )
+    result_item.num_unchanged = max(0, num_files - result_item.num_changed)
+    result_item.num_files_on_disk = num_files
+    for line in send_email_notifications([result_item], timeout=settings.NOTIFY_WAIT_TIMEOUT):
+        pass
+
+@csrf_exempt
+@transaction.non_atomic_requests
+def agent(request, item_id):
+    try:
+        item = FileWatchModel.objects.get(id=item_id)
+    except FileWatchModel.DoesNotExist:
+        raise Http404('Item %s does not exist' % item_id)
+    if request.method not in ('GET', 'POST'):
+        return HttpResponseNotAllowed(['GET', 'POST'])
+    try:
+        verify_request(request, item)
+    except AgentAuthError as e:
+        logger.warning('Agent request for item %s refused: %s' % (item_id, e))
+        return HttpResponseForbidden('%s\r\n' % e, content_type="text/plain")
+    if request.method == 'GET':
+        return JsonResponse(agent_config(item))
+    try:
+        payload = decode_delta(request.body, settings.AGENT_MAX_DELTA_SIZE)
+        status = agent_status(payload)
+        writer = apply_delta(item, payload)
+    except RevisionConflict as e:
+        return JsonResponse({ 'error': str(e), 'revision': FileWatchModel.objects.get(id=item_id).revision }, status=409)
+    except IntegrityError as e:
+        # the delta does not match the stored files, e.g. a file added twice;
+        # the agent sends all files again with the next check
+        logger.warning('Agent delta for item %s does not match the stored files: %s' % (item_id, e))
+        return JsonResponse({ 'error': 'delta does not match the stored files: %s' % e,
+                              'revision': FileWatchModel.objects.get(id=item_id).revision }, status=409)
+    except (ValueError, KeyError, TypeError, IndexError, DataError) as e:
+        return HttpResponseBadRequest('invalid delta: %s\r\n' % e, content_type="text/plain")
+    if status is not None and payload.get('notify') and payload.get('run') and settings.EVENT_LOG:
+        _agent_notification(item, payload['run'], status.num_files)
+    return JsonResponse({ 'revision': item.revision, 'inserted': writer.num_inserted, 'updated': writer.num_updated,
+                          'moved': writer.num_moved, 'deleted': writer.num_deleted })
 
 FILEWATCH_CHECK_VIEW_TEMPLATE = """
 {% load type %}
@@ -325,6 +741,9 @@ FILEWATCH_CHECK_VIEW_TEMPLATE = """
     #unchanged ol { margin: 0.5em 4em; }
     #unchanged ol li { font-family: monospace; }
     #summary { background: #ffc; }
+    #kinds { background:#f6f6f6; }
+    #directories { background:#f6f6f6; }
+    #directories td { font-family: monospace; }
     #explanation { background:#eee; border-bottom: 0px none; }
   </style>
 </head>
@@ -336,17 +755,10 @@ FILEWATCH_CHECK_VIEW_TEMPLATE = """
   <h1>Filewatch report</h1>
   {% endif %}
     <table class="meta">
-  {% if filename %}
     <tr>
       <th>Filename:</th>
       <td><pre>{{ filename }}</pre></td>
     </tr>
-  {% else %}
-    <tr>
-      <th>Number of mails:</th>
-      <td>{{ num_mails_ok }} ok / {{ num_mails_failed }} failed</td>
-    </tr>
-  {% endif %}
     <tr>
       <th>Total number of files:</th>
       <td>{{ num_files }}</td>
@@ -361,9 +773,39 @@ FILEWATCH_CHECK_VIEW_TEMPLATE = """
     </tr>
     </table>
   </div>
+{% if kind_list %}
+  <div id="kinds">
+    <p>Changes by kind</p>
+    <table>
+      {% for kind, count in kind_list %}
+      <tr>
+        <th>{{ kind }}:</th>
+        <td>{{ count }}</td>
+      </tr>
+      {% endfor %}
+    </table>
+  </div>
+{% endif %}
+{% if truncated and directory_list %}
+  <div id="directories">
+    <p>Most changes by directory</p>
+    <table>
+      {% for kind, dirname, count in directory_list %}
+      <tr>
+        <th>{{ kind }}:</th>
+        <td>{{ dirname }} ({{ count }})</td>
+      </tr>
+      {% endfor %}
+    </table>
+  </div>
+{% endif %}
 {% if num_changed != 0 %}
   <div id="changed">
+    {% if truncated %}
+    <p>Changed files (first {{ changed_list|length }} of {{ num_changed }}, the complete list is attached as {{ attachment_name }})</p>
+    {% else %}
     <p>Changed files</p>
+    {% endif %}
       <ol>
         {% for item in changed_list %}
           <li>
@@ -0,0 +1,433 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from arsoft.web.filewatch.models import FileWatchModel, FileWatchItemModel
+from arsoft.web.filewatch.compare import get_changes, detect_moves, FILE_ADDED, FILE_CHANGED, FILE_UNCHANGED, FILE_DELETED, FILE_UPDATED, FILE_MOVED, ADDED_CHANGE, DELETED_CHANGE
+from arsoft.web.filewatch.hashing import FileHasher
+from arsoft.web.filewatch.persist import FileWatchItemWriter, open_baseline, update_baseline
+from arsoft.web.filewatch.history import new_run_id
+from arsoft.web.filewatch.status import StatusCounter, save_status
+from arsoft.web.filewatch.views import CheckItemHandler, send_email_notifications
+from arsoft.web.filewatch.jobs import worker_name, lock_item, unlock_item
+from arsoft.web.filewatch.scan import FileWatchItemFromDisk, PathFilter, parse_patterns, SYMLINKS_IGNORE, SYMLINKS_FOLLOW
+from arsoft.web.filewatch.inotify import INotify, IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE, \
+    IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED, IN_DONT_FOLLOW, IN_EXCL_UNLINK
+
+import os, stat
+import sys
+import errno
+import time
+
+# import the logging library
+import logging
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+class FileWatchDaemon(object):
+    """
+    Watches the given items with inotify and updates the file entries of
+    the paths touched by the events. Events are collected until no new
+    event arrived for WATCH_COALESCE_DELAY seconds (or at most
+    WATCH_MAX_DELAY seconds), so a burst of events for the same files is
+    handled at once. The changes are collected per watch item and sent as
+    notification every WATCH_NOTIFY_INTERVAL seconds.
+
+    Each item is locked like by a check job while the daemon changes its
+    files; the changes of an item locked by a check are handled again
+    later. The baseline of the item is kept up to date with the changes.
+    When the changes cannot be written they are rolled back and the item
+    is checked completely instead.
+
+    Like the checks, the daemon skips the files and directories excluded
+    by the include and exclude patterns of an item and handles symbolic
+    links as selected by CHECK_SCAN_SYMLINKS.
+
+    All items are checked completely on startup and after the event queue
+    of the kernel overflowed. Linked directories are not watched, so their
+    changes are only found by these checks; an item is checked completely
+    when a link to a directory is created or removed in it. A watch root which is deleted,
+    moved away or replaced (e.g. a file saved by renaming a new one over
+    it) is watched again as soon as it exists.
+    """
+
+    WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+                    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+
+    def __init__(self, item_list, notify=True, output=None):
+        self._item_list = list(item_list)
+        self._notify = notify
+        self._output = output
+        self._inotify = INotify()
+        self._name = worker_name()
+        self._wd_to_path = {}
+        # paths of touched files and removed directories per item id
+        self._touched = {}
+        self._touched_dirs = {}
+        self._first_event = None
+        self._last_event = None
+        self._reconcile = set()
+        self._notifications = {}
+        self._last_notify = time.time()
+        # watch roots which were deleted, moved or replaced and need to be
+        # watched again once they exist
+        self._lost_roots = set()
+        self._symlinks = settings.CHECK_SCAN_SYMLINKS
+        self._filters = {}
+        for item in self._item_list:
+            if item.recursive and (item.include or item.exclude):
+                self._filters[item.id] = PathFilter(item.filename, include=parse_patterns(item.include), exclude=parse_patterns(item.exclude))
+
+    def _write(self, line):
+        if self._output is not None:
+            self._output(line.rstrip('\r\n'))
+
+    def _included(self, item, path, is_dir=False):
+        path_filter = self._filters.get(item.id)
+        if path_filter is None or path == item.filename:
+            return True
+        return not path_filter.dir_excluded(path) if is_dir else path_filter.include_path(path)
+
+    def _items_for_path(self, path, is_dir=False):
+        """
+        Returns the watch items which contain the given file or directory
+        and do not exclude it.
+        """
+        ret = []
+        for item in self._item_list:
+            if path == item.filename or (item.recursive and path.startswith(os.path.join(item.filename, ''))):
+                if self._included(item, path, is_dir):
+                    ret.append(item)
+        return ret
+
+    def _add_watch(self, path):
+        try:
+            wd = self._inotify.add_watch(path, self.WATCH_MASK)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                logger.error('Unable to watch %s: limit of inotify watches reached (fs.inotify.max_user_watches)' % path)
+            elif e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                logger.error('Unable to watch %s: %s' % (path, e.strerror))
+            return False
+        self._wd_to_path[wd] = path
+        return True
+
+    def _add_watches(self, root):
+        """
+        Watches the given directory and all directories below it which are
+        not excluded by all items and returns the included files found
+        inside of them.
+        """
+        files = []
+        if not self._items_for_path(root, is_dir=True):
+            return files
+        stack = [ root ]
+        while stack:
+            path = stack.pop()
+            if not self._add_watch(path):
+                continue
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_symlink():
+                        # linked directories are not watched
+                        if self._symlinks == SYMLINKS_IGNORE or entry.is_dir():
+                            continue
+                        if self._items_for_path(entry.path):
+                            files.append(entry.path)
+                    elif entry.is_dir(follow_symlinks=False):
+                        if self._items_for_path(entry.path, is_dir=True):
+                            stack.append(entry.path)
+                    elif self._items_for_path(entry.path):
+                        files.append(entry.path)
+                except OSError:
+                    pass
+        return files
+
+    def _remove_watches(self, root):
+        prefix = os.path.join(root, '')
+        for wd, path in list(self._wd_to_path.items()):
+            if path == root or path.startswith(prefix):
+                del self._wd_to_path[wd]
+                self._inotify.rm_watch(wd)
+
+    def _watch_root(self, item):
+        """
+        Watches the given watch item and returns the files found or None if
+        it cannot be watched.
+        """
+        if item.recursive and os.path.isdir(item.filename):
+            files = self._add_watches(item.filename)
+            return files if item.filename in self._wd_to_path.values() else None
+        elif self._add_watch(item.filename):
+            return [ item.filename ]
+        return None
+
+    def _setup(self):
+        for item in self._item_list:
+            if self._watch_root(item) is None:
+                self._lost_roots.add(item.filename)
+            self._reconcile.add(item.id)
+
+    def _root_lost(self, path):
+        # a file saved by renaming a new one over it or a root which was
+        # deleted or moved away; its watch is gone or follows the old file
+        self._remove_watches(path)
+        self._lost_roots.add(path)
+        self._touch(path, is_dir=True)
+        self._touch(path)
+
+    def _rewatch_roots(self):
+        ret = False
+        for item in self._item_list:
+            if item.filename in self._lost_roots and os.path.exists(item.filename):
+                files = self._watch_root(item)
+                if files is not None:
+                    self._lost_roots.discard(item.filename)
+                    for filename in files:
+                        self._touch(filename)
+                    ret = True
+        return ret
+
+    def _root_paths(self):
+        return set([ item.filename for item in self._item_list ])
+
+    def _touch(self, path, is_dir=False):
+        for item in self._items_for_path(path, is_dir):
+            if is_dir:
+                self._touched_dirs.setdefault(item.id, set()).add(path)
+            else:
+                self._touched.setdefault(item.id, set()).add(path)
+
+    def _handle_event(self, event):
+        if event.mask & IN_Q_OVERFLOW:
+            # events got lost, so only a complete check is reliable
+            logger.warning('inotify event queue overflow, checking all items')
+            self._reconcile.update([ item.id for item in self._item_list ])
+            return
+        path = self._wd_to_path.get(event.wd)
+        if path is None:
+            return
+        if event.mask & IN_IGNORED:
+            del self._wd_to_path[event.wd]
+            if path in self._root_paths():
+                self._root_lost(path)
+            return
+        if not event.name and event.mask & (IN_DELETE_SELF | IN_MOVE_SELF) and path in self._root_paths():
+            self._root_lost(path)
+            return
+        full = os.path.join(path, event.name) if event.name else path
+        if event.is_dir and event.name:
+            if event.mask & (IN_CREATE | IN_MOVED_TO):
+                for filename in self._add_watches(full):
+                    self._touch(filename)
+            if event.mask & IN_MOVED_FROM:
+                # the watches keep following the moved directory, so drop
+                # them; they are added again when it is moved to a watched
+                # directory.
+                self._remove_watches(full)
+            if event.mask & (IN_DELETE | IN_MOVED_FROM):
+                self._touch(full, is_dir=True)
+        else:
+            if self._symlinks == SYMLINKS_FOLLOW and event.name and event.mask & (IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM):
+                self._linked_dir_changed(full)
+            self._touch(full)
+
+    def _linked_dir_changed(self, path):
+        # the files below a linked directory are only reported by a check;
+        # a removed link is no longer a directory, so its files are looked
+        # up in the database
+        if os.path.islink(path) and os.path.isdir(path):
+            self._reconcile.update([ item.id for item in self._items_for_path(path, is_dir=True) ])
+        elif not os.path.lexists(path):
+            self._touch(path, is_dir=True)
+
+    def _disk_item(self, path):
+        try:
+            s = os.lstat(path)
+            if stat.S_ISLNK(s.st_mode):
+                if self._symlinks == SYMLINKS_IGNORE:
+                    return None
+                s = os.stat(path)
+        except OSError:
+            return None
+        return FileWatchItemFromDisk(path, s) if stat.S_ISREG(s.st_mode) else None
+
+    def _compare_paths(self, paths, db_items):
+        for path in paths:
+            disk_item = self._disk_item(path)
+            db_item = db_items.get(path)
+            if disk_item is not None and db_item is None:
+                yield (FILE_ADDED, disk_item, None, [ADDED_CHANGE])
+            elif disk_item is None and db_item is not None:
+                yield (FILE_DELETED, None, db_item, [DELETED_CHANGE])
+            elif disk_item is not None:
+                changes = get_changes(disk_item, db_item)
+                yield (FILE_CHANGED if changes else FILE_UNCHANGED, disk_item, db_item, changes)
+
+    def _update_item(self, item, paths, dirs):
+        if not lock_item(item, self._name):
+            # a check is running, so try again after it
+            self._touched.setdefault(item.id, set()).update(paths)
+            self._touched_dirs.setdefault(item.id, set()).update(dirs)
+            if self._first_event is None:
+                self._first_event = time.time()
+            self._last_event = time.time()
+            return
+        try:
+            self._update_locked_item(item, paths, dirs)
+        except Exception:
+            # the changes are rolled back, so the item is checked completely
+            logger.exception('Unable to update the files of %s' % item.filename)
+            self._reconcile.add(item.id)
+        finally:
+            unlock_item(item, self._name)
+
+    def _update_locked_item(self, item, paths, dirs):
+        started = time.time()
+        result_item = self._notifications.get(item.id)
+        if result_item is None:
+            result_item = CheckItemHandler.ResultItem(item)
+        # a check may have changed the entries since the item was loaded
+        item.revision = FileWatchModel.objects.filter(pk=item.pk).values_list('revision', flat=True)[0]
+        db_items = {}
+        paths = sorted(paths)
+        chunk_size = settings.CHECK_BULK_CHUNK_SIZE
+        for i in range(0, len(paths), chunk_size):
+            for db_item in FileWatchItemModel.objects.filter(watchid=item, filename__in=paths[i:i + chunk_size]):
+                db_items[db_item.filename] = db_item
+        for dirname in dirs:
+            for db_item in FileWatchItemModel.objects.filter(watchid=item, filename__startswith=os.path.join(dirname, '')):
+                if self._included(item, db_item.filename):
+                    db_items[db_item.filename] = db_item
+                    paths.append(db_item.filename)
+        results = self._compare_paths(sorted(set(paths)), db_items)
+        if item.checksum:
+            try:
+                results = FileHasher(item.checksum, settings.CHECK_HASH_WORKERS).process(results)
+            except ValueError:
+                logger.error('Checksum algorithm %s of %s not supported' % (item.checksum, item.filename))
+        if settings.CHECK_DETECT_MOVES:
+            # a rename shows up as events for the old and the new name
+            results = detect_moves(results, settings.CHECK_MOVE_MAX_PENDING)
+        baseline = open_baseline(item) if settings.CHECK_BASELINE else None
+        writer = FileWatchItemWriter(item, run_id=new_run_id() if settings.EVENT_LOG else None)
+        counter = StatusCounter()
+        changed_list = []
+        try:
+            for (state, disk_item, db_item, changes) in results:
+                counter.add(state, disk_item, db_item, changes)
+                if state == FILE_ADDED:
+                    writer.insert(disk_item, changes)
+                    changed_list.append( (disk_item.filename, changes) )
+                    self._write('watch: %s: file %s added' % (item.filename, disk_item.filename))
+                elif state == FILE_DELETED:
+                    writer.delete(db_item, changes)
+                    changed_list.append( (db_item.filename, changes) )
+                    self._write('watch: %s: file %s deleted' % (item.filename, db_item.filename))
+                elif state == FILE_CHANGED:
+                    writer.update(db_item, changes)
+                    changed_list.append( (db_item.filename, changes) )
+                    self._write('watch: %s: file %s changed' % (item.filename, db_item.filename))
+                elif state == FILE_MOVED:
+                    old_filename = db_item.filename
+                    writer.move(db_item, disk_item, changes)
+                    changed_list.append( (disk_item.filename, changes) )
+                    self._write('watch: %s: file %s moved to %s' % (item.filename, old_filename, disk_item.filename))
+                elif state == FILE_UPDATED:
+                    writer.update(db_item)
+        except BaseException:
+            writer.close(sys.exc_info())
+            if baseline is not None:
+                baseline.close()
+            raise
+        writer.close()
+        if settings.CHECK_BASELINE:
+            # the changed entries are merged into the baseline, so the next
+            # check does not need to rebuild it from the database
+            try:
+                update_baseline(item, baseline, writer)
+            finally:
+                if baseline is not None:
+                    baseline.close()
+        save_status(item, timezone.now(), time.time() - started, counter, False)
+        for entry in changed_list:
+            result_item.changed_list.append(entry)
+        if result_item.changed_list:
+            self._notifications[item.id] = result_item
+
+    def _process_events(self):
+        close_old_connections()
+        touched, self._touched = self._touched, {}
+        touched_dirs, self._touched_dirs = self._touched_dirs, {}
+        for item in self._item_list:
+            if item.id in self._reconcile:
+                # checked completely anyway
+                continue
+            paths = touched.get(item.id, set())
+            dirs = touched_dirs.get(item.id, set())
+            if paths or dirs:
+                self._update_item(item, paths, dirs)
+
+    def _process_reconcile(self):
+        close_old_connections()
+        reconcile, self._reconcile = self._reconcile, set()
+        for item in self._item_list:
+            if item.id in reconcile:
+                if not lock_item(item, self._name):
+                    # checked by a job right now, try again later
+                    self._reconcile.add(item.id)
+                    continue
+                try:
+                    for line in CheckItemHandler(item_id=item.id, notify=self._notify):
+                        self._write(line)
+                except Exception:
+                    logger.exception('Check of %s failed' % item.filename)
+                finally:
+                    unlock_item(item, self._name)
+
+    def _send_notifications(self):
+        result_items, self._notifications = list(self._notifications.values()), {}
+        self._last_notify = time.time()
+        if not self._notify:
+            return
+        for line in send_email_notifications(result_items):
+            self._write(line)
+
+    def run(self):
+        self._setup()
+        self._process_reconcile()
+        try:
+            while True:
+                pending = self._touched or self._touched_dirs
+                events = self._inotify.read_events(settings.WATCH_COALESCE_DELAY if pending else 1.0)
+                now = time.time()
+                for event in events:
+                    self._handle_event(event)
+                # the files of a root which is watched again are handled
+                # like those of an event
+                rewatched = self._rewatch_roots() if self._lost_roots else False
+                if events or rewatched:
+                    if self._first_event is None:
+                        self._first_event = now
+                    self._last_event = now
+                if self._first_event is not None and \
+                    (now - self._last_event >= settings.WATCH_COALESCE_DELAY or now - self._first_event >= settings.WATCH_MAX_DELAY):
+                    self._first_event = None
+                    self._process_events()
+                if self._reconcile:
+                    for item_id in self._reconcile:
+                        self._touched.pop(item_id, None)
+                        self._touched_dirs.pop(item_id, None)
+                    self._process_reconcile()
+                if self._notifications and now - self._last_notify >= settings.WATCH_NOTIFY_INTERVAL:
+                    self._send_notifications()
+        finally:
+            self._inotify.close()
@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+#
+# Runs CheckItemHandler end to end on a synthetic tree against a temporary
+# SQLite database: the first check adds all files, the second finds them
+# unchanged and the third one runs after a fraction of the files has been
+# mutated. For every check and stage the wall time, the peak RSS and the
+# number of database queries are reported. The results can be written as
+# JSON, so runs can be compared:
+#
+#   python3 benchmarks/bench_check.py --files 100000 --output before.json
+#   python3 benchmarks/bench_check.py --files 100000 --setting CHECK_SCAN_WORKERS=1 --compare before.json
+#
+# The settings default to those in arsoft/web/filewatch/settings.py.
+
+import sys
+import os
+import ast
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import resource
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthtree import create_tree, mutate_tree
+
+_SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'arsoft', 'web', 'filewatch', 'settings.py')
+
+def _default_settings():
+    # the settings module needs the arsoft.web framework, so only take the
+    # constants defined by plain expressions from it
+    with open(_SETTINGS_FILE) as f:
+        tree = ast.parse(f.read())
+    ret = {}
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+            continue
+        name = node.targets[0].id
+        if not name.isupper() or name in ('DATABASES', 'SITE_ID', 'EMAIL_BACKEND'):
+            continue
+        try:
+            ret[name] = eval(compile(ast.Expression(node.value), _SETTINGS_FILE, 'eval'), {'__builtins__': {}})
+        except Exception:
+            pass
+    return ret
+
+def _configure(tmpdir, overrides):
+    from django.conf import settings
+    values = _default_settings()
+    values.update(overrides)
+    values.update(
+        SECRET_KEY='bench',
+        USE_TZ=True,
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'arsoft.web.filewatch'],
+        DATABASES={ 'default': { 'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(tmpdir, 'filewatch.db') } },
+        EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        JOB_LOG_DIR=os.path.join(tmpdir, 'jobs'),
+        METRICS_FILE=os.path.join(tmpdir, 'metrics.json'),
+        CHECK_BASELINE_DIR=os.path.join(tmpdir, 'baseline'),
+        )
+    settings.configure(**values)
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0, interactive=False)
+    return values
+
+class _QueryCounter(object):
+    # replaces the query log of the connection, so all queries are counted
+    # without keeping them
+    maxlen = None
+
+    def __init__(self):
+        self.count = 0
+
+    def append(self, query):
+        self.count += 1
+
+    def clear(self):
+        pass
+
+def _reset_peak_rss():
+    # Linux allows resetting the peak RSS, so it can be measured per stage
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+def _peak_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _run_check(phase, item, counter, **kwargs):
+    from arsoft.web.filewatch.views import CheckItemHandler
+    from arsoft.web.filewatch.metrics import timed
+    handler = CheckItemHandler(item_id=item.id, notify=False, **kwargs)
+    stages = []
+    start = time.time()
+    # the same loop as CheckItemHandler.__iter__, but measuring each stage
+    for func in handler._handler_list:
+        stage = func.__name__.lstrip('_')
+        _reset_peak_rss()
+        queries = counter.count
+        stage_time = [ 0.0 ]
+        def add(seconds):
+            stage_time[0] += seconds
+        num_lines = 0
+        for line in timed(func(), add):
+            num_lines += 1
+        stages.append( { 'stage': stage, 'seconds': round(stage_time[0], 6), 'peak_rss_kb': _peak_rss_kb(),
+                         'queries': counter.count - queries, 'lines': num_lines } )
+    wall = time.time() - start
+    roots = [ root_metrics.as_dict() for root_metrics in handler.metrics.roots.values() ]
+    return { 'phase': phase, 'wall_seconds': round(wall, 6), 'queries': sum([ s['queries'] for s in stages ]),
+             'peak_rss_kb': max([ s['peak_rss_kb'] for s in stages ]), 'stages': stages, 'roots': roots }
+
+def _print_results(results):
+    print('%-12s %-26s %10s %12s %10s' % ('check', 'stage', 'time [s]', 'peak RSS [MB]', 'queries'))
+    for run in results['runs']:
+        for stage in run['stages']:
+            print('%-12s %-26s %10.3f %12.1f %10i' % (run['phase'], stage['stage'], stage['seconds'], stage['peak_rss_kb'] / 1024.0, stage['queries']))
+        print('%-12s %-26s %10.3f %12.1f %10i' % (run['phase'], 'total', run['wall_seconds'], run['peak_rss_kb'] / 1024.0, run['queries']))
+
+def _print_comparison(results, baseline):
+    print('%-12s %-26s %10s %10s %8s %10s %10s' % ('check', 'stage', 'base [s]', 'time [s]', 'change', 'base q', 'queries'))
+    base_runs = dict([ (run['phase'], run) for run in baseline['runs'] ])
+    for run in results['runs']:
+        base_run = base_runs.get(run['phase'])
+        if base_run is None:
+            continue
+        base_stages = dict([ (stage['stage'], stage) for stage in base_run['stages'] ])
+        rows = [ (stage, base_stages.get(stage['stage'])) for stage in run['stages'] ]
+        rows.append( ({ 'stage': 'total', 'seconds': run['wall_seconds'], 'queries': run['queries'] },
+                      { 'stage': 'total', 'seconds': base_run['wall_seconds'], 'queries': base_run['queries'] }) )
+        for (stage, base_stage) in rows:
+            if base_stage is None:
+                continue
+            change = (stage['seconds'] / base_stage['seconds'] - 1.0) * 100.0 if base_stage['seconds'] > 0 else 0.0
+            print('%-12s %-26s %10.3f %10.3f %+7.1f%% %10i %10i' % (run['phase'], stage['stage'], base_stage['seconds'],
+                  stage['seconds'], change, base_stage['queries'], stage['queries']))
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark a complete check on a synthetic tree')
+    parser.add_argument('--files', type=int, default=10000, help='number of files in the synthetic tree')
+    parser.add_argument('--depth', type=int, default=3, help='number of directory levels below the root')
+    parser.add_argument('--fanout', type=int, default=8, help='number of subdirectories per directory')
+    parser.add_argument('--file-size', type=int, default=0, help='average size of the files in bytes')
+    parser.add_argument('--mutate', type=float, default=0.01, help='fraction of the files mutated before the last check')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the tree and the mutations')
+    parser.add_argument('--checksum', default='', help='checksum algorithm of the watch item')
+    parser.add_argument('--incremental', action='store_true', help='run the checks incrementally')
+    parser.add_argument('--setting', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a setting (the value is a Python literal)')
+    parser.add_argument('--dir', default=None, help='directory for the synthetic tree and the database')
+    parser.add_argument('--output', default=None, help='write the results as JSON to this file')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--compare', default=None, help='compare the results with those of an earlier run (JSON file)')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic tree and the database')
+    args = parser.parse_args()
+
+    overrides = {}
+    for setting in args.setting:
+        (name, sep, value) = setting.partition('=')
+        if not sep:
+            parser.error('invalid setting %s' % setting)
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value
+
+    tmpdir = tempfile.mkdtemp(prefix='filewatch-bench-', dir=args.dir)
+    root = os.path.join(tmpdir, 'tree')
+    try:
+        values = _configure(tmpdir, overrides)
+        from django.db import connection
+        from arsoft.web.filewatch.models import FileWatchModel
+
+        start = time.time()
+        directories = create_tree(root, args.files, args.depth, args.fanout, args.file_size, args.seed)
+        create_time = time.time() - start
+        item = FileWatchModel.objects.create(filename=root, recursive=True, notify='root@localhost', checksum=args.checksum)
+
+        counter = _QueryCounter()
+        connection.ensure_connection()
+        connection.queries_log = counter
+        connection.force_debug_cursor = True
+
+        runs = []
+        runs.append(_run_check('initial', item, counter, incremental=args.incremental))
+        runs.append(_run_check('unchanged', item, counter, incremental=args.incremental))
+        mutations = mutate_tree(root, args.mutate, args.seed)
+        runs.append(_run_check('mutated', item, counter, incremental=args.incremental))
+
+        results = {
+            'benchmark': 'check',
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': {
+                'files': args.files, 'depth': args.depth, 'fanout': args.fanout, 'file_size': args.file_size,
+                'directories': len(directories), 'mutate': args.mutate, 'seed': args.seed,
+                'checksum': args.checksum, 'incremental': args.incremental,
+                },
+            'settings': dict([ (name, values[name]) for name in sorted(values) if name.startswith('CHECK_') ]),
+            'create_seconds': round(create_time, 6),
+            'mutations': mutations,
+            'runs': runs,
+            }
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if args.json:
+            json.dump(results, sys.stdout, indent=2, sort_keys=True)
+            sys.stdout.write('\n')
+        else:
+            print('created %i files in %i directories in %.1fs' % (args.files, len(directories), create_time))
+            if args.compare:
+                with open(args.compare) as f:
+                    _print_comparison(results, json.load(f))
+            else:
+                _print_results(results)
+    finally:
+        if args.keep:
+            print('synthetic tree and database kept in %s' % tmpdir)
+        else:
+            shutil.rmtree(tmpdir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
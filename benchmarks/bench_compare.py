@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+#
+# Measures how the comparison of files on disk against the database entries
+# scales with the number of files. The old nested loop implementation is
+# only run up to --legacy-max files, because it is quadratic.
+#
+#   python3 benchmarks/bench_compare.py --sizes 1000,10000,100000,1000000
+
+import sys
+import os
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from arsoft.web.filewatch.compare import merge_files
+from arsoft.web.filewatch.scan import FileWatchItemFromDisk
+
+_EPOCH_SECONDS = 1600000000
+
+class _DbItem(object):
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.ctime_ns = _EPOCH_SECONDS * 1000000000
+        self.mtime_ns = self.ctime_ns
+        self.uid = 0
+        self.gid = 0
+        self.mode = 0o100644
+        self.size = size
+
+def _DiskItem(filename, size):
+    return FileWatchItemFromDisk.from_values(filename, _EPOCH_SECONDS * 1000000000, _EPOCH_SECONDS * 1000000000,
+                                             0, 0, 0o100644, size)
+
+def _make_items(num, changed_fraction, added_fraction):
+    files_in_db = []
+    files_on_disk = []
+    num_changed = int(num * changed_fraction)
+    num_added = int(num * added_fraction)
+    for i in range(num):
+        filename = '/srv/data/%03i/file%08i' % (i % 997, i)
+        files_in_db.append(_DbItem(filename, 10))
+        if i < num_added:
+            # replaced by a new file, so one is deleted and one added
+            filename = filename + '.new'
+        files_on_disk.append(_DiskItem(filename, 20 if i % max(1, num // max(1, num_changed)) == 0 and num_changed else 10))
+    return files_on_disk, files_in_db
+
+def _legacy_compare(files_on_disk, files_in_db):
+    missing_files_from_db = list(files_in_db)
+    for disk_item in files_on_disk:
+        found = False
+        for db_item in files_in_db:
+            if db_item.filename == disk_item.filename:
+                found = True
+                break
+        if found:
+            missing_files_from_db.remove(db_item)
+    return missing_files_from_db
+
+def _run(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+def _consume_merge(files_on_disk, files_in_db):
+    for _ in merge_files(files_on_disk, files_in_db):
+        pass
+
+def _sorted(items):
+    return sorted(items, key=lambda x: x.filename)
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the file comparison')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000', help='comma separated list of file counts')
+    parser.add_argument('--legacy-max', type=int, default=10000, help='largest file count for the nested loop')
+    parser.add_argument('--changed', type=float, default=0.01, help='fraction of changed files')
+    parser.add_argument('--added', type=float, default=0.01, help='fraction of added/deleted files')
+    args = parser.parse_args()
+
+    print('%10s %12s %12s %14s' % ('files', 'merge [s]', 'legacy [s]', 'files/s'))
+    for num in [int(x) for x in args.sizes.split(',')]:
+        # the merge expects both sides sorted, like the walker and the database return them
+        files_on_disk, files_in_db = _make_items(num, args.changed, args.added)
+        merge = _run(_consume_merge, _sorted(files_on_disk), _sorted(files_in_db))
+        # merge_files applies the changes to the db items, so recreate them
+        files_on_disk, files_in_db = _make_items(num, args.changed, args.added)
+        if num <= args.legacy_max:
+            legacy = '%12.3f' % _run(_legacy_compare, files_on_disk, files_in_db)
+        else:
+            legacy = '%12s' % '-'
+        print('%10i %12.3f %s %14.0f' % (num, merge, legacy, num / merge if merge else 0))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
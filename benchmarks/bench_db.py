@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+#
+# Measures the queries of a check against the file table with the former
+# schema (unique filename, datetime columns) and the current one (unique
+# watch item and filename, timestamps in nanoseconds) using SQLite
+# directly. The files are spread over a number of watch items and only
+# the files of one item are read.
+#
+#   python3 benchmarks/bench_db.py --files 1000000 --items 10
+
+import sys
+import os
+import time
+import random
+import argparse
+import sqlite3
+import tempfile
+
+_SCHEMAS = {
+    'former': [
+        'CREATE TABLE item ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "filename" varchar(512) NOT NULL UNIQUE, '
+        '"created" datetime NOT NULL, "modified" datetime NOT NULL, "uid" integer NOT NULL, "gid" integer NOT NULL, '
+        '"mode" integer NOT NULL, "size" integer NOT NULL, "watchid_id" integer NOT NULL)',
+        'CREATE INDEX item_watchid ON item ("watchid_id")',
+        ],
+    'current': [
+        'CREATE TABLE item ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "filename" varchar(512) NOT NULL, '
+        '"ctime_ns" bigint NOT NULL, "mtime_ns" bigint NOT NULL, "uid" integer NOT NULL, "gid" integer NOT NULL, '
+        '"mode" integer NOT NULL, "size" integer NOT NULL, "watchid_id" integer NOT NULL, UNIQUE ("watchid_id", "filename"))',
+        'CREATE INDEX item_watchid ON item ("watchid_id")',
+        ],
+    }
+
+_KEYSET_QUERY = 'SELECT * FROM item WHERE watchid_id = ? AND filename > ? ORDER BY filename LIMIT ?'
+_LOOKUP_QUERY = 'SELECT * FROM item WHERE watchid_id = ? AND filename IN (%s)'
+
+def _filename(item, i):
+    return '/srv/item%02i/%03i/file%08i' % (item, i % 997, i)
+
+def _create(path, schema, num_files, num_items):
+    conn = sqlite3.connect(path)
+    for sql in _SCHEMAS[schema]:
+        conn.execute(sql)
+    rows = []
+    for i in range(num_files):
+        item = i % num_items
+        if schema == 'former':
+            times = ('2020-09-13 12:26:40.123456', '2020-09-13 12:26:40.123456')
+        else:
+            times = (1600000000123456789, 1600000000123456789)
+        rows.append( (_filename(item, i),) + times + (0, 0, 0o100644, 10, item) )
+    conn.executemany('INSERT INTO item (filename, %s, uid, gid, mode, size, watchid_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)' %
+                     ('created, modified' if schema == 'former' else 'ctime_ns, mtime_ns'), rows)
+    conn.commit()
+    conn.execute('ANALYZE')
+    return conn
+
+def _keyset(conn, item, batch_size):
+    num = 0
+    last = ''
+    while True:
+        batch = conn.execute(_KEYSET_QUERY, (item, last, batch_size)).fetchall()
+        num += len(batch)
+        if len(batch) < batch_size:
+            break
+        last = batch[-1][1]
+    return num
+
+def _lookup(conn, item, filenames, chunk_size):
+    num = 0
+    for i in range(0, len(filenames), chunk_size):
+        chunk = filenames[i:i + chunk_size]
+        num += len(conn.execute(_LOOKUP_QUERY % ','.join('?' * len(chunk)), [item] + chunk).fetchall())
+    return num
+
+def _plan(conn, sql, args):
+    return '; '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, args))
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the queries of the file table')
+    parser.add_argument('--files', type=int, default=1000000, help='number of files in the table')
+    parser.add_argument('--items', type=int, default=10, help='number of watch items')
+    parser.add_argument('--batch-size', type=int, default=2000, help='number of rows per keyset query')
+    parser.add_argument('--lookups', type=int, default=10000, help='number of files looked up by name')
+    args = parser.parse_args()
+
+    item = args.items // 2
+    filenames = [ _filename(item, i) for i in random.sample(range(item, args.files, args.items), min(args.lookups, args.files // args.items)) ]
+    tmpdir = tempfile.mkdtemp()
+    print('%-8s %12s %12s %12s' % ('schema', 'size [MB]', 'keyset [s]', 'lookup [s]'))
+    plans = []
+    for schema in ['former', 'current']:
+        path = os.path.join(tmpdir, schema + '.db')
+        conn = _create(path, schema, args.files, args.items)
+        start = time.time()
+        _keyset(conn, item, args.batch_size)
+        keyset = time.time() - start
+        start = time.time()
+        _lookup(conn, item, filenames, 500)
+        lookup = time.time() - start
+        print('%-8s %12.1f %12.3f %12.3f' % (schema, os.path.getsize(path) / 1048576.0, keyset, lookup))
+        plans.append( (schema, _plan(conn, _KEYSET_QUERY, (item, '', args.batch_size)), _plan(conn, _LOOKUP_QUERY % '?', (item, filenames[0]))) )
+        conn.close()
+        os.unlink(path)
+    os.rmdir(tmpdir)
+    for (schema, keyset_plan, lookup_plan) in plans:
+        print('%s keyset: %s' % (schema, keyset_plan))
+        print('%s lookup: %s' % (schema, lookup_plan))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+#
+# Measures the memory used for the scan results of a number of files: the
+# former object with a __dict__ and two datetimes, the __slots__ based
+# FileWatchItemFromDisk and the columnar FileWatchItemBatch.
+#
+#   python3 benchmarks/bench_memory.py --files 1000000
+
+import sys
+import os
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from arsoft.timestamp import utc_timestamp_to_datetime
+from arsoft.web.filewatch.scan import FileWatchItemFromDisk, FileWatchItemBatch
+
+class _LegacyFileWatchItemFromDisk(object):
+    def __init__(self, filename, file_stats):
+        self.filename = filename
+        self.created = utc_timestamp_to_datetime(file_stats.st_ctime)
+        self.modified = utc_timestamp_to_datetime(file_stats.st_mtime)
+        self.uid = file_stats.st_uid
+        self.gid = file_stats.st_gid
+        self.mode = file_stats.st_mode
+        self.size = file_stats.st_size
+
+def _filenames(num):
+    return [ '/srv/data/%03i/file%08i' % (i % 997, i) for i in range(num) ]
+
+def _measure(name, num, func):
+    filenames = _filenames(num)
+    tracemalloc.start()
+    start = time.time()
+    result = func(filenames)
+    elapsed = time.time() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-10s %10i %12.1f %12.1f %10.2f' % (name, num, current / 1048576.0, current / float(num), elapsed))
+    del result
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the memory of the scan results')
+    parser.add_argument('--files', type=int, default=1000000, help='number of files')
+    args = parser.parse_args()
+
+    # the filenames are allocated before the measurement, so only the
+    # memory of the records is counted
+    file_stats = os.stat(__file__)
+    print('%-10s %10s %12s %12s %10s' % ('records', 'files', 'memory [MB]', 'bytes/file', 'time [s]'))
+    _measure('legacy', args.files, lambda filenames: [ _LegacyFileWatchItemFromDisk(f, file_stats) for f in filenames ])
+    _measure('slots', args.files, lambda filenames: [ FileWatchItemFromDisk(f, file_stats) for f in filenames ])
+    _measure('batch', args.files, lambda filenames: FileWatchItemBatch(FileWatchItemFromDisk(f, file_stats) for f in filenames))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
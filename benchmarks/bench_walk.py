@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+#
+# Compares the os.scandir based FileWalker against the former recursive
+# os.listdir/os.stat implementation on a synthetic directory tree.
+#
+#   python3 benchmarks/bench_walk.py --files 1000000 --fanout 32
+
+import sys
+import os, stat
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from arsoft.web.filewatch.scan import FileWalker, FileWatchItemFromDisk
+
+def _legacy_get_files_recursive(filename):
+    ret = []
+    files = []
+    try:
+        files = os.listdir(filename)
+    except OSError:
+        pass
+    for f in files:
+        if f == '.' or f == '..':
+            continue
+        full = os.path.join(filename, f)
+        try:
+            s = os.stat(full)
+            if stat.S_ISDIR(s.st_mode):
+                subdir_files = _legacy_get_files_recursive(full)
+                ret.extend(subdir_files)
+            elif stat.S_ISREG(s.st_mode):
+                ret.append( FileWatchItemFromDisk(full, s) )
+        except FileNotFoundError:
+            pass
+    return ret
+
+def create_tree(root, num_files, fanout):
+    """
+    Creates num_files empty files below root, spread over directories with
+    at most fanout entries each.
+    """
+    for i in range(num_files):
+        parts = []
+        n = i // fanout
+        while n:
+            parts.append('d%02i' % (n % fanout))
+            n //= fanout
+        dirname = os.path.join(root, *reversed(parts)) if parts else root
+        if i % fanout == 0:
+            os.makedirs(dirname, exist_ok=True)
+        open(os.path.join(dirname, 'f%02i' % (i % fanout)), 'w').close()
+
+def _measure(func):
+    start = time.time()
+    num = func()
+    return time.time() - start, num
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the directory walker')
+    parser.add_argument('--files', type=int, default=100000, help='number of files in the synthetic tree')
+    parser.add_argument('--fanout', type=int, default=32, help='number of entries per directory')
+    parser.add_argument('--dir', default=None, help='directory for the synthetic tree')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic tree')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='filewatch-bench-', dir=args.dir)
+    try:
+        start = time.time()
+        create_tree(root, args.files, args.fanout)
+        print('created %i files in %.1fs' % (args.files, time.time() - start))
+
+        # warm up the dentry/inode cache, so both runs see the same state
+        _legacy_get_files_recursive(root)
+
+        legacy, legacy_num = _measure(lambda: len(_legacy_get_files_recursive(root)))
+        walker = FileWalker()
+        walk, walk_num = _measure(lambda: sum(1 for _ in walker.walk(root)))
+        print('%-10s %10s %10s %12s' % ('walker', 'files', 'time [s]', 'files/s'))
+        print('%-10s %10i %10.2f %12.0f' % ('legacy', legacy_num, legacy, legacy_num / legacy))
+        print('%-10s %10i %10.2f %12.0f' % ('scandir', walk_num, walk, walk_num / walk))
+    finally:
+        if args.keep:
+            print('synthetic tree kept in %s' % root)
+        else:
+            shutil.rmtree(root)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
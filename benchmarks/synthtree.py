@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; mixedindent off; indent-mode python;
+#
+# Generates reproducible synthetic directory trees for the benchmarks and
+# mutates a fraction of their files. The same parameters and seed always
+# give the same tree and the same mutations.
+#
+#   python3 benchmarks/synthtree.py create /tmp/tree --files 100000 --depth 3 --fanout 8
+#   python3 benchmarks/synthtree.py mutate /tmp/tree --fraction 0.01
+
+import sys
+import os
+import time
+import random
+import argparse
+
+MUTATE_MODIFY = 'modify'
+MUTATE_CHMOD = 'chmod'
+MUTATE_DELETE = 'delete'
+MUTATE_ADD = 'add'
+MUTATE_KINDS = [ MUTATE_MODIFY, MUTATE_CHMOD, MUTATE_DELETE, MUTATE_ADD ]
+
+# all files get the same timestamps, so the tree does not depend on the
+# time it was created
+_BASE_TIME = 1600000000
+
+def _directories(root, depth, fanout):
+    ret = [ root ]
+    level = [ root ]
+    for n in range(depth):
+        level = [ os.path.join(parent, 'd%02i' % i) for parent in level for i in range(fanout) ]
+        ret.extend(level)
+    return ret
+
+def create_tree(root, num_files, depth=3, fanout=8, file_size=0, seed=0):
+    """
+    Creates num_files files below root in a tree of directories with depth
+    levels and fanout subdirectories each. The files are spread evenly over
+    all directories; their size varies around file_size bytes. Returns the
+    list of directories.
+    """
+    rnd = random.Random(seed)
+    directories = _directories(root, depth, fanout)
+    for dirname in directories:
+        os.makedirs(dirname, exist_ok=True)
+    for i in range(num_files):
+        filename = os.path.join(directories[i % len(directories)], 'f%08i' % i)
+        size = rnd.randint(file_size // 2, file_size + file_size // 2) if file_size else 0
+        with open(filename, 'wb') as f:
+            if size:
+                f.write(rnd.getrandbits(size * 8).to_bytes(size, 'little'))
+        os.utime(filename, (_BASE_TIME, _BASE_TIME))
+    return directories
+
+def list_files(root):
+    ret = []
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        dirnames.sort()
+        ret.extend(os.path.join(dirpath, filename) for filename in sorted(filenames))
+    return ret
+
+def mutate_tree(root, fraction, seed=0, kinds=MUTATE_KINDS):
+    """
+    Changes the given fraction of the files below root. The selected files
+    are modified, get a new mode, are deleted or get a new sibling in turn
+    (by default). Returns a dict of the number of mutations by kind.
+    """
+    rnd = random.Random(seed)
+    files = list_files(root)
+    selected = rnd.sample(files, int(round(len(files) * fraction)))
+    ret = dict([ (kind, 0) for kind in kinds ])
+    # the changed files must differ in their modification time, even on
+    # file systems with a coarse resolution
+    now = time.time()
+    for (i, filename) in enumerate(sorted(selected)):
+        kind = kinds[i % len(kinds)]
+        if kind == MUTATE_MODIFY:
+            with open(filename, 'ab') as f:
+                f.write(b'mutated\n')
+            os.utime(filename, (now, now))
+        elif kind == MUTATE_CHMOD:
+            os.chmod(filename, 0o600)
+        elif kind == MUTATE_DELETE:
+            os.unlink(filename)
+        elif kind == MUTATE_ADD:
+            with open(filename + '.new', 'wb') as f:
+                f.write(b'added\n')
+        ret[kind] += 1
+    return ret
+
+def main():
+    parser = argparse.ArgumentParser(description='create or mutate a synthetic directory tree')
+    parser.add_argument('command', choices=['create', 'mutate'], help='create a new tree or mutate an existing one')
+    parser.add_argument('root', help='root directory of the tree')
+    parser.add_argument('--files', type=int, default=10000, help='number of files')
+    parser.add_argument('--depth', type=int, default=3, help='number of directory levels below the root')
+    parser.add_argument('--fanout', type=int, default=8, help='number of subdirectories per directory')
+    parser.add_argument('--file-size', type=int, default=0, help='average size of the files in bytes')
+    parser.add_argument('--fraction', type=float, default=0.01, help='fraction of the files to mutate')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.command == 'create':
+        directories = create_tree(args.root, args.files, args.depth, args.fanout, args.file_size, args.seed)
+        print('created %i files in %i directories in %.1fs' % (args.files, len(directories), time.time() - start))
+    else:
+        mutations = mutate_tree(args.root, args.fraction, args.seed)
+        print('mutated %s in %.1fs' % (', '.join([ '%i (%s)' % (mutations[kind], kind) for kind in MUTATE_KINDS ]), time.time() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,11 +9,12 @@ setup(name='arsoft-web-filewatch',
 		author='Andreas Roth',
 		author_email='aroth@arsoft-online.com',
 		url='http://www.arsoft-online.com/',
-		packages=['arsoft.web.filewatch'],
-		scripts=[],
+		packages=['arsoft.web.filewatch', 'arsoft.web.filewatch.migrations',
+                  'arsoft.web.filewatch.management', 'arsoft.web.filewatch.management.commands'],
+		scripts=['arsoft-filewatch-agent'],
 		data_files=[
             ('/etc/arsoft/web/filewatch/static', ['arsoft/web/filewatch/static/main.css']),
-            ('/etc/arsoft/web/filewatch/templates', ['arsoft/web/filewatch/templates/home.html']),
+            ('/etc/arsoft/web/filewatch/templates', ['arsoft/web/filewatch/templates/home.html', 'arsoft/web/filewatch/templates/files.html']),
             ('/usr/lib/arsoft-web-filewatch', ['manage.py']),
             ]
 		)